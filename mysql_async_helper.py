@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+
+# Builtin Modules
+import re
+import time
+import asyncio
+import traceback
+
+# 3rd-party Modules
+try:
+    import aiomysql
+except ImportError:
+    aiomysql = None
+
+from mysql_helper import STREAM_FETCH_SIZE, format_sql, get_row_size
+
+def get_async_config(c, max_connections=None):
+    _charset = c.get('charset') or 'utf8mb4'
+
+    config = {
+        'host'    : c.get('host') or '127.0.0.1',
+        'port'    : int(c.get('port') or 3306),
+        'user'    : c.get('user'),
+        'password': c.get('password') or '',
+        'db'      : c.get('database'),
+
+        'cursorclass' : aiomysql.DictCursor,
+        'charset'     : _charset,
+        'init_command': 'SET NAMES "{0}"'.format(_charset),
+        'minsize'     : 0,
+        'maxsize'     : max_connections or 2,
+        'autocommit'  : False,
+    }
+    return config
+
+class AsyncMySQLHelper(object):
+    '''
+    基于 asyncio（aiomysql）的`MySQLHelper`，接口一致，所有查询方法均为协程
+    单个事件循环中可同时对大量数据库执行查询，无需为每个连接创建线程
+    连接池在首次查询时创建，使用完毕后需调用`await db.close()`
+
+    需要安装 aiomysql：
+        pip install aiomysql
+    '''
+    # 性能统计，与`MySQLHelper.profiler`一致
+    profiler = None
+
+    def __init__(self, config, max_connections=None, profiler=None, *args, **kwargs):
+        if aiomysql is None:
+            raise Exception('AsyncMySQLHelper requires aiomysql, please install it by `pip install aiomysql`')
+
+        self.skip_log = True
+
+        self.config          = config
+        self.max_connections = max_connections or 2
+        self.client          = None
+
+        self._client_lock = asyncio.Lock()
+
+        if profiler:
+            self.profiler = profiler
+
+    async def _get_client(self):
+        if self.client is None:
+            async with self._client_lock:
+                if self.client is None:
+                    self.client = await aiomysql.create_pool(**get_async_config(self.config, self.max_connections))
+
+        return self.client
+
+    async def _get_connection(self):
+        '''
+        从连接池获取连接，返回 (<连接>, <等待时间>)
+        '''
+        start_time = time.time()
+        client = await self._get_client()
+        conn = await client.acquire()
+        return conn, time.time() - start_time
+
+    async def _release_connection(self, conn):
+        await self.client.release(conn)
+
+    def _record_query(self, formatted_sql, start_time, rows, pool_wait=0.0):
+        if not self.profiler:
+            return
+
+        latency = time.time() - start_time
+        size    = sum(get_row_size(r) for r in rows)
+
+        self.profiler.record_query(formatted_sql, latency, len(rows), size, pool_wait)
+
+    async def close(self):
+        if self.client is None:
+            return
+
+        self.client.close()
+        await self.client.wait_closed()
+        self.client = None
+
+    async def check(self):
+        try:
+            await self.query('SELECT 1')
+
+        except Exception as e:
+            for line in traceback.format_exc().splitlines():
+                print(line)
+
+            raise Exception(str(e))
+
+    async def start_trans(self):
+        if not self.skip_log:
+            print('[MYSQL] Trans START')
+
+        conn, pool_wait = await self._get_connection()
+        cur  = await conn.cursor()
+
+        trans_conn = {
+            'conn'    : conn,
+            'cur'     : cur,
+            'poolWait': pool_wait,
+        }
+
+        return trans_conn
+
+    async def commit(self, trans_conn):
+        if not trans_conn:
+            return
+
+        if not self.skip_log:
+            print('[MYSQL] Trans COMMIT')
+
+        conn = trans_conn.get('conn')
+        cur  = trans_conn.get('cur')
+
+        await conn.commit()
+
+        await cur.close()
+        await self._release_connection(conn)
+
+    async def rollback(self, trans_conn):
+        if not trans_conn:
+            return
+
+        if not self.skip_log:
+            print('[MYSQL] Trans ROLLBACK')
+
+        conn = trans_conn.get('conn')
+        cur  = trans_conn.get('cur')
+
+        await conn.rollback()
+
+        await cur.close()
+        await self._release_connection(conn)
+
+    async def _trans_execute(self, trans_conn, sql, sql_params=None):
+        formatted_sql = format_sql(sql, sql_params)
+
+        if not self.skip_log:
+            print('[MYSQL] Trans Query `{}`'.format(re.sub(r'\s+', ' ', formatted_sql, flags=re.M)))
+
+        if not trans_conn:
+            raise Exception('Transaction not started')
+
+        cur = trans_conn['cur']
+
+        start_time = time.time()
+
+        count  = await cur.execute(formatted_sql)
+        db_res = list(await cur.fetchall())
+
+        # 连接池等待时间只计入事务中的第一个查询
+        self._record_query(formatted_sql, start_time, db_res, trans_conn.pop('poolWait', 0.0))
+
+        return db_res, count
+
+    async def _execute(self, sql, sql_params=None):
+        formatted_sql = format_sql(sql, sql_params)
+
+        if not self.skip_log:
+            print('[MYSQL] Query `{}`'.format(re.sub(r'\s+', ' ', formatted_sql, flags=re.M)))
+
+        conn = None
+        cur  = None
+
+        try:
+            conn, pool_wait = await self._get_connection()
+            cur  = await conn.cursor()
+
+            start_time = time.time()
+
+            count  = await cur.execute(formatted_sql)
+            db_res = list(await cur.fetchall())
+
+            self._record_query(formatted_sql, start_time, db_res, pool_wait)
+
+        except Exception:
+            for line in traceback.format_exc().splitlines():
+                print(line)
+
+            if conn:
+                await conn.rollback()
+
+            raise
+
+        else:
+            await conn.commit()
+
+            return db_res, count
+
+        finally:
+            if cur:
+                await cur.close()
+
+            if conn:
+                await self._release_connection(conn)
+
+    async def iter_query(self, sql, sql_params=None):
+        '''
+        使用非缓冲游标（SSDictCursor）逐行返回查询结果，用法：
+            async for row in db.iter_query(sql):
+                ...
+        注意：迭代完成前，会一直占用一个连接
+        '''
+        formatted_sql = format_sql(sql, sql_params)
+
+        if not self.skip_log:
+            print('[MYSQL] Stream Query `{}`'.format(re.sub(r'\s+', ' ', formatted_sql, flags=re.M)))
+
+        conn = None
+        cur  = None
+
+        rows_count = 0
+        rows_size  = 0
+
+        try:
+            conn, pool_wait = await self._get_connection()
+            cur  = await conn.cursor(aiomysql.SSDictCursor)
+
+            start_time = time.time()
+
+            await cur.execute(formatted_sql)
+            while True:
+                rows = await cur.fetchmany(STREAM_FETCH_SIZE)
+                if not rows:
+                    break
+
+                if self.profiler:
+                    rows_count += len(rows)
+                    rows_size  += sum(get_row_size(r) for r in rows)
+
+                for row in rows:
+                    yield row
+
+        except Exception:
+            for line in traceback.format_exc().splitlines():
+                print(line)
+
+            if conn:
+                await conn.rollback()
+
+            raise
+
+        else:
+            await conn.commit()
+
+            # 耗时包含调用方处理各行的时间
+            if self.profiler:
+                self.profiler.record_query(formatted_sql, time.time() - start_time, rows_count, rows_size, pool_wait)
+
+        finally:
+            if cur:
+                await cur.close()
+
+            if conn:
+                await self._release_connection(conn)
+
+    async def trans_query(self, trans_conn, sql, sql_params=None):
+        result, count = await self._trans_execute(trans_conn, sql, sql_params)
+        return result
+
+    async def trans_non_query(self, trans_conn, sql, sql_params=None):
+        result, count = await self._trans_execute(trans_conn, sql, sql_params)
+        return count
+
+    async def query(self, sql, sql_params=None):
+        result, count = await self._execute(sql, sql_params)
+        return result
+
+    async def non_query(self, sql, sql_params=None):
+        result, count = await self._execute(sql, sql_params)
+        return count
@@ -0,0 +1,567 @@
+# -*- coding: utf-8 -*-
+
+import re
+import hashlib
+
+from functools import lru_cache
+from mysql_helper import escape_sql_param
+
+# 词法规则，`/*!50100 ... */`形式的版本注释只去除注释符号，内容正常解析
+TOKEN_RE = re.compile(r'''
+      (?P<space>\s+)
+    | (?P<comment>--[^\n]*|\#[^\n]*|/\*(?!!)[\s\S]*?\*/)
+    | (?P<version>/\*!\d*)
+    | (?P<version_end>\*/)
+    | (?P<ident>`(?:[^`]|``)*`)
+    | (?P<string>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")
+    | (?P<number>\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)
+    | (?P<word>[\w$]+)
+    | (?P<op>.)
+''', re.X)
+
+STRING_ESCAPE_RE = re.compile(r'\\(.)', re.S)
+
+# 字符串中的转义字符，其余`\x`均表示`x`本身
+STRING_UNESCAPE_MAP = {
+    '0': '\0',
+    'b': '\b',
+    'n': '\n',
+    'r': '\r',
+    't': '\t',
+    'Z': '\x1a',
+}
+
+NUMBER_RE = re.compile(r'^-?\d+(\.\d+)?$')
+
+# 缓存的语法树数量，语法树的 MD5 会保存在表的`syntaxDigest`中，无需缓存全部语法树
+SYNTAX_TREE_CACHE_SIZE = 4096
+
+# 显示宽度无意义的整数类型（MySQL 8.0 起不再输出）
+INT_TYPES = ('TINYINT', 'SMALLINT', 'MEDIUMINT', 'INT', 'INTEGER', 'BIGINT')
+
+NUMERIC_TYPES = INT_TYPES + ('DECIMAL', 'NUMERIC', 'FLOAT', 'DOUBLE', 'REAL', 'BIT')
+
+# 索引、约束定义的起始关键字
+INDEX_KEYWORDS = ('PRIMARY', 'UNIQUE', 'KEY', 'INDEX', 'FULLTEXT', 'SPATIAL', 'CONSTRAINT', 'FOREIGN', 'CHECK')
+
+# 字符集的默认排序规则（MySQL 5.7 在排序规则为默认值时不输出`COLLATE`）
+DEFAULT_COLLATIONS = {
+    'ascii'  : 'ascii_general_ci',
+    'binary' : 'binary',
+    'gbk'    : 'gbk_chinese_ci',
+    'latin1' : 'latin1_swedish_ci',
+    'utf8'   : 'utf8_general_ci',
+    'utf8mb4': 'utf8mb4_general_ci',
+}
+
+# 与不指定时等价、可忽略的表选项
+DEFAULT_TABLE_OPTIONS = {
+    'ROW_FORMAT': ('DYNAMIC', 'DEFAULT'),
+}
+
+# 不参与对比的表选项
+IGNORED_TABLE_OPTIONS = ('AUTO_INCREMENT', )
+
+def tokenize(sql):
+    '''
+    将 SQL 拆分为记号列表，忽略空白及注释
+    返回结构如下：
+        [ (<kind>, <text>), ... ]
+    其中 kind 为 ident、string、number、word、op 之一，ident 的 text 为去除反引号后的名称
+    '''
+    tokens = []
+    in_version_comment = False
+
+    for m in TOKEN_RE.finditer(sql):
+        kind = m.lastgroup
+        text = m.group()
+
+        if kind in ('space', 'comment'):
+            continue
+
+        elif kind == 'version':
+            in_version_comment = True
+            continue
+
+        elif kind == 'version_end':
+            if in_version_comment:
+                in_version_comment = False
+                continue
+
+            tokens.append(('op', '*'))
+            tokens.append(('op', '/'))
+            continue
+
+        elif kind == 'ident':
+            text = text[1:-1].replace('``', '`')
+
+        tokens.append((kind, text))
+
+    return tokens
+
+def unescape_string(text):
+    '''
+    去除字符串字面量的引号及转义，如："'it''s'" -> "it's"
+    '''
+    quote = text[0]
+    text  = text[1:-1].replace(quote * 2, quote)
+    return STRING_ESCAPE_RE.sub(lambda m: STRING_UNESCAPE_MAP.get(m.group(1), m.group(1)), text)
+
+def render_token(token):
+    '''
+    将记号转换为规范化的文本：关键字转为大写、标识符统一加反引号、字符串统一转义方式
+    '''
+    kind, text = token
+    if kind == 'word':
+        return text.upper()
+
+    elif kind == 'ident':
+        return '`{}`'.format(text.replace('`', '``'))
+
+    elif kind == 'string':
+        return escape_sql_param(unescape_string(text))
+
+    return text
+
+def is_word(token, *words):
+    return token[0] == 'word' and token[1].upper() in words
+
+def strip_db_qualifier(tokens):
+    '''
+    去除`<DB>`.前缀，如："`<DB>`.`tb_user`" -> "`tb_user`"
+    '''
+    stripped = []
+    i = 0
+    while i < len(tokens):
+        if tokens[i] == ('ident', '<DB>') and i + 1 < len(tokens) and tokens[i + 1] == ('op', '.'):
+            i += 2
+            continue
+
+        stripped.append(tokens[i])
+        i += 1
+
+    return stripped
+
+def find_closing_paren(tokens, start):
+    '''
+    查找与`start`处的左括号匹配的右括号位置，不存在时返回 -1
+    '''
+    depth = 0
+    for i in range(start, len(tokens)):
+        if tokens[i] == ('op', '('):
+            depth += 1
+        elif tokens[i] == ('op', ')'):
+            depth -= 1
+            if depth == 0:
+                return i
+
+    return -1
+
+def split_by_comma(tokens):
+    '''
+    按最外层的`,`拆分记号列表
+    '''
+    parts = [[]]
+    depth = 0
+    for token in tokens:
+        if token == ('op', '('):
+            depth += 1
+        elif token == ('op', ')'):
+            depth -= 1
+
+        if token == ('op', ',') and depth == 0:
+            parts.append([])
+        else:
+            parts[-1].append(token)
+
+    return [p for p in parts if p]
+
+def normalize_charset(charset):
+    # MySQL 8.0 中`utf8`显示为`utf8mb3`
+    charset = charset.lower()
+    if charset.startswith('utf8mb3'):
+        charset = 'utf8' + charset[len('utf8mb3'):]
+
+    return charset
+
+def get_token_value(token):
+    '''
+    获取选项值，字符串去除引号
+    '''
+    kind, text = token
+    if kind == 'string':
+        return unescape_string(text)
+
+    return text
+
+def get_charset_collation(charset, collation):
+    '''
+    补全省略的字符集、排序规则，返回 (<charset>, <collation>)
+    '''
+    if collation and not charset:
+        charset = collation.split('_')[0]
+
+    if charset and not collation:
+        collation = DEFAULT_COLLATIONS.get(charset)
+
+    return charset, collation
+
+def parse_table_options(tokens):
+    '''
+    解析表选项，如："ENGINE=InnoDB AUTO_INCREMENT=10 DEFAULT CHARSET=utf8mb4"
+    返回结构如下：
+        {
+            "<OPTION>": <str>
+        }
+    字符集、排序规则统一为`CHARSET`、`COLLATE`，并补全省略的默认值
+    '''
+    options = {}
+
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        i += 1
+
+        if is_word(token, 'DEFAULT'):
+            continue
+
+        name = render_token(token)
+        if name == 'CHARACTER' and i < len(tokens) and is_word(tokens[i], 'SET'):
+            name = 'CHARSET'
+            i += 1
+
+        if i < len(tokens) and tokens[i] == ('op', '='):
+            i += 1
+
+        if i >= len(tokens):
+            options[name] = None
+            break
+
+        value = tokens[i]
+        i += 1
+
+        if name == 'COMMENT':
+            options[name] = render_token(value)
+        elif name in ('CHARSET', 'COLLATE'):
+            options[name] = normalize_charset(get_token_value(value))
+        else:
+            options[name] = get_token_value(value).upper()
+
+    for name in IGNORED_TABLE_OPTIONS:
+        options.pop(name, None)
+
+    for name, default_values in DEFAULT_TABLE_OPTIONS.items():
+        if options.get(name) in default_values:
+            options.pop(name)
+
+    charset, collation = get_charset_collation(options.get('CHARSET'), options.get('COLLATE'))
+    if charset:
+        options['CHARSET'] = charset
+    if collation:
+        options['COLLATE'] = collation
+
+    return options
+
+def normalize_column_definition(tokens, table_options):
+    '''
+    规范化列定义（不含列名），返回规范化后的文本元组：
+        - 去除整数类型的显示宽度（`ZEROFILL`列的显示宽度影响取值的展示，予以保留）
+        - 去除与表默认值一致的字符集、排序规则
+        - 可为 NULL 的列去除`NULL`、`DEFAULT NULL`
+        - 数值类型的默认值去除引号
+        - `CURRENT_TIMESTAMP()`、`NOW()`统一为`CURRENT_TIMESTAMP`
+    '''
+    data_type = tokens[0][1].upper() if tokens else ''
+
+    # 类型参数，如：varchar(64)、decimal(10,2)、enum('a','b')
+    i = 1
+    type_definition = [data_type]
+    if len(tokens) > 1 and tokens[1] == ('op', '('):
+        i = find_closing_paren(tokens, 1) + 1 or len(tokens)
+        is_zerofill = any(is_word(t, 'ZEROFILL') for t in tokens[i:])
+        if data_type not in INT_TYPES or is_zerofill:
+            type_definition.extend(render_token(t) for t in tokens[1:i])
+
+    is_nullable = True
+    for j in range(len(tokens) - 1):
+        if is_word(tokens[j], 'NOT') and is_word(tokens[j + 1], 'NULL'):
+            is_nullable = False
+            break
+
+    charset   = None
+    collation = None
+
+    definition = []
+    while i < len(tokens):
+        token = tokens[i]
+
+        if is_word(token, 'CHARACTER', 'CHARSET', 'COLLATE') and i + 1 < len(tokens):
+            if is_word(token, 'CHARACTER') and is_word(tokens[i + 1], 'SET'):
+                i += 1
+
+            value = normalize_charset(get_token_value(tokens[i + 1]))
+            if is_word(token, 'COLLATE'):
+                collation = value
+            else:
+                charset = value
+
+            i += 2
+            continue
+
+        if is_nullable:
+            if is_word(token, 'NULL'):
+                i += 1
+                continue
+
+            if is_word(token, 'DEFAULT') and i + 1 < len(tokens) and is_word(tokens[i + 1], 'NULL'):
+                i += 2
+                continue
+
+        if is_word(token, 'CURRENT_TIMESTAMP', 'NOW', 'LOCALTIME', 'LOCALTIMESTAMP'):
+            definition.append('CURRENT_TIMESTAMP')
+            if i + 2 < len(tokens) and tokens[i + 1] == ('op', '(') and tokens[i + 2] == ('op', ')'):
+                i += 2
+
+            i += 1
+            continue
+
+        if is_word(token, 'DEFAULT') and data_type in NUMERIC_TYPES and i + 1 < len(tokens):
+            # 数值类型的默认值：'0' -> 0、- 1 -> -1
+            value = None
+            if tokens[i + 1][0] == 'string':
+                value, step = get_token_value(tokens[i + 1]), 2
+            elif tokens[i + 1] == ('op', '-') and i + 2 < len(tokens) and tokens[i + 2][0] == 'number':
+                value, step = '-' + tokens[i + 2][1], 3
+
+            if value is not None and NUMBER_RE.match(value):
+                definition.extend(['DEFAULT', value])
+                i += step
+                continue
+
+        definition.append(render_token(token))
+        i += 1
+
+    # 字符集、排序规则与表默认值一致时不输出
+    charset, collation = get_charset_collation(charset, collation)
+    charset_definition = []
+    if charset and charset != table_options.get('CHARSET'):
+        charset_definition.extend(['CHARSET', charset])
+    if collation and collation != table_options.get('COLLATE'):
+        charset_definition.extend(['COLLATE', collation])
+
+    return tuple(type_definition + charset_definition + definition)
+
+def normalize_index_definition(tokens):
+    '''
+    规范化索引、约束定义，返回规范化后的文本元组：
+        - `INDEX`统一为`KEY`
+        - 去除默认的`USING BTREE`
+        - 去除默认的外键规则`RESTRICT`、`NO ACTION`
+    '''
+    definition = []
+
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+
+        if is_word(token, 'INDEX'):
+            definition.append('KEY')
+            i += 1
+            continue
+
+        if is_word(token, 'USING') and i + 1 < len(tokens) and is_word(tokens[i + 1], 'BTREE'):
+            i += 2
+            continue
+
+        if is_word(token, 'ON') and i + 2 < len(tokens) and is_word(tokens[i + 1], 'DELETE', 'UPDATE'):
+            if is_word(tokens[i + 2], 'RESTRICT'):
+                i += 3
+                continue
+
+            if i + 3 < len(tokens) and is_word(tokens[i + 2], 'NO') and is_word(tokens[i + 3], 'ACTION'):
+                i += 4
+                continue
+
+        definition.append(render_token(token))
+        i += 1
+
+    return tuple(definition)
+
+def normalize_partition_definition(tokens):
+    '''
+    规范化分区定义，返回规范化后的文本元组：
+        - 分区名统一为标识符
+        - 去除各分区的`ENGINE = InnoDB`
+    '''
+    definition = []
+
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+
+        if is_word(token, 'ENGINE', 'STORAGE'):
+            if is_word(token, 'STORAGE'):
+                i += 1
+
+            i += 1
+            if i < len(tokens) and tokens[i] == ('op', '='):
+                i += 1
+
+            i += 1
+            continue
+
+        definition.append(render_token(token))
+        i += 1
+
+        # 分区名不加反引号时为普通单词
+        if is_word(token, 'PARTITION', 'SUBPARTITION') and i < len(tokens) and tokens[i][0] == 'word' \
+                and not is_word(tokens[i], 'BY'):
+            definition.append(render_token(('ident', tokens[i][1])))
+            i += 1
+
+    return tuple(definition)
+
+def parse_create_table(tokens):
+    '''
+    返回结构如下：
+        ("TABLE", <tableName>, <列定义>, <索引定义>, <表选项>, <分区定义>)
+    其中列定义保持原顺序，索引定义按文本排序，表选项按名称排序
+    '''
+    i = 0
+    while i < len(tokens) and not is_word(tokens[i], 'TABLE'):
+        i += 1
+
+    i += 1
+    while i < len(tokens) and is_word(tokens[i], 'IF', 'NOT', 'EXISTS'):
+        i += 1
+
+    if i >= len(tokens):
+        return None
+
+    table_name = tokens[i][1]
+    i += 1
+
+    if i >= len(tokens) or tokens[i] != ('op', '('):
+        return None
+
+    body_end = find_closing_paren(tokens, i)
+    if body_end < 0:
+        return None
+
+    body_tokens = tokens[i + 1:body_end]
+    rest_tokens = tokens[body_end + 1:]
+
+    # 表选项与分区定义
+    partition_start = len(rest_tokens)
+    for j, token in enumerate(rest_tokens):
+        if is_word(token, 'PARTITION'):
+            partition_start = j
+            break
+
+    table_options = parse_table_options(rest_tokens[:partition_start])
+
+    partition = None
+    if partition_start < len(rest_tokens):
+        partition = normalize_partition_definition(rest_tokens[partition_start:])
+
+    # 列、索引
+    columns = []
+    indexes = []
+    for definition in split_by_comma(body_tokens):
+        if definition[0][0] == 'word' and definition[0][1].upper() in INDEX_KEYWORDS:
+            indexes.append(normalize_index_definition(definition))
+        else:
+            columns.append((definition[0][1], normalize_column_definition(definition[1:], table_options)))
+
+    return ('TABLE', table_name, tuple(columns), tuple(sorted(indexes)), tuple(sorted(table_options.items())), partition)
+
+def parse_create_view(tokens):
+    '''
+    返回结构如下：
+        ("VIEW", <viewName>, <视图选项>, <查询语句>)
+    忽略`DEFINER`及默认的`ALGORITHM=UNDEFINED`
+    '''
+    options = {}
+
+    i = 1
+    while i < len(tokens) and not is_word(tokens[i], 'VIEW'):
+        token = tokens[i]
+
+        if is_word(token, 'DEFINER'):
+            # DEFINER=`user`@`host`
+            i += 2
+            while i < len(tokens) and (tokens[i][0] == 'ident' or tokens[i] in (('op', '@'), ('op', '%'))):
+                i += 1
+            continue
+
+        elif is_word(token, 'ALGORITHM') and i + 2 < len(tokens):
+            options['ALGORITHM'] = tokens[i + 2][1].upper()
+            i += 3
+            continue
+
+        elif is_word(token, 'SQL') and i + 2 < len(tokens):
+            options['SQL SECURITY'] = tokens[i + 2][1].upper()
+            i += 3
+            continue
+
+        i += 1
+
+    if options.get('ALGORITHM') == 'UNDEFINED':
+        options.pop('ALGORITHM')
+
+    if i + 1 >= len(tokens):
+        return None
+
+    view_name = tokens[i + 1][1]
+
+    i += 2
+    if i < len(tokens) and tokens[i][0] == 'op' and tokens[i][1] == '(':
+        # 列名列表
+        i = find_closing_paren(tokens, i) + 1
+
+    if i < len(tokens) and is_word(tokens[i], 'AS'):
+        i += 1
+
+    query = []
+    for j in range(i, len(tokens)):
+        token = tokens[j]
+
+        # MySQL 8.0 会在字符串前加上字符集前缀，如：_utf8mb4'abc'
+        if token[0] == 'word' and token[1].startswith('_') and j + 1 < len(tokens) and tokens[j + 1][0] == 'string':
+            continue
+
+        query.append(render_token(token))
+
+    return ('VIEW', view_name, tuple(sorted(options.items())), tuple(query))
+
+@lru_cache(maxsize=SYNTAX_TREE_CACHE_SIZE)
+def parse_create_syntax(syntax):
+    '''
+    解析建表（视图）语句，生成规范化的语法树，结果会被缓存
+    不同版本、不同获取方式产生的格式差异（子句顺序、空白、显示宽度、默认字符集等）不会影响语法树
+    无法解析的语句返回：
+        ("UNKNOWN", <规范化的记号文本>)
+    '''
+    if not syntax:
+        return None
+
+    tokens = strip_db_qualifier(tokenize(syntax))
+
+    tree = None
+    if len(tokens) > 1 and is_word(tokens[0], 'CREATE'):
+        is_table = any(is_word(t, 'TABLE') for t in tokens[1:4])
+        if is_table:
+            tree = parse_create_table(tokens)
+        else:
+            tree = parse_create_view(tokens)
+
+    if tree is None:
+        tree = ('UNKNOWN', tuple(render_token(t) for t in tokens))
+
+    return tree
+
+def get_syntax_digest(syntax):
+    '''
+    规范化语法树的 MD5，用于计算表指纹
+    '''
+    return hashlib.md5(repr(parse_create_syntax(syntax)).encode('utf-8')).digest()
@@ -2,12 +2,13 @@
 
 # Builtin Modules
 import re
+import time
 import traceback
 
 # 3rd-party Modules
 import six
 import pymysql
-from pymysql.cursors import DictCursor
+from pymysql.cursors import DictCursor, SSDictCursor
 from dbutils.pooled_db import PooledDB
 
 SQL_PARAM_ESCAPE_MAP = {
@@ -22,11 +23,33 @@ SQL_PARAM_ESCAPE_MAP = {
   '\\'  : '\\\\',
 }
 
+# 流式查询时每次从服务器读取的行数
+STREAM_FETCH_SIZE = 1000
+
 class HexStr(str):
     pass
 
+# 转义用的字符映射表（`str.translate`），以及用于快速判断是否需要转义的正则表达式
+SQL_PARAM_ESCAPE_TABLE = str.maketrans(SQL_PARAM_ESCAPE_MAP)
+SQL_PARAM_ESCAPE_RE    = re.compile('[{}]'.format(re.escape(''.join(SQL_PARAM_ESCAPE_MAP.keys()))))
+
+# 占位符：`?`为转义后的值，`??`为原样插入的值，3 个及以上的`?`不处理
+SQL_PLACEHOLDER_RE = re.compile(r'\?+')
+
 def escape_sql_param(s):
-    if s is None:
+    if isinstance(s, six.string_types):
+        # 字符串最常见，优先处理（字符串不会等于 True/False）
+        escaped = s
+        if SQL_PARAM_ESCAPE_RE.search(s):
+            # 绝大多数值（如：表名）不包含需要转义的字符
+            escaped = s.translate(SQL_PARAM_ESCAPE_TABLE)
+
+        escaped = "'" + escaped + "'"
+        if isinstance(s, HexStr):
+            escaped = 'X' + escaped
+        return escaped
+
+    elif s is None:
         return 'NULL'
 
     elif s in (True, False):
@@ -34,16 +57,6 @@ def escape_sql_param(s):
         s = s.upper()
         return s
 
-    elif isinstance(s, six.string_types):
-        is_hex_str = isinstance(s, HexStr)
-
-        s = six.ensure_str(s)
-        s = ''.join(SQL_PARAM_ESCAPE_MAP.get(c, c) for c in list(s))
-        s = "'{}'".format(six.ensure_str(s))
-        if is_hex_str:
-            s = 'X' + s
-        return s
-
     elif isinstance(s, (six.integer_types, float)):
         return str(s)
 
@@ -60,13 +73,15 @@ def format_sql(sql, sql_params=None, pretty=False):
     if not isinstance(sql_params, (list, tuple)):
         sql_params = [sql_params]
 
-    result          = ''
-    placeholder_re  = re.compile('\?+', re.M)
+    separator = ',\n  ' if pretty else ', '
+
+    parts           = []
     chunk_index     = 0
     sql_param_index = 0
+    sql_params_len  = len(sql_params)
 
-    for m in re.finditer(placeholder_re, sql):
-        if sql_param_index >= len(sql_params):
+    for m in SQL_PLACEHOLDER_RE.finditer(sql):
+        if sql_param_index >= sql_params_len:
             break
 
         placeholder = m.group()
@@ -75,39 +90,40 @@ def format_sql(sql, sql_params=None, pretty=False):
 
         sql_param = sql_params[sql_param_index]
 
-        escaped_sql_param = str(sql_param)
-        if placeholder == '?':
-            if isinstance(sql_param, dict):
-                # Dict -> field = 'Value', ...
-                expressions = []
-                for k, v in sql_param.items():
-                    if v is None:
-                        expressions.append('{} = NULL'.format(k))
+        if placeholder == '??':
+            escaped_sql_param = str(sql_param)
+
+        elif isinstance(sql_param, dict):
+            # Dict -> field = 'Value', ...
+            expressions = []
+            for k, v in sql_param.items():
+                if v is None:
+                    expressions.append('{} = NULL'.format(k))
 
-                    else:
-                        expressions.append("{} = {}".format(k, escape_sql_param(v)))
+                else:
+                    expressions.append("{} = {}".format(k, escape_sql_param(v)))
 
-                escaped_sql_param = (',\n  ' if pretty else ', ').join(expressions)
+            escaped_sql_param = separator.join(expressions)
 
-            elif isinstance(sql_param, (tuple, list, set)):
-                # Tuple, List -> 'value1', 'value2', ...
-                expressions = []
-                for x in sql_param:
-                    if isinstance(x, (tuple, list, set)):
-                        values = [escape_sql_param(v) for v in x]
-                        expressions.append('({})'.format(', '.join(values)))
+        elif isinstance(sql_param, (tuple, list, set)):
+            # Tuple, List -> 'value1', 'value2', ...
+            expressions = []
+            for x in sql_param:
+                if isinstance(x, (tuple, list, set)):
+                    expressions.append('({})'.format(', '.join([escape_sql_param(v) for v in x])))
 
-                    else:
-                        expressions.append(escape_sql_param(x))
+                else:
+                    expressions.append(escape_sql_param(x))
 
-                escaped_sql_param = (',\n  ' if pretty else ', ').join(expressions)
+            escaped_sql_param = separator.join(expressions)
 
-            else:
-                # Other -> 'value'
-                escaped_sql_param = escape_sql_param(sql_param)
+        else:
+            # Other -> 'value'
+            escaped_sql_param = escape_sql_param(sql_param)
 
         start_index, end_index = m.span()
-        result += sql[chunk_index:start_index] + escaped_sql_param
+        parts.append(sql[chunk_index:start_index])
+        parts.append(escaped_sql_param)
         chunk_index = end_index
         sql_param_index += 1
 
@@ -115,11 +131,27 @@ def format_sql(sql, sql_params=None, pretty=False):
         return sql
 
     if chunk_index < len(sql):
-        return result + sql[chunk_index:]
+        parts.append(sql[chunk_index:])
+        return ''.join(parts)
+
+    return ''.join(parts).strip()
+
+def get_row_size(row):
+    '''
+    估算一行数据的大小（字节），字符串按 UTF-8 编码后的长度计算，其他值按 8 字节计算
+    '''
+    size = 0
+    for v in (row.values() if isinstance(row, dict) else row):
+        if isinstance(v, six.string_types):
+            size += len(six.ensure_binary(v))
+        elif isinstance(v, (bytes, bytearray)):
+            size += len(v)
+        else:
+            size += 8
 
-    return result.strip()
+    return size
 
-def get_config(c):
+def get_config(c, max_connections=None):
     _charset = c.get('charset') or 'utf8mb4'
 
     config = {
@@ -132,16 +164,46 @@ def get_config(c):
         'cursorclass'   : DictCursor,
         'charset'       : _charset,
         'init_command'  : 'SET NAMES "{0}"'.format(_charset),
-        'maxconnections': 2,
+        'maxconnections': max_connections or 2,
+        'blocking'      : True,
     }
     return config
 
 class MySQLHelper(object):
-    def __init__(self, config, *args, **kwargs):
+    # 性能统计（如：`mysql_profiler.QueryProfiler`），设置后每次查询均会调用`profiler.record_query(...)`
+    # 可在类上设置以统计所有实例，也可在创建实例时单独指定
+    profiler = None
+
+    def __init__(self, config, max_connections=None, profiler=None, *args, **kwargs):
         self.skip_log = True
 
-        self.config = config
-        self.client = PooledDB(pymysql, **get_config(config))
+        self.config          = config
+        self.max_connections = max_connections or 2
+        self.client          = PooledDB(pymysql, **get_config(config, self.max_connections))
+
+        if profiler:
+            self.profiler = profiler
+
+    def _get_connection(self):
+        '''
+        从连接池获取连接，返回 (<连接>, <等待时间>)
+        连接池已满时会阻塞等待，新建连接的耗时也包含在等待时间中
+        '''
+        start_time = time.time()
+        conn = self.client.connection()
+        return conn, time.time() - start_time
+
+    def _record_query(self, formatted_sql, start_time, rows, pool_wait=0.0):
+        if not self.profiler:
+            return
+
+        latency = time.time() - start_time
+        size    = sum(get_row_size(r) for r in rows)
+
+        self.profiler.record_query(formatted_sql, latency, len(rows), size, pool_wait)
+
+    def close(self):
+        self.client.close()
 
     def check(self):
         try:
@@ -157,12 +219,13 @@ class MySQLHelper(object):
         if not self.skip_log:
             print('[MYSQL] Trans START')
 
-        conn = self.client.connection()
+        conn, pool_wait = self._get_connection()
         cur  = conn.cursor()
 
         trans_conn = {
-            'conn': conn,
-            'cur' : cur,
+            'conn'    : conn,
+            'cur'     : cur,
+            'poolWait': pool_wait,
         }
 
         return trans_conn
@@ -209,10 +272,15 @@ class MySQLHelper(object):
         conn = trans_conn['conn']
         cur  = trans_conn['cur']
 
+        start_time = time.time()
+
         count  = cur.execute(formatted_sql)
-        db_res = cur.fetchall()
+        db_res = list(cur.fetchall())
+
+        # 连接池等待时间只计入事务中的第一个查询
+        self._record_query(formatted_sql, start_time, db_res, trans_conn.pop('poolWait', 0.0))
 
-        return list(db_res), count
+        return db_res, count
 
     def _execute(self, sql, sql_params=None):
         formatted_sql = format_sql(sql, sql_params)
@@ -224,13 +292,73 @@ class MySQLHelper(object):
         cur  = None
 
         try:
-            conn = self.client.connection()
+            conn, pool_wait = self._get_connection()
             cur  = conn.cursor()
 
+            start_time = time.time()
+
             count  = cur.execute(formatted_sql)
-            db_res = cur.fetchall()
+            db_res = list(cur.fetchall())
 
-        except Exception as e:
+            self._record_query(formatted_sql, start_time, db_res, pool_wait)
+
+        except Exception:
+            for line in traceback.format_exc().splitlines():
+                print(line)
+
+            if conn:
+                conn.rollback()
+
+            raise
+
+        else:
+            conn.commit()
+
+            return db_res, count
+
+        finally:
+            if cur:
+                cur.close()
+
+            if conn:
+                conn.close()
+
+    def iter_query(self, sql, sql_params=None):
+        '''
+        使用非缓冲游标（SSDictCursor）逐行返回查询结果，内存占用与结果总行数无关
+        注意：迭代完成前，会一直占用一个连接
+        '''
+        formatted_sql = format_sql(sql, sql_params)
+
+        if not self.skip_log:
+            print('[MYSQL] Stream Query `{}`'.format(re.sub(r'\s+', ' ', formatted_sql, flags=re.M)))
+
+        conn = None
+        cur  = None
+
+        rows_count = 0
+        rows_size  = 0
+
+        try:
+            conn, pool_wait = self._get_connection()
+            cur  = conn.cursor(SSDictCursor)
+
+            start_time = time.time()
+
+            cur.execute(formatted_sql)
+            while True:
+                rows = cur.fetchmany(STREAM_FETCH_SIZE)
+                if not rows:
+                    break
+
+                if self.profiler:
+                    rows_count += len(rows)
+                    rows_size  += sum(get_row_size(r) for r in rows)
+
+                for row in rows:
+                    yield row
+
+        except Exception:
             for line in traceback.format_exc().splitlines():
                 print(line)
 
@@ -242,7 +370,9 @@ class MySQLHelper(object):
         else:
             conn.commit()
 
-            return list(db_res), count
+            # 耗时包含调用方处理各行的时间
+            if self.profiler:
+                self.profiler.record_query(formatted_sql, time.time() - start_time, rows_count, rows_size, pool_wait)
 
         finally:
             if cur:
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+# Builtin Modules
+import re
+import time
+import json
+import bisect
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# 延迟直方图的分桶上限（毫秒），最后一个桶为`+inf`
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+INFORMATION_SCHEMA_RE = re.compile(r'information_schema\.(\w+)', re.I)
+SQL_KEYWORDS_RE       = re.compile(r'^\s*((?:SHOW\s+CREATE\s+\w+)|\w+)', re.I)
+
+def get_query_label(sql):
+    '''
+    查询分类标签，如：`SELECT information_schema.COLUMNS`、`SHOW CREATE TABLE`
+    '''
+    m = SQL_KEYWORDS_RE.match(sql)
+    label = re.sub(r'\s+', ' ', m.group(1)).upper() if m else 'OTHER'
+
+    m = INFORMATION_SCHEMA_RE.search(sql)
+    if m:
+        label += ' information_schema.' + m.group(1).upper()
+
+    return label
+
+class QueryStats(object):
+    def __init__(self):
+        self.count      = 0
+        self.rows       = 0
+        self.bytes      = 0
+        self.total_time = 0.0
+        self.max_time   = 0.0
+        self.pool_wait  = 0.0
+        self.histogram  = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def add(self, latency, rows, size, pool_wait):
+        self.count      += 1
+        self.rows       += rows
+        self.bytes      += size
+        self.total_time += latency
+        self.max_time    = max(self.max_time, latency)
+        self.pool_wait  += pool_wait
+
+        self.histogram[bisect.bisect_left(LATENCY_BUCKETS_MS, latency * 1000)] += 1
+
+    def to_dict(self):
+        buckets = OrderedDict()
+        for i, count in enumerate(self.histogram):
+            bucket = '<={}ms'.format(LATENCY_BUCKETS_MS[i]) if i < len(LATENCY_BUCKETS_MS) else '+inf'
+            buckets[bucket] = count
+
+        return OrderedDict([
+            ('count'    , self.count),
+            ('rows'     , self.rows),
+            ('bytes'    , self.bytes),
+            ('totalTime', round(self.total_time, 6)),
+            ('avgTime'  , round(self.total_time / self.count, 6) if self.count else 0),
+            ('maxTime'  , round(self.max_time, 6)),
+            ('poolWait' , round(self.pool_wait, 6)),
+            ('histogram', buckets),
+        ])
+
+class QueryProfiler(object):
+    '''
+    记录查询耗时、行数、数据量、连接池等待时间，以及各阶段耗时
+    由`MySQLHelper`在每次查询后调用`record_query`，线程安全
+    '''
+    def __init__(self):
+        self.lock        = threading.Lock()
+        self.query_stats = OrderedDict()
+        self.phases      = OrderedDict()
+        self.start_time  = time.time()
+
+    def record_query(self, sql, latency, rows=0, size=0, pool_wait=0.0):
+        label = get_query_label(sql)
+
+        with self.lock:
+            stats = self.query_stats.get(label)
+            if stats is None:
+                stats = self.query_stats[label] = QueryStats()
+
+            stats.add(latency, rows, size, pool_wait)
+
+    @contextmanager
+    def phase(self, name):
+        '''
+        统计阶段耗时，同名阶段多次执行时累加
+        '''
+        start_time = time.time()
+        try:
+            yield
+
+        finally:
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + time.time() - start_time
+
+    def get_metrics(self):
+        '''
+        返回结构如下：
+            {
+                "totalTime": <float>,
+                "phases": {
+                    "<phaseName>": <float>
+                },
+                "queries": {
+                    "<queryLabel>": {
+                        "count"    : <int>,
+                        "rows"     : <int>,
+                        "bytes"    : <int>,
+                        "totalTime": <float>,
+                        "avgTime"  : <float>,
+                        "maxTime"  : <float>,
+                        "poolWait" : <float>,
+                        "histogram": { "<=1ms": <int>, ..., "+inf": <int> }
+                    }
+                }
+            }
+        其中时间单位均为秒
+        '''
+        with self.lock:
+            metrics = OrderedDict([
+                ('totalTime', round(time.time() - self.start_time, 6)),
+                ('phases'   , OrderedDict((k, round(v, 6)) for k, v in self.phases.items())),
+                ('queries'  , OrderedDict((k, v.to_dict()) for k, v in self.query_stats.items())),
+            ])
+
+        return metrics
+
+    def dump_json(self, path):
+        with open(path, 'w') as _f:
+            json.dump(self.get_metrics(), _f, indent=2)
+
+    def print_summary(self):
+        metrics = self.get_metrics()
+
+        print('')
+        print('-> 各阶段耗时（总耗时 {:.3f} 秒）：'.format(metrics['totalTime']))
+        for phase_name, phase_time in metrics['phases'].items():
+            print('\t{:<20} {:>10.3f}s'.format(phase_name, phase_time))
+
+        print('')
+        print('-> 查询统计：')
+        for label, stats in metrics['queries'].items():
+            print('\t' + label)
+            print('\t\t次数 {}，行数 {}，数据量 {:.1f} KB，总耗时 {:.3f} 秒，平均 {:.1f} 毫秒，最大 {:.1f} 毫秒，等待连接 {:.3f} 秒'.format(
+                    stats['count'], stats['rows'], stats['bytes'] / 1024.0,
+                    stats['totalTime'], stats['avgTime'] * 1000, stats['maxTime'] * 1000, stats['poolWait']))
+
+            histogram = ', '.join('{}: {}'.format(k, v) for k, v in stats['histogram'].items() if v)
+            print('\t\t延迟分布: {}'.format(histogram))
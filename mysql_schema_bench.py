@@ -0,0 +1,756 @@
+# -*- coding: utf-8 -*-
+
+import io
+import re
+import sys
+import time
+import pickle
+import random
+import asyncio
+import threading
+import tracemalloc
+
+from itertools import groupby
+from operator import itemgetter
+from contextlib import redirect_stdout
+from collections import OrderedDict
+from mysql_helper import format_sql, HexStr, SQL_PARAM_ESCAPE_MAP
+from mysql_schema_diff import COLUMN_PROPS, get_cli_options, add_column_row, set_table_fingerprints, \
+        get_column_definition, get_index_definition, build_table_metadata, set_table_metadata, \
+        get_mysql_schema, get_mysql_option, compare_schema, print_schema_diff
+from mysql_schema_model import Column
+
+DATA_TYPES = [
+    # DATA_TYPE, COLUMN_TYPE, CHARACTER_SET_NAME, COLLATION_NAME
+    ( 'int',      'int(11)',      None,      None                 ),
+    ( 'bigint',   'bigint(20)',   None,      None                 ),
+    ( 'varchar',  'varchar(64)',  'utf8mb4', 'utf8mb4_unicode_ci' ),
+    ( 'text',     'text',         'utf8mb4', 'utf8mb4_unicode_ci' ),
+    ( 'datetime', 'datetime',     None,      None                 ),
+    ( 'tinyint',  'tinyint(1)',   None,      None                 ),
+]
+
+# 模拟的差异类型
+DRIFT_KINDS = [
+    'column_type',
+    'column_removed',
+    'column_added',
+    'index_removed',
+    'table_removed',
+    'table_added',
+]
+
+BENCH_DATABASE = 'bench'
+
+def get_bench_table_name(t):
+    return 'tb_bench_{:06d}'.format(t)
+
+def generate_column_rows(table_count, columns_per_table):
+    '''
+    生成模拟的 information_schema.COLUMNS 数据
+    '''
+    for t in range(table_count):
+        table_name = get_bench_table_name(t)
+
+        for c in range(columns_per_table):
+            data_type, column_type, charset, collation = DATA_TYPES[c % len(DATA_TYPES)]
+
+            # 每次生成新的字符串对象，模拟从数据库读取时各行数据互不共享的情况
+            yield {
+                'TABLE_CATALOG'           : ''.join(['def']),
+                'TABLE_SCHEMA'            : BENCH_DATABASE,
+                'TABLE_NAME'              : table_name,
+                'COLUMN_NAME'             : 'column{}'.format(c),
+                'ORDINAL_POSITION'        : c + 1,
+                'COLUMN_DEFAULT'          : None,
+                'IS_NULLABLE'             : ''.join(['Y', 'ES']) if c % 2 else ''.join(['N', 'O']),
+                'DATA_TYPE'               : ''.join([data_type]),
+                'CHARACTER_MAXIMUM_LENGTH': 64 if charset else None,
+                'CHARACTER_OCTET_LENGTH'  : 256 if charset else None,
+                'NUMERIC_PRECISION'       : None if charset else 10,
+                'NUMERIC_SCALE'           : None if charset else 0,
+                'DATETIME_PRECISION'      : None,
+                'CHARACTER_SET_NAME'      : ''.join([charset]) if charset else None,
+                'COLLATION_NAME'          : ''.join([collation]) if collation else None,
+                'COLUMN_TYPE'             : ''.join([column_type]),
+                'COLUMN_KEY'              : ''.join(['PRI']) if c == 0 else '',
+                'EXTRA'                   : '',
+                'COLUMN_COMMENT'          : 'Column {} of {}'.format(c, table_name),
+            }
+
+def generate_index_rows(table_name, columns_per_table):
+    '''
+    生成模拟的 information_schema.STATISTICS 数据：主键及一个普通索引
+    '''
+    rows = [{
+        'TABLE_SCHEMA': BENCH_DATABASE,
+        'TABLE_NAME'  : table_name,
+        'INDEX_NAME'  : 'PRIMARY',
+        'NON_UNIQUE'  : 0,
+        'SEQ_IN_INDEX': 1,
+        'COLUMN_NAME' : 'column0',
+        'SUB_PART'    : None,
+        'INDEX_TYPE'  : 'BTREE',
+    }]
+
+    if columns_per_table > 1:
+        rows.append({
+            'TABLE_SCHEMA': BENCH_DATABASE,
+            'TABLE_NAME'  : table_name,
+            'INDEX_NAME'  : 'idx_column1',
+            'NON_UNIQUE'  : 1,
+            'SEQ_IN_INDEX': 1,
+            'COLUMN_NAME' : 'column1',
+            'SUB_PART'    : None,
+            'INDEX_TYPE'  : 'BTREE',
+        })
+
+    return rows
+
+def get_bench_create_syntax(table_name, table):
+    definitions = [get_column_definition(c) for c in table['columns'].values()]
+    definitions.extend(get_index_definition(k, v) for k, v in table['indexes'].items())
+
+    return 'CREATE TABLE `{}` (\n  {}\n) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4'.format(table_name, ',\n  '.join(definitions))
+
+def add_bench_table(mysql_schemas, table_name, column_rows, index_rows):
+    table = {
+        'syntax' : None,
+        'columns': OrderedDict(),
+    }
+    for r in column_rows:
+        table['columns'][r['COLUMN_NAME']] = Column(r)
+
+    mysql_schemas[table_name] = table
+    set_table_metadata({ table_name: table }, build_table_metadata(BENCH_DATABASE, index_rows, [], []))
+
+    table['syntax'] = get_bench_create_syntax(table_name, table)
+
+def generate_schema_pair(table_count, columns_per_table, drift_percent=1.0, seed=0):
+    '''
+    生成一对模拟的数据库结构（与`get_mysql_schema`返回结构一致），目标数据库中约`drift_percent`%的表存在差异
+    差异类型见`DRIFT_KINDS`，按`seed`随机选择，结果可重现
+    返回 (<基准数据库结构>, <目标数据库结构>)
+    '''
+    rng = random.Random(seed)
+
+    base_schema   = OrderedDict()
+    target_schema = OrderedDict()
+
+    for table_name, column_rows in groupby(generate_column_rows(table_count, columns_per_table), key=itemgetter('TABLE_NAME')):
+        column_rows = list(column_rows)
+        index_rows  = generate_index_rows(table_name, columns_per_table)
+
+        add_bench_table(base_schema, table_name, column_rows, index_rows)
+
+        if rng.random() * 100 >= drift_percent:
+            # 无差异的表共享同一份结构
+            target_schema[table_name] = base_schema[table_name]
+            continue
+
+        drift_kind = rng.choice(DRIFT_KINDS)
+        if drift_kind == 'table_removed':
+            continue
+
+        if drift_kind == 'column_type':
+            column_rows[-1] = dict(column_rows[-1], COLUMN_TYPE='varchar(128)', DATA_TYPE='varchar', CHARACTER_MAXIMUM_LENGTH=128)
+
+        elif drift_kind == 'column_removed' and len(column_rows) > 1:
+            column_rows = column_rows[:-1]
+
+        elif drift_kind == 'column_added':
+            column_rows.append(dict(column_rows[-1], COLUMN_NAME='extraColumn', ORDINAL_POSITION=len(column_rows) + 1))
+
+        elif drift_kind == 'index_removed':
+            index_rows = index_rows[:1]
+
+        add_bench_table(target_schema, table_name, column_rows, index_rows)
+
+        if drift_kind == 'table_added':
+            add_bench_table(target_schema, table_name + '_extra', column_rows, index_rows)
+
+    set_table_fingerprints(base_schema)
+    set_table_fingerprints(target_schema)
+
+    return base_schema, target_schema
+
+def build_dict_schema(column_rows):
+    '''
+    原先的结构：每列为包含全部`COLUMN_PROPS`的 dict，并嵌套在 OrderedDict 中
+    '''
+    mysql_schemas = OrderedDict()
+    for r in column_rows:
+        table_name  = r['TABLE_NAME']
+        column_name = r['COLUMN_NAME']
+
+        if table_name not in mysql_schemas:
+            mysql_schemas[table_name] = {
+                'syntax' : None,
+                'columns': OrderedDict(),
+            }
+
+        if column_name not in mysql_schemas[table_name]['columns']:
+            mysql_schemas[table_name]['columns'][column_name] = {}
+
+        for p in COLUMN_PROPS:
+            mysql_schemas[table_name]['columns'][column_name][p] = r[p]
+
+    return mysql_schemas
+
+def build_compact_schema(column_rows):
+    mysql_schemas = OrderedDict()
+    for r in column_rows:
+        add_column_row(mysql_schemas, r)
+
+    return mysql_schemas
+
+def measure(func, *args, **kwargs):
+    '''
+    执行函数并返回 (<结果>, <耗时(秒)>, <结果占用内存(字节)>, <峰值内存(字节)>)
+    '''
+    tracemalloc.start()
+    start_time = time.time()
+
+    result = func(*args, **kwargs)
+
+    cost_time = time.time() - start_time
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, cost_time, current, peak
+
+def measure_time(func, *args, **kwargs):
+    '''
+    执行函数并返回 (<结果>, <耗时(秒)>)，不启用 tracemalloc，避免影响耗时
+    '''
+    start_time = time.time()
+    result = func(*args, **kwargs)
+    return result, time.time() - start_time
+
+def format_size(size):
+    return '{:.1f} MB'.format(size / 1024.0 / 1024.0)
+
+def bench_memory(total_columns, columns_per_table):
+    table_count = max(total_columns // columns_per_table, 1)
+
+    print('模拟数据库结构: {} 表 x {} 列 = {} 列'.format(table_count, columns_per_table, table_count * columns_per_table))
+    print('{:<12} {:>10} {:>14} {:>14}'.format('结构', '耗时', '结构占用内存', '峰值内存'))
+
+    for name, builder in (('dict', build_dict_schema), ('compact', build_compact_schema)):
+        result, cost_time, current, peak = measure(builder, generate_column_rows(table_count, columns_per_table))
+        print('{:<12} {:>9.3f}s {:>14} {:>14}'.format(name, cost_time, format_size(current), format_size(peak)))
+
+        del result
+
+def legacy_escape_sql_param(s):
+    '''
+    原先的实现：逐字符查表转义
+    '''
+    if s is None:
+        return 'NULL'
+
+    elif s in (True, False):
+        return str(s).upper()
+
+    elif isinstance(s, str):
+        is_hex_str = isinstance(s, HexStr)
+
+        s = ''.join(SQL_PARAM_ESCAPE_MAP.get(c, c) for c in list(s))
+        s = "'{}'".format(s)
+        if is_hex_str:
+            s = 'X' + s
+        return s
+
+    elif isinstance(s, (int, float)):
+        return str(s)
+
+    else:
+        return "'{}'".format(s)
+
+def legacy_format_sql(sql, sql_params=None):
+    '''
+    原先的实现：每次调用编译正则表达式，使用`+=`拼接结果
+    '''
+    if not sql_params:
+        return sql
+
+    if not isinstance(sql_params, (list, tuple)):
+        sql_params = [sql_params]
+
+    result          = ''
+    placeholder_re  = re.compile('\\?+', re.M)
+    chunk_index     = 0
+    sql_param_index = 0
+
+    for m in re.finditer(placeholder_re, sql):
+        if sql_param_index >= len(sql_params):
+            break
+
+        placeholder = m.group()
+        if len(placeholder) > 2:
+            continue
+
+        sql_param = sql_params[sql_param_index]
+
+        escaped_sql_param = str(sql_param)
+        if placeholder == '?':
+            if isinstance(sql_param, (tuple, list, set)):
+                escaped_sql_param = ', '.join(legacy_escape_sql_param(x) for x in sql_param)
+            else:
+                escaped_sql_param = legacy_escape_sql_param(sql_param)
+
+        start_index, end_index = m.span()
+        result += sql[chunk_index:start_index] + escaped_sql_param
+        chunk_index = end_index
+        sql_param_index += 1
+
+    if chunk_index == 0:
+        return sql
+
+    if chunk_index < len(sql):
+        return result + sql[chunk_index:]
+
+    return result.strip()
+
+def bench_format_sql(param_count, repeat):
+    '''
+    `format_sql`/`escape_sql_param`的耗时：包含大量参数的`IN (...)`列表，以及大量占位符的语句
+    '''
+    # 每 100 个值中有 1 个包含需要转义的字符
+    table_names = []
+    for i in range(param_count):
+        table_name = get_bench_table_name(i)
+        if i % 100 == 0:
+            table_name += "'s \\ name"
+
+        table_names.append(table_name)
+
+    cases = [
+        ('IN 列表', 'SELECT * FROM information_schema.TABLES WHERE TABLE_NAME IN (?)', [table_names]),
+        ('多占位符', ' UNION ALL '.join(['SELECT ?'] * param_count), table_names),
+    ]
+
+    print('参数数量: {}，重复 {} 次'.format(param_count, repeat))
+    print('{:<12} {:>12} {:>12} {:>8}'.format('语句', '原实现', '现实现', '加速比'))
+
+    for case_name, sql, sql_params in cases:
+        if legacy_format_sql(sql, sql_params) != format_sql(sql, sql_params):
+            raise Exception('Results of `format_sql` mismatch: {}'.format(case_name))
+
+        _, legacy_time = measure_time(lambda: [legacy_format_sql(sql, sql_params) for _ in range(repeat)])
+        _, cost_time   = measure_time(lambda: [format_sql(sql, sql_params) for _ in range(repeat)])
+
+        print('{:<12} {:>11.3f}s {:>11.3f}s {:>7.1f}x'.format(case_name, legacy_time, cost_time, legacy_time / max(cost_time, 1e-9)))
+
+def render_text(schema_diff):
+    output = io.StringIO()
+    with redirect_stdout(output):
+        print_schema_diff(schema_diff, no_color=True)
+
+    return output.getvalue()
+
+def serialize_diff(schema_diff, output_format):
+    from mysql_schema_output import write_schema_diff
+
+    output = io.BytesIO()
+    write_schema_diff(schema_diff, output_format, output)
+    return output.getvalue()
+
+def render_migration(schema_diff, base_schema, target_schema):
+    from mysql_schema_migration import write_migration_sql
+
+    output = io.BytesIO()
+    write_migration_sql(schema_diff, base_schema, target_schema, output)
+    return output.getvalue()
+
+def bench_compare(table_counts, columns_per_table, drift_percent, compare_workers=0):
+    '''
+    对比、输出、序列化的耗时、吞吐量（表/秒）及峰值内存
+    指定`compare_workers`时，额外测试多进程分片对比（结果须与单进程对比完全一致）
+    '''
+    print('模拟数据库结构: 每表 {} 列，差异表比例 {}%'.format(columns_per_table, drift_percent))
+    print('{:<10} {:<10} {:>10} {:>12} {:>14} {:>12}'.format('表数量', '阶段', '耗时', '表/秒', '峰值内存', '结果大小'))
+
+    for table_count in table_counts:
+        base_schema, target_schema = generate_schema_pair(table_count, columns_per_table, drift_percent)
+        schema_diff = compare_schema(base_schema, target_schema)
+
+        if compare_workers > 1:
+            from mysql_schema_parallel import compare_schema_parallel
+
+            parallel_diff, cost_time = measure_time(compare_schema_parallel, base_schema, target_schema, compare_workers)
+            if list(parallel_diff.items()) != list(schema_diff.items()):
+                raise Exception('Parallel comparison result differs from serial comparison')
+
+            print('{:<10} {:<10} {:>9.3f}s {:>12.0f} {:>14} {:>12}'.format(
+                    table_count, 'compare-p{}'.format(compare_workers), cost_time, table_count / max(cost_time, 1e-9), '-',
+                    '{} 表'.format(len(parallel_diff))))
+
+            del parallel_diff
+
+        stages = [
+            ('compare', compare_schema,   (base_schema, target_schema)),
+            ('text',    render_text,      (schema_diff, )),
+            ('jsonl',   serialize_diff,   (schema_diff, 'jsonl')),
+            ('msgpack', serialize_diff,   (schema_diff, 'msgpack')),
+            ('sql',     render_migration, (schema_diff, base_schema, target_schema)),
+        ]
+        for stage_name, func, args in stages:
+            result, cost_time = measure_time(func, *args)
+
+            # 单独执行一次以统计峰值内存（tracemalloc 会显著降低执行速度）
+            _, _, _, peak = measure(func, *args)
+
+            result_size = '{} 表'.format(len(result)) if stage_name == 'compare' else format_size(len(result))
+            print('{:<10} {:<10} {:>9.3f}s {:>12.0f} {:>14} {:>12}'.format(
+                    table_count, stage_name, cost_time, table_count / max(cost_time, 1e-9), format_size(peak), result_size))
+
+            del result
+
+        del base_schema, target_schema, schema_diff
+
+class ReplayDB(object):
+    '''
+    回放 information_schema 查询结果的模拟数据库，接口与`MySQLHelper`一致，用于在没有 MySQL 服务器时测试结构获取的性能
+    `records`为 { "<格式化后的 SQL>": [ <row>, ... ] }，可通过`RecordingDB`从真实数据库录制
+    `latency`为每次查询模拟的网络延迟（秒）
+    '''
+    def __init__(self, records, config, max_connections=None, latency=0):
+        self.config          = config
+        self.max_connections = max_connections or 2
+        self.records         = records
+        self.latency         = latency
+
+    def close(self):
+        pass
+
+    def get_rows(self, sql, sql_params=None):
+        formatted_sql = format_sql(sql, sql_params)
+        if formatted_sql not in self.records:
+            raise Exception('Query not recorded: `{}`'.format(re.sub('\\s+', ' ', formatted_sql, flags=re.M)))
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        return self.records[formatted_sql]
+
+    def query(self, sql, sql_params=None):
+        return list(self.get_rows(sql, sql_params))
+
+    def iter_query(self, sql, sql_params=None):
+        for r in self.get_rows(sql, sql_params):
+            yield r
+
+class RecordingDB(object):
+    '''
+    包装`MySQLHelper`，记录所有查询结果，供`ReplayDB`回放
+    '''
+    def __init__(self, db):
+        self.db              = db
+        self.config          = db.config
+        self.max_connections = db.max_connections
+        self.records         = {}
+        self.lock            = threading.Lock()
+
+    def close(self):
+        self.db.close()
+
+    def record(self, sql, sql_params, rows):
+        with self.lock:
+            self.records[format_sql(sql, sql_params)] = rows
+
+        return rows
+
+    def query(self, sql, sql_params=None):
+        return self.record(sql, sql_params, self.db.query(sql, sql_params))
+
+    def iter_query(self, sql, sql_params=None):
+        rows = self.record(sql, sql_params, list(self.db.iter_query(sql, sql_params)))
+        for r in rows:
+            yield r
+
+class SyntheticDB(ReplayDB):
+    '''
+    根据查询语句生成模拟数据的数据库，表结构与`generate_column_rows`一致
+    '''
+    def __init__(self, table_count, columns_per_table, max_connections=None, latency=0):
+        config = { 'database': BENCH_DATABASE }
+        super(SyntheticDB, self).__init__({}, config, max_connections, latency)
+
+        self.table_count       = table_count
+        self.columns_per_table = columns_per_table
+
+    def get_rows(self, sql, sql_params=None):
+        formatted_sql = format_sql(sql, sql_params)
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        m = re.search(r'SHOW CREATE TABLE (?:`\w+`\.)?`(\w+)`', formatted_sql)
+        if m:
+            table_name = m.group(1)
+            table = OrderedDict()
+            add_bench_table(table, table_name,
+                    [r for r in generate_column_rows(1, self.columns_per_table)],
+                    generate_index_rows(table_name, self.columns_per_table))
+            return [{ 'Table': table_name, 'Create Table': table[table_name]['syntax'] }]
+
+        if 'information_schema.COLUMNS' in formatted_sql:
+            return generate_column_rows(self.table_count, self.columns_per_table)
+
+        if 'information_schema.STATISTICS' in formatted_sql:
+            rows = []
+            for t in range(self.table_count):
+                rows.extend(generate_index_rows(get_bench_table_name(t), self.columns_per_table))
+            return rows
+
+        if 'information_schema.TABLES' in formatted_sql:
+            rows = []
+            for t in range(self.table_count):
+                rows.append({
+                    'TABLE_SCHEMA'   : BENCH_DATABASE,
+                    'TABLE_NAME'     : get_bench_table_name(t),
+                    'TABLE_TYPE'     : 'BASE TABLE',
+                    'ENGINE'         : 'InnoDB',
+                    'TABLE_COLLATION': 'utf8mb4_unicode_ci',
+                    'CREATE_OPTIONS' : '',
+                    'TABLE_COMMENT'  : '',
+                })
+            return rows
+
+        return []
+
+class AsyncReplayDB(object):
+    '''
+    将`ReplayDB`/`SyntheticDB`包装为接口与`AsyncMySQLHelper`一致的模拟数据库，用于在没有 MySQL 服务器、未安装 aiomysql 时测试异步获取
+    同时执行的查询不超过`max_connections`，模拟的网络延迟使用`asyncio.sleep`，不阻塞事件循环
+    '''
+    def __init__(self, db, latency=0):
+        self.db              = db
+        self.config          = db.config
+        self.max_connections = db.max_connections
+        self.latency         = latency
+        self.semaphore       = asyncio.Semaphore(self.max_connections)
+
+    async def close(self):
+        self.db.close()
+
+    async def get_rows(self, sql, sql_params=None):
+        async with self.semaphore:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+
+            return list(self.db.get_rows(sql, sql_params))
+
+    async def query(self, sql, sql_params=None):
+        return await self.get_rows(sql, sql_params)
+
+    async def iter_query(self, sql, sql_params=None):
+        for r in await self.get_rows(sql, sql_params):
+            yield r
+
+def record_main(args, options):
+    '''
+    从真实数据库录制结构获取过程中的所有查询结果：
+        python mysql_schema_bench.py record <user>:<passwd>@<host>:<port>/<db> <path> [--extract-mode=show|bulk]
+    '''
+    from mysql_helper import MySQLHelper
+
+    extract_mode = options.get('extract-mode') or 'show'
+
+    db = RecordingDB(MySQLHelper(get_mysql_option(args[0])))
+    try:
+        mysql_schemas = get_mysql_schema(db, 1, extract_mode)
+    finally:
+        db.close()
+
+    with open(args[1], 'wb') as _f:
+        pickle.dump({ 'config': { 'database': db.config['database'] }, 'records': db.records }, _f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    print('已录制 {} 个表、{} 条查询至 {}'.format(len(mysql_schemas), len(db.records), args[1]))
+
+def bench_extract(db_factory, fetch_workers, extract_mode):
+    '''
+    结构获取的耗时及峰值内存
+    '''
+    mysql_schemas, cost_time = measure_time(get_mysql_schema, db_factory(), fetch_workers, extract_mode)
+    _, _, current, peak = measure(get_mysql_schema, db_factory(), fetch_workers, extract_mode)
+
+    print('获取方式: {}，并行数: {}'.format(extract_mode, fetch_workers))
+    print('{} 表，耗时 {:.3f} 秒（{:.0f} 表/秒），结构占用内存 {}，峰值内存 {}'.format(
+            len(mysql_schemas), cost_time, len(mysql_schemas) / max(cost_time, 1e-9), format_size(current), format_size(peak)))
+
+async def check_async_helper(db):
+    '''
+    通过`AsyncMySQLHelper`执行连接检查、流式读取、事务及错误处理，结果不符合预期时报错
+    '''
+    await db.check()
+
+    sql        = 'SELECT * FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = ?'
+    sql_params = [db.config['database']]
+
+    rows        = await db.query(sql, sql_params)
+    stream_rows = [r async for r in db.iter_query(sql, sql_params)]
+    if stream_rows != rows:
+        raise Exception('`iter_query` result differs from `query`')
+
+    trans_conn = await db.start_trans()
+    try:
+        await db.trans_non_query(trans_conn, 'SET SESSION group_concat_max_len = ?', [1024])
+        trans_rows = await db.trans_query(trans_conn, sql, sql_params)
+
+    except Exception:
+        await db.rollback(trans_conn)
+        raise
+
+    else:
+        await db.commit(trans_conn)
+
+    if trans_rows != rows:
+        raise Exception('`trans_query` result differs from `query`')
+
+    # 错误处理：查询失败时应抛出异常，且连接归还至连接池
+    try:
+        with redirect_stdout(io.StringIO()):
+            await db.query('DELETE FROM information_schema.COLUMNS')
+
+    except Exception:
+        pass
+
+    else:
+        raise Exception('Failed query did not raise')
+
+    await db.query('SELECT 1')
+
+def bench_extract_async(db_factory, db_count, latency, stand_in_server=False):
+    '''
+    同一事件循环中异步获取多个数据库结构（`get_mysql_schemas_async`）与依次同步获取（`bulk`方式）的耗时
+    异步获取的结果须与同步获取完全一致
+    `stand_in_server`为 True 时启动`StandInMySQLServer`，通过`MySQLHelper`、`AsyncMySQLHelper`（需安装 aiomysql）连接，
+    否则使用接口与`AsyncMySQLHelper`一致的`AsyncReplayDB`，只测试获取逻辑
+    '''
+    from mysql_schema_diff import get_mysql_schemas_async
+
+    server = None
+    if stand_in_server:
+        from mysql_helper import MySQLHelper
+        from mysql_async_helper import AsyncMySQLHelper
+        from mysql_schema_standin import StandInMySQLServer
+
+        server = StandInMySQLServer(db_factory(0), latency)
+        server.start()
+
+        def _sync_db_factory():
+            return MySQLHelper(server.get_config(BENCH_DATABASE))
+
+        def _async_db_factory():
+            return AsyncMySQLHelper(server.get_config(BENCH_DATABASE))
+
+    else:
+        def _sync_db_factory():
+            return db_factory(latency)
+
+        def _async_db_factory():
+            return AsyncReplayDB(db_factory(0), latency)
+
+    def _get_mysql_schemas_sync():
+        schemas = []
+        for _ in range(db_count):
+            db = _sync_db_factory()
+            try:
+                schemas.append(get_mysql_schema(db, 1, 'bulk'))
+            finally:
+                db.close()
+
+        return schemas
+
+    async def _get_mysql_schemas_async(dbs):
+        try:
+            return await get_mysql_schemas_async(dbs)
+        finally:
+            await asyncio.gather(*(db.close() for db in dbs))
+
+    async def _check_async_helper():
+        db = _async_db_factory()
+        try:
+            await check_async_helper(db)
+        finally:
+            await db.close()
+
+    try:
+        if stand_in_server:
+            asyncio.run(_check_async_helper())
+            print('AsyncMySQLHelper 检查通过（连接、流式读取、事务、错误处理）')
+
+        sync_schemas,  sync_cost_time  = measure_time(_get_mysql_schemas_sync)
+        async_schemas, async_cost_time = measure_time(lambda: asyncio.run(_get_mysql_schemas_async([_async_db_factory() for _ in range(db_count)])))
+
+    finally:
+        if server is not None:
+            server.close()
+
+    for sync_schema, async_schema in zip(sync_schemas, async_schemas):
+        if list(sync_schema.items()) != list(async_schema.items()):
+            raise Exception('Async extraction result differs from sync extraction')
+
+    table_count = sum(len(s) for s in sync_schemas)
+    print('数据库数量: {}，共 {} 表，每次查询模拟延迟 {:.0f} 毫秒{}'.format(
+            db_count, table_count, latency * 1000, '（本地模拟服务器）' if stand_in_server else ''))
+    print('依次同步获取耗时 {:.3f} 秒，异步获取耗时 {:.3f} 秒'.format(sync_cost_time, async_cost_time))
+
+def main():
+    args, options = get_cli_options(sys.argv[1:])
+
+    bench_name = args[0] if args else 'memory'
+
+    if bench_name == 'memory':
+        total_columns     = int(options.get('columns') or 100000)
+        columns_per_table = int(options.get('columns-per-table') or 20)
+        bench_memory(total_columns, columns_per_table)
+
+    elif bench_name == 'compare':
+        table_counts      = [int(x) for x in (options.get('tables') or '1000,10000,100000').split(',')]
+        columns_per_table = int(options.get('columns-per-table') or 10)
+        drift_percent     = float(options.get('drift') or 1)
+        compare_workers   = int(options.get('compare-workers') or 0)
+        bench_compare(table_counts, columns_per_table, drift_percent, compare_workers)
+
+    elif bench_name in ('extract', 'extract-async'):
+        fetch_workers = int(options.get('fetch-workers') or 4)
+        extract_mode  = options.get('extract-mode') or 'show'
+        latency       = float(options.get('latency') or 0) / 1000.0
+
+        if options.get('recording'):
+            with open(options['recording'], 'rb') as _f:
+                recording = pickle.load(_f)
+
+            def _db_factory(latency=latency):
+                return ReplayDB(recording['records'], recording['config'], fetch_workers + 1, latency)
+
+        else:
+            table_count       = int(options.get('tables') or 1000)
+            columns_per_table = int(options.get('columns-per-table') or 10)
+
+            def _db_factory(latency=latency):
+                return SyntheticDB(table_count, columns_per_table, fetch_workers + 1, latency)
+
+        if bench_name == 'extract-async':
+            db_count        = int(options.get('dbs') or 10)
+            stand_in_server = options.get('stand-in-server') is True
+            bench_extract_async(_db_factory, db_count, latency, stand_in_server)
+        else:
+            bench_extract(_db_factory, fetch_workers, extract_mode)
+
+    elif bench_name == 'format-sql':
+        param_count = int(options.get('params') or 10000)
+        repeat      = int(options.get('repeat') or 20)
+        bench_format_sql(param_count, repeat)
+
+    elif bench_name == 'record':
+        record_main(args[1:], options)
+
+    else:
+        raise Exception('Unknown benchmark: {}'.format(bench_name))
+
+if __name__ == '__main__':
+    main()
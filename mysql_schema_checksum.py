@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from mysql_schema_filter import DEFAULT_TABLE_FILTER, TableFilter
+from mysql_schema_diff import get_mysql_schemas_concurrently
+
+# 计算校验和时的 group_concat_max_len，避免列、索引较多的表被截断导致校验和失真
+CHECKSUM_GROUP_CONCAT_MAX_LEN = 64 * 1024 * 1024
+
+def get_table_checksums(db, table_filter=None):
+    '''
+    在服务器端计算每个表的校验和，只传输表名及 MD5 值
+    校验和包含表选项、各列属性、索引、外键、分区、视图定义，按`ORDINAL_POSITION`/`SEQ_IN_INDEX`等排序后使用`GROUP_CONCAT`拼接
+    不同版本的 MySQL 元数据取值可能不同（如：整数显示宽度），此时校验和不一致，但会在详细对比时被规范化，不会误报差异
+    返回结构如下：
+        {
+            "<tableName>": <str>
+        }
+    '''
+    table_filter = table_filter or DEFAULT_TABLE_FILTER
+
+    sql = '''
+        SELECT
+            t.TABLE_NAME,
+            MD5(CONCAT_WS('#',
+                t.TABLE_TYPE,
+                IFNULL(t.ENGINE, ''),
+                IFNULL(t.TABLE_COLLATION, ''),
+                IFNULL(t.CREATE_OPTIONS, ''),
+                t.TABLE_COMMENT,
+                IFNULL(c.checksum, ''),
+                IFNULL(s.checksum, ''),
+                IFNULL(f.checksum, ''),
+                IFNULL(p.checksum, ''),
+                IFNULL(v.checksum, ''))) AS checksum
+        FROM
+            information_schema.TABLES AS t
+        LEFT JOIN (
+            SELECT
+                TABLE_NAME,
+                MD5(GROUP_CONCAT(CONCAT_WS('|',
+                    COLUMN_NAME,
+                    ORDINAL_POSITION,
+                    IFNULL(COLUMN_DEFAULT, '<NULL>'),
+                    IS_NULLABLE,
+                    COLUMN_TYPE,
+                    IFNULL(CHARACTER_SET_NAME, ''),
+                    IFNULL(COLLATION_NAME, ''),
+                    COLUMN_KEY,
+                    EXTRA,
+                    COLUMN_COMMENT) ORDER BY ORDINAL_POSITION SEPARATOR '\\n')) AS checksum
+            FROM
+                information_schema.COLUMNS
+            WHERE
+                    TABLE_SCHEMA = ?
+                AND ??
+                AND COLUMN_NAME NOT LIKE '\\_%'
+            GROUP BY
+                TABLE_NAME
+        ) AS c ON c.TABLE_NAME = t.TABLE_NAME
+        LEFT JOIN (
+            SELECT
+                TABLE_NAME,
+                MD5(GROUP_CONCAT(CONCAT_WS('|',
+                    INDEX_NAME,
+                    NON_UNIQUE,
+                    SEQ_IN_INDEX,
+                    COLUMN_NAME,
+                    IFNULL(SUB_PART, ''),
+                    INDEX_TYPE) ORDER BY INDEX_NAME, SEQ_IN_INDEX SEPARATOR '\\n')) AS checksum
+            FROM
+                information_schema.STATISTICS
+            WHERE
+                    TABLE_SCHEMA = ?
+                AND ??
+            GROUP BY
+                TABLE_NAME
+        ) AS s ON s.TABLE_NAME = t.TABLE_NAME
+        LEFT JOIN (
+            SELECT
+                kcu.TABLE_NAME,
+                MD5(GROUP_CONCAT(CONCAT_WS('|',
+                    kcu.CONSTRAINT_NAME,
+                    kcu.COLUMN_NAME,
+                    kcu.REFERENCED_TABLE_SCHEMA = kcu.TABLE_SCHEMA,
+                    kcu.REFERENCED_TABLE_NAME,
+                    kcu.REFERENCED_COLUMN_NAME,
+                    rc.UPDATE_RULE,
+                    rc.DELETE_RULE) ORDER BY kcu.CONSTRAINT_NAME, kcu.ORDINAL_POSITION SEPARATOR '\\n')) AS checksum
+            FROM
+                information_schema.KEY_COLUMN_USAGE AS kcu
+            JOIN
+                information_schema.REFERENTIAL_CONSTRAINTS AS rc
+                ON  rc.CONSTRAINT_SCHEMA = kcu.CONSTRAINT_SCHEMA
+                AND rc.TABLE_NAME        = kcu.TABLE_NAME
+                AND rc.CONSTRAINT_NAME   = kcu.CONSTRAINT_NAME
+            WHERE
+                    kcu.TABLE_SCHEMA = ?
+                AND ??
+            GROUP BY
+                kcu.TABLE_NAME
+        ) AS f ON f.TABLE_NAME = t.TABLE_NAME
+        LEFT JOIN (
+            SELECT
+                TABLE_NAME,
+                MD5(GROUP_CONCAT(CONCAT_WS('|',
+                    PARTITION_NAME,
+                    IFNULL(SUBPARTITION_NAME, ''),
+                    PARTITION_METHOD,
+                    PARTITION_EXPRESSION,
+                    IFNULL(SUBPARTITION_METHOD, ''),
+                    IFNULL(SUBPARTITION_EXPRESSION, ''),
+                    IFNULL(PARTITION_DESCRIPTION, '')) ORDER BY PARTITION_ORDINAL_POSITION, SUBPARTITION_ORDINAL_POSITION SEPARATOR '\\n')) AS checksum
+            FROM
+                information_schema.PARTITIONS
+            WHERE
+                    TABLE_SCHEMA = ?
+                AND ??
+                AND PARTITION_NAME IS NOT NULL
+            GROUP BY
+                TABLE_NAME
+        ) AS p ON p.TABLE_NAME = t.TABLE_NAME
+        LEFT JOIN (
+            SELECT
+                TABLE_NAME,
+                MD5(CONCAT_WS('|', REPLACE(VIEW_DEFINITION, CONCAT('`', TABLE_SCHEMA, '`.'), ''), CHECK_OPTION, SECURITY_TYPE)) AS checksum
+            FROM
+                information_schema.VIEWS
+            WHERE
+                    TABLE_SCHEMA = ?
+                AND ??
+        ) AS v ON v.TABLE_NAME = t.TABLE_NAME
+        WHERE
+                t.TABLE_SCHEMA = ?
+            AND ??
+        '''
+    database  = db.config['database']
+    condition = table_filter.get_sql_condition()
+    sql_params = [
+        database, condition,
+        database, condition,
+        database, table_filter.get_sql_condition('kcu.TABLE_NAME'),
+        database, condition,
+        database, condition,
+        database, table_filter.get_sql_condition('t.TABLE_NAME'),
+    ]
+
+    trans_conn = db.start_trans()
+    try:
+        db.trans_non_query(trans_conn, 'SET SESSION group_concat_max_len = ?', [CHECKSUM_GROUP_CONCAT_MAX_LEN])
+        db_ret = db.trans_query(trans_conn, sql, sql_params)
+
+    except Exception:
+        db.rollback(trans_conn)
+        raise
+
+    else:
+        db.commit(trans_conn)
+
+    table_checksums = OrderedDict()
+    for d in sorted(db_ret, key=lambda d: d['TABLE_NAME']):
+        if table_filter.match(d['TABLE_NAME']):
+            table_checksums[d['TABLE_NAME']] = d['checksum']
+
+    return table_checksums
+
+def get_changed_table_names(base_checksums, target_checksums):
+    '''
+    返回校验和不一致（包括只存在于一侧）的表名列表，按表名排序
+    '''
+    table_names = set(base_checksums.keys()) | set(target_checksums.keys())
+    return sorted(t for t in table_names if base_checksums.get(t) != target_checksums.get(t))
+
+def get_changed_table_filter(changed_table_names):
+    '''
+    只包含校验和不一致的表的过滤条件，这些表已按原过滤条件过滤过，不再排除任何表
+    '''
+    return TableFilter(tables=changed_table_names, exclude=[])
+
+def get_mysql_schemas_two_phase(dbs, fetch_workers=None, extract_mode=None, table_filter=None):
+    '''
+    两阶段获取多个数据库的结构：
+        1. 同时计算各数据库每个表的校验和并对比
+        2. 只获取校验和不一致的表的详细结构
+    返回 (<结构列表>, <耗时列表>, <需详细对比的表名列表>)，结构中只包含校验和不一致的表，顺序与传入的`dbs`一致
+    '''
+    def _get_table_checksums(db):
+        start_time = time.time()
+        table_checksums = get_table_checksums(db, table_filter)
+        return table_checksums, time.time() - start_time
+
+    with ThreadPoolExecutor(max_workers=len(dbs)) as executor:
+        results = list(executor.map(_get_table_checksums, dbs))
+
+    checksums_list  = [r[0] for r in results]
+    checksum_times  = [r[1] for r in results]
+
+    changed_table_names = set()
+    for table_checksums in checksums_list[1:]:
+        changed_table_names.update(get_changed_table_names(checksums_list[0], table_checksums))
+
+    changed_table_names = sorted(changed_table_names)
+    if not changed_table_names:
+        return [OrderedDict() for _ in dbs], checksum_times, changed_table_names
+
+    changed_table_filter = get_changed_table_filter(changed_table_names)
+    schemas, cost_times = get_mysql_schemas_concurrently(dbs, fetch_workers, extract_mode, None, changed_table_filter)
+
+    cost_times = [a + b for a, b in zip(checksum_times, cost_times)]
+    return schemas, cost_times, changed_table_names
@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import sys
+import json
+import time
+import socket
+import signal
+import struct
+import threading
+import traceback
+import socketserver
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from mysql_helper import MySQLHelper
+
+DEFAULT_DAEMON_SOCKET = os.path.join(os.path.expanduser('~'), '.cache', 'mysql-schema-diff', 'daemon.sock')
+
+# 内存中缓存的数据库结构数量上限，超出时删除最久未使用的
+DEFAULT_DAEMON_SCHEMA_CACHE_SIZE = 16
+
+# 不提交至守护进程、始终在当前进程中执行的子命令
+LOCAL_COMMANDS = ('daemon', 'export', 'watch', 'fleet')
+
+# 守护进程只执行读取元数据的查询
+# `SET SESSION group_concat_max_len`为计算校验和时所需，只影响当前会话
+READ_ONLY_SQL_RE = re.compile(r'^\s*(?:SELECT|SHOW|DESC|DESCRIBE|EXPLAIN|SET\s+SESSION\s+group_concat_max_len\b)', re.I)
+UNSAFE_SQL_RE    = re.compile(r'\bINTO\s+(?:OUTFILE|DUMPFILE)\b|\bFOR\s+UPDATE\b|\bLOCK\s+IN\s+SHARE\s+MODE\b|;\s*[A-Za-z]', re.I)
+
+# 响应帧：<类型（1 字节）><长度（4 字节，大端）><内容>
+FRAME_HEADER = struct.Struct('>cI')
+
+FRAME_STDOUT = b'o'
+FRAME_STDERR = b'e'
+FRAME_EXIT   = b'x'
+
+FRAME_READ_SIZE = 64 * 1024
+
+def check_read_only_sql(sql):
+    '''
+    检查 SQL 模板（填充参数前）是否只读取数据，否则抛出异常
+    '''
+    if not READ_ONLY_SQL_RE.match(sql) or UNSAFE_SQL_RE.search(sql):
+        raise Exception('Only read-only metadata queries are allowed in daemon mode: `{}`'.format(re.sub(r'\s+', ' ', sql).strip()[:100]))
+
+class ReadOnlyMySQLHelper(MySQLHelper):
+    '''
+    只允许执行只读查询的`MySQLHelper`，连接池在多次任务间复用
+    '''
+    def _trans_execute(self, trans_conn, sql, sql_params=None):
+        check_read_only_sql(sql)
+        return super(ReadOnlyMySQLHelper, self)._trans_execute(trans_conn, sql, sql_params)
+
+    def _execute(self, sql, sql_params=None):
+        check_read_only_sql(sql)
+        return super(ReadOnlyMySQLHelper, self)._execute(sql, sql_params)
+
+    def iter_query(self, sql, sql_params=None):
+        # 在开始迭代前检查
+        check_read_only_sql(sql)
+        return super(ReadOnlyMySQLHelper, self).iter_query(sql, sql_params)
+
+class DaemonDBPool(object):
+    '''
+    按连接参数保存`ReadOnlyMySQLHelper`，连接建立后不会关闭，后续任务无需重新连接、认证
+    空闲连接被服务器断开时，`PooledDB`会在取出连接时检测并重新连接
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.dbs  = OrderedDict()
+
+    def get_db(self, db_option, max_connections=None):
+        key = tuple(db_option.items()) + (max_connections,)
+
+        with self.lock:
+            db = self.dbs.get(key)
+            if db is None:
+                db = self.dbs[key] = ReadOnlyMySQLHelper(OrderedDict(db_option), max_connections=max_connections)
+
+        return db
+
+    def close(self):
+        with self.lock:
+            for db in self.dbs.values():
+                db.close()
+
+            self.dbs.clear()
+
+class MemorySchemaCache(object):
+    '''
+    保存在内存中的数据库结构缓存，接口与`SnapshotCache`一致
+    与快照缓存相同，每次使用前执行一次探测查询，探测值变化时才重新获取，无需读写、反序列化快照文件
+    '''
+    def __init__(self, max_size=None):
+        self.max_size = max_size or DEFAULT_DAEMON_SCHEMA_CACHE_SIZE
+        self.lock     = threading.Lock()
+        self.schemas  = OrderedDict()
+
+    def get_cache_key(self, db, cache_scope=None):
+        return (db.config.get('host') or '127.0.0.1', str(db.config.get('port') or 3306), db.config.get('database'), cache_scope or '')
+
+    def get_mysql_schema(self, db, extract_func, cache_scope=None):
+        '''
+        返回 (<数据库结构>, <是否命中缓存>)
+        '''
+        from mysql_schema_snapshot import get_schema_probe
+
+        key = self.get_cache_key(db, cache_scope)
+
+        # 在获取结构前探测，获取期间发生的变化会在下次任务时被发现
+        probe = get_schema_probe(db)
+
+        with self.lock:
+            cached = self.schemas.get(key)
+            if cached is not None and cached[0] == probe:
+                self.schemas.move_to_end(key)
+                return cached[1], True
+
+        mysql_schemas = extract_func(db)
+
+        with self.lock:
+            self.schemas[key] = (probe, mysql_schemas)
+            self.schemas.move_to_end(key)
+
+            while len(self.schemas) > self.max_size:
+                self.schemas.popitem(last=False)
+
+        return mysql_schemas, False
+
+    def clear(self):
+        with self.lock:
+            self.schemas.clear()
+
+def get_daemon_socket_path(daemon_socket_option=None):
+    # `--daemon-socket`未指定路径时使用默认路径
+    if not daemon_socket_option or daemon_socket_option is True:
+        return DEFAULT_DAEMON_SOCKET
+
+    return daemon_socket_option
+
+def is_daemon_job(args):
+    return not (args and args[0] in LOCAL_COMMANDS)
+
+def send_frame(sock, frame_type, data):
+    sock.sendall(FRAME_HEADER.pack(frame_type, len(data)) + data)
+
+def recv_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, FRAME_READ_SIZE))
+        if not chunk:
+            raise EOFError('Daemon connection closed unexpectedly')
+
+        chunks.append(chunk)
+        size -= len(chunk)
+
+    return b''.join(chunks)
+
+def iter_frames(sock):
+    '''
+    逐个返回 (<类型>, <内容>)
+    '''
+    while True:
+        frame_type, size = FRAME_HEADER.unpack(recv_exactly(sock, FRAME_HEADER.size))
+        yield frame_type, recv_exactly(sock, size)
+
+        if frame_type == FRAME_EXIT:
+            return
+
+@contextmanager
+def redirect_std_fds(sock):
+    '''
+    将标准输出、标准错误的文件描述符重定向至管道，并以响应帧的形式转发给客户端
+    在文件描述符级别重定向，直接写入文件描述符的输出（如：`open_output`、子进程）同样会被转发
+    '''
+    send_lock = threading.Lock()
+
+    def _forward(read_fd, frame_type):
+        with os.fdopen(read_fd, 'rb', buffering=0) as _f:
+            while True:
+                data = _f.read(FRAME_READ_SIZE)
+                if not data:
+                    break
+
+                with send_lock:
+                    try:
+                        send_frame(sock, frame_type, data)
+                    except EnvironmentError:
+                        # 客户端已断开，继续读取直至管道关闭，避免任务阻塞
+                        pass
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    saved_stdout = sys.stdout
+    saved_stderr = sys.stderr
+    saved_fds    = [os.dup(1), os.dup(2)]
+
+    threads = []
+    for fd, frame_type in ((1, FRAME_STDOUT), (2, FRAME_STDERR)):
+        read_fd, write_fd = os.pipe()
+        os.dup2(write_fd, fd)
+        os.close(write_fd)
+
+        thread = threading.Thread(target=_forward, args=(read_fd, frame_type))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    try:
+        yield
+
+    finally:
+        # 任务中可能替换了`sys.stdout`（如：结构化输出时改为标准错误）
+        for stream in (sys.stdout, sys.stderr, saved_stdout, saved_stderr):
+            try:
+                stream.flush()
+            except (EnvironmentError, ValueError):
+                pass
+
+        sys.stdout = saved_stdout
+        sys.stderr = saved_stderr
+
+        # 恢复后管道写入端全部关闭，转发线程读取完剩余输出后结束
+        os.dup2(saved_fds[0], 1)
+        os.dup2(saved_fds[1], 2)
+        for fd in saved_fds:
+            os.close(fd)
+
+        for thread in threads:
+            thread.join()
+
+class SchemaDiffDaemon(object):
+    '''
+    对比任务守护进程，任务之间复用连接池、数据库结构缓存
+    任务会重定向进程的标准输出、切换工作目录，因此依次执行
+    '''
+    def __init__(self, socket_path=None, schema_cache_size=None):
+        self.socket_path  = get_daemon_socket_path(socket_path)
+        self.db_pool      = DaemonDBPool()
+        self.schema_cache = MemorySchemaCache(schema_cache_size)
+        self.job_lock     = threading.Lock()
+        self.job_count    = 0
+
+    def warm_up(self, sources, fetch_workers=None):
+        '''
+        预先建立到指定数据库的连接
+        '''
+        from mysql_schema_diff import get_mysql_option
+
+        for source in sources:
+            db_option = get_mysql_option(source)
+            self.db_pool.get_db(db_option, fetch_workers).check()
+
+            print('已连接: {}:{}/{}'.format(db_option.get('host'), db_option.get('port') or 3306, db_option.get('database')))
+
+    def run_job(self, argv):
+        '''
+        执行对比任务，返回退出码
+        '''
+        from mysql_schema_diff import get_cli_options, get_profiler, report_profile, diff_main
+
+        args, options = get_cli_options(argv)
+        options.pop('daemon-socket', None)
+
+        if not is_daemon_job(args):
+            raise Exception('Command `{}` is not supported in daemon mode'.format(args[0]))
+
+        if options.get('refresh-cache'):
+            self.schema_cache.clear()
+
+        profiler = get_profiler(options)
+        try:
+            diff_main(args, options, profiler, self.db_pool, self.schema_cache)
+
+        finally:
+            if profiler:
+                report_profile(profiler, options)
+
+            MySQLHelper.profiler = None
+
+        return 0
+
+    def handle(self, sock):
+        request = json.loads(sock.makefile('rb').readline().decode('utf-8'))
+
+        with self.job_lock:
+            self.job_count += 1
+            job_id     = self.job_count
+            start_time = time.time()
+
+            exit_code = 1
+            cwd       = os.getcwd()
+            try:
+                with redirect_std_fds(sock):
+                    try:
+                        # 客户端参数中的相对路径（快照文件、`--output`等）相对于客户端的工作目录
+                        os.chdir(request['cwd'])
+                        exit_code = self.run_job(request['argv'])
+
+                    except SystemExit as e:
+                        exit_code = e.code if isinstance(e.code, int) else 1
+
+                    except Exception:
+                        traceback.print_exc()
+
+            finally:
+                os.chdir(cwd)
+
+            print('[{}] 任务 #{} 完成，退出码 {}，耗时 {:.3f} 秒'.format(time.strftime('%Y-%m-%d %H:%M:%S'), job_id, exit_code, time.time() - start_time))
+
+        send_frame(sock, FRAME_EXIT, json.dumps({ 'exitCode': exit_code }).encode('utf-8'))
+
+    def serve_forever(self):
+        daemon = self
+
+        class _Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                try:
+                    daemon.handle(self.request)
+
+                except Exception:
+                    traceback.print_exc()
+
+        socket_dir = os.path.dirname(os.path.abspath(self.socket_path))
+        if not os.path.exists(socket_dir):
+            os.makedirs(socket_dir, mode=0o700)
+
+        if os.path.exists(self.socket_path):
+            if is_daemon_running(self.socket_path):
+                raise Exception('Daemon is already running: {}'.format(self.socket_path))
+
+            os.remove(self.socket_path)
+
+        # 任务中包含数据库密码，只允许当前用户连接
+        old_umask = os.umask(0o177)
+        try:
+            server = socketserver.ThreadingUnixStreamServer(self.socket_path, _Handler)
+        finally:
+            os.umask(old_umask)
+
+        server.daemon_threads = True
+
+        # `kill`时同样删除套接字文件、关闭连接池
+        def _on_sigterm(signum, frame):
+            raise KeyboardInterrupt()
+
+        signal.signal(signal.SIGTERM, _on_sigterm)
+
+        print('守护进程已启动: {}'.format(self.socket_path))
+        try:
+            server.serve_forever()
+
+        except KeyboardInterrupt:
+            pass
+
+        finally:
+            server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+            self.db_pool.close()
+
+            print('守护进程已退出')
+
+def is_daemon_running(socket_path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+
+    except EnvironmentError:
+        return False
+
+    else:
+        return True
+
+    finally:
+        sock.close()
+
+def submit_job(daemon_socket_option, argv):
+    '''
+    将对比任务提交至守护进程，转发其输出，返回退出码
+    '''
+    socket_path = get_daemon_socket_path(daemon_socket_option)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(socket_path)
+        except EnvironmentError as e:
+            raise Exception('Cannot connect to daemon `{}`, please start it by `python mysql_schema_diff.py daemon`: {}'.format(socket_path, e))
+
+        request = {
+            'argv': argv,
+            'cwd' : os.getcwd(),
+        }
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+
+        stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+        stderr = getattr(sys.stderr, 'buffer', sys.stderr)
+
+        for frame_type, data in iter_frames(sock):
+            if frame_type == FRAME_STDOUT:
+                stdout.write(data)
+                stdout.flush()
+
+            elif frame_type == FRAME_STDERR:
+                stderr.write(data)
+                stderr.flush()
+
+            elif frame_type == FRAME_EXIT:
+                return json.loads(data.decode('utf-8'))['exitCode']
+
+    finally:
+        sock.close()
+
+def daemon_main(args, options):
+    '''
+    启动守护进程，保持到各数据库的连接池及数据库结构缓存：
+        python mysql_schema_diff.py daemon [<预先连接的数据库> ...] [--daemon-socket=<path>]
+    之后的对比任务指定`--daemon-socket`即可提交至守护进程执行：
+        python mysql_schema_diff.py <基准数据库> <目标数据库> --daemon-socket
+    '''
+    from mysql_schema_diff import DEFAULT_FETCH_WORKERS
+
+    fetch_workers_option     = int(options.get('fetch-workers') or DEFAULT_FETCH_WORKERS)
+    schema_cache_size_option = int(options.get('schema-cache-size') or DEFAULT_DAEMON_SCHEMA_CACHE_SIZE)
+
+    daemon = SchemaDiffDaemon(options.get('daemon-socket'), schema_cache_size_option)
+    daemon.warm_up(args, fetch_workers_option)
+    daemon.serve_forever()
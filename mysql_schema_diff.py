@@ -1,11 +1,22 @@
 # -*- coding: utf-8 -*-
 
 import sys
-import json
 import re
-
-from collections import OrderedDict
+import time
+import asyncio
+
+from itertools import groupby, chain
+from operator import itemgetter
+from collections import OrderedDict, deque
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 from mysql_helper import MySQLHelper, escape_sql_param
+from mysql_schema_filter import DEFAULT_TABLE_FILTER, get_table_filter
+from mysql_ddl_parser import get_syntax_digest
+from mysql_schema_rules import DEFAULT_DIFF_RULES, load_diff_rules
+from mysql_schema_model import COLUMN_PROPS, INDEX_PROPS, FOREIGN_KEY_PROPS, PARTITION_PROPS, \
+        Column, get_column_fingerprint, get_table_syntax_digest, get_table_fingerprint, \
+        add_column_row, set_table_fingerprints
 
 COLOR_RED    = '\033[1;31m'
 COLOR_GREEN  = '\033[1;32m'
@@ -17,31 +28,13 @@ COLOR_GRAY   = '\033[1;37m'
 COLOR_WHITE  = '\033[1;38m'
 COLOR_RESET  = '\033[1;0m'
 
-COLUMN_PROPS = [
-    'TABLE_CATALOG',
-    # 'TABLE_SCHEMA',
-    'TABLE_NAME',
-    'COLUMN_NAME',
-    'ORDINAL_POSITION',
-    'COLUMN_DEFAULT',
-    'IS_NULLABLE',
-    'DATA_TYPE',
-    'CHARACTER_MAXIMUM_LENGTH',
-    'CHARACTER_OCTET_LENGTH',
-    'NUMERIC_PRECISION',
-    'NUMERIC_SCALE',
-    'DATETIME_PRECISION',
-    'CHARACTER_SET_NAME',
-    'COLLATION_NAME',
-    'COLUMN_TYPE',
-    'COLUMN_KEY',
-    'EXTRA',
-    'COLUMN_COMMENT',
-]
-
-COLUMN_SAME_PROP_VALUES = [
-    ( "'NULL'", None ),
-]
+NUMERIC_DATA_TYPES = (
+    'tinyint', 'smallint', 'mediumint', 'int', 'integer', 'bigint',
+    'decimal', 'numeric', 'float', 'double', 'real', 'bit',
+)
+
+# 默认并行获取建表语句的连接数
+DEFAULT_FETCH_WORKERS = 4
 
 def get_mysql_option(conn_str):
     conn_str = conn_str.replace('mysql://', '')
@@ -84,12 +77,287 @@ def get_mysql_option(conn_str):
 
     return mysql_option
 
-def get_mysql_schema(db):
+def get_cli_options(argv):
+    '''
+    解析命令行参数，支持`--name`、`--name=value`形式的选项
+    返回 (<位置参数列表>, <选项字典>)
+    '''
+    args    = []
+    options = OrderedDict()
+
+    for a in argv:
+        if a.startswith('--'):
+            if '=' in a:
+                k, v = a[2:].split('=', 1)
+                options[k] = v
+            else:
+                options[a[2:]] = True
+
+        else:
+            args.append(a)
+
+    return args, options
+
+def normalize_create_syntax(create_info, database):
+    '''
+    去除建表语句中与结构无关的部分，用于输出及生成迁移 SQL
+    对比时使用`mysql_ddl_parser`生成的规范化语法树，不依赖此处的处理
+    '''
+    if 'Create Table' in create_info:
+        # 表
+        syntax = create_info['Create Table']
+        syntax = re.sub(' AUTO_INCREMENT=\d+', '', syntax)
+        syntax = re.sub(' ROW_FORMAT=DYNAMIC', '', syntax)
+
+    elif 'Create View' in create_info:
+        # 视图
+        syntax = create_info['Create View']
+        syntax = re.sub(' DEFINER=`[-\w]+`', '', syntax)
+
+    # 去除数据库名，避免影响对比
+    syntax = syntax.replace('`{}`'.format(database), '`<DB>`')
+
+    return syntax
+
+def get_create_syntax(db, table_name, database=None):
+    '''
+    获取单个表的建表语句，指定`database`时获取该数据库下的表，否则获取连接配置中数据库下的表
+    '''
+    table_prefix = ''
+    if database:
+        table_prefix = '`{}`.'.format(database)
+    else:
+        database = db.config['database']
+
+    sql = '''
+        SHOW CREATE TABLE ??`??`
+    '''
+    sql_params = [table_prefix, table_name]
+    db_ret = db.query(sql, sql_params)
+
+    return normalize_create_syntax(db_ret[0], database)
+
+def get_create_syntaxes(db, table_names, fetch_workers=None, database=None):
+    '''
+    使用多个连接并行执行`SHOW CREATE TABLE`，同时执行的数量不超过`fetch_workers`
+    返回结构如下：
+        {
+            "<tableName>": <syntax>
+        }
+    '''
+    # 并发数不超过连接池大小，避免等待连接或压垮服务器
+    fetch_workers = min(fetch_workers or 1, db.max_connections)
+
+    def _get_create_syntax(table_name):
+        return get_create_syntax(db, table_name, database)
+
+    syntaxes = OrderedDict()
+    if fetch_workers <= 1 or len(table_names) <= 1:
+        for table_name in table_names:
+            syntaxes[table_name] = _get_create_syntax(table_name)
+
+    else:
+        with ThreadPoolExecutor(max_workers=fetch_workers) as executor:
+            for table_name, syntax in zip(table_names, executor.map(_get_create_syntax, table_names)):
+                syntaxes[table_name] = syntax
+
+    return syntaxes
+
+def get_bulk_queries(databases, table_filter=None):
+    '''
+    批量获取数据库结构所需的 information_schema 查询，同步（`MySQLHelper`）、异步（`AsyncMySQLHelper`）获取共用
+    返回结构如下：
+        {
+            "tables"     : (<sql>, <sql_params>),
+            "views"      : (<sql>, <sql_params>),
+            "columns"    : (<sql>, <sql_params>),
+            "indexes"    : (<sql>, <sql_params>),
+            "foreignKeys": (<sql>, <sql_params>),
+            "partitions" : (<sql>, <sql_params>),
+        }
+    '''
+    table_filter = table_filter or DEFAULT_TABLE_FILTER
+    sql_params   = [databases, table_filter.get_sql_condition()]
+
+    queries = OrderedDict()
+
+    # 表
+    sql = '''
+        SELECT
+            TABLE_SCHEMA,
+            TABLE_NAME,
+            TABLE_TYPE,
+            ENGINE,
+            TABLE_COLLATION,
+            CREATE_OPTIONS,
+            TABLE_COMMENT
+        FROM
+            information_schema.TABLES
+        WHERE
+                TABLE_SCHEMA IN (?)
+            AND ??
+        ORDER BY
+            TABLE_SCHEMA,
+            TABLE_NAME
+        '''
+    queries['tables'] = (sql, sql_params)
+
+    # 视图
+    sql = '''
+        SELECT
+            TABLE_SCHEMA,
+            TABLE_NAME,
+            VIEW_DEFINITION,
+            CHECK_OPTION,
+            SECURITY_TYPE
+        FROM
+            information_schema.VIEWS
+        WHERE
+                TABLE_SCHEMA IN (?)
+            AND ??
+        '''
+    queries['views'] = (sql, sql_params)
+
+    # 列
+    sql = '''
+        SELECT
+            TABLE_SCHEMA,
+            ??
+        FROM
+            information_schema.COLUMNS
+        WHERE
+                TABLE_SCHEMA IN (?)
+            AND ??
+            AND COLUMN_NAME NOT LIKE '\\_%'
+        ORDER BY
+            BINARY TABLE_SCHEMA,
+            BINARY TABLE_NAME,
+            ORDINAL_POSITION
+        '''
+    queries['columns'] = (sql, [', '.join(COLUMN_PROPS)] + sql_params)
+
+    # 索引
+    sql = '''
+        SELECT
+            TABLE_SCHEMA,
+            TABLE_NAME,
+            INDEX_NAME,
+            NON_UNIQUE,
+            SEQ_IN_INDEX,
+            COLUMN_NAME,
+            SUB_PART,
+            INDEX_TYPE
+        FROM
+            information_schema.STATISTICS
+        WHERE
+                TABLE_SCHEMA IN (?)
+            AND ??
+        ORDER BY
+            TABLE_SCHEMA,
+            TABLE_NAME,
+            INDEX_NAME = 'PRIMARY' DESC,
+            INDEX_NAME,
+            SEQ_IN_INDEX
+        '''
+    queries['indexes'] = (sql, sql_params)
+
+    # 外键
+    sql = '''
+        SELECT
+            kcu.TABLE_SCHEMA,
+            kcu.TABLE_NAME,
+            kcu.CONSTRAINT_NAME,
+            kcu.COLUMN_NAME,
+            kcu.REFERENCED_TABLE_SCHEMA,
+            kcu.REFERENCED_TABLE_NAME,
+            kcu.REFERENCED_COLUMN_NAME,
+            rc.UPDATE_RULE,
+            rc.DELETE_RULE
+        FROM
+            information_schema.KEY_COLUMN_USAGE AS kcu
+        JOIN
+            information_schema.REFERENTIAL_CONSTRAINTS AS rc
+            ON  rc.CONSTRAINT_SCHEMA = kcu.CONSTRAINT_SCHEMA
+            AND rc.TABLE_NAME        = kcu.TABLE_NAME
+            AND rc.CONSTRAINT_NAME   = kcu.CONSTRAINT_NAME
+        WHERE
+                kcu.TABLE_SCHEMA IN (?)
+            AND ??
+        ORDER BY
+            kcu.TABLE_SCHEMA,
+            kcu.TABLE_NAME,
+            kcu.CONSTRAINT_NAME,
+            kcu.ORDINAL_POSITION
+        '''
+    queries['foreignKeys'] = (sql, [databases, table_filter.get_sql_condition('kcu.TABLE_NAME')])
+
+    # 分区
+    sql = '''
+        SELECT
+            TABLE_SCHEMA,
+            TABLE_NAME,
+            PARTITION_NAME,
+            SUBPARTITION_NAME,
+            PARTITION_METHOD,
+            PARTITION_EXPRESSION,
+            SUBPARTITION_METHOD,
+            SUBPARTITION_EXPRESSION,
+            PARTITION_DESCRIPTION
+        FROM
+            information_schema.PARTITIONS
+        WHERE
+                TABLE_SCHEMA IN (?)
+            AND ??
+            AND PARTITION_NAME IS NOT NULL
+        ORDER BY
+            TABLE_SCHEMA,
+            TABLE_NAME,
+            PARTITION_ORDINAL_POSITION,
+            SUBPARTITION_ORDINAL_POSITION
+        '''
+    queries['partitions'] = (sql, sql_params)
+
+    return queries
+
+def filter_column_rows(column_rows, table_filter):
+    '''
+    SQL 中的匹配可能不区分大小写，再按表精确过滤一次
+    '''
+    for _, table_column_rows in groupby(column_rows, key=itemgetter('TABLE_SCHEMA', 'TABLE_NAME')):
+        first_row = next(table_column_rows)
+        if not table_filter.match(first_row['TABLE_NAME']):
+            continue
+
+        yield first_row
+        for r in table_column_rows:
+            yield r
+
+def iter_column_rows(db, databases=None, table_filter=None):
+    '''
+    流式获取所有列的属性，只查询`COLUMN_PROPS`中的字段，并在 SQL 中过滤`_`开头的列
+    表过滤条件`table_filter`下推至 SQL 中，未指定时使用默认条件（排除`_`开头的表）
+    结果按 TABLE_SCHEMA, TABLE_NAME（二进制顺序，与 Python 字符串排序一致）, ORDINAL_POSITION 排序
+    '''
+    table_filter = table_filter or DEFAULT_TABLE_FILTER
+
+    sql, sql_params = get_bulk_queries(databases or [db.config['database']], table_filter)['columns']
+    return filter_column_rows(db.iter_query(sql, sql_params), table_filter)
+
+def iter_column_rows_by_database(db, databases, table_filter=None):
+    '''
+    按数据库分组流式返回 (<数据库名>, <列属性迭代器>)
+    '''
+    for database, column_rows in groupby(iter_column_rows(db, databases, table_filter), key=itemgetter('TABLE_SCHEMA')):
+        yield database, column_rows
+
+def get_mysql_schema(db, fetch_workers=None, extract_mode=None, table_filter=None):
     '''
     返回结构如下：
         {
             "<tableName>": {
-                "syntax": <str>,
+                "syntax"      : <str>,
+                "syntaxDigest": <bytes>,
+                "fingerprint" : <bytes>,
                 "columns": {
                     "<columnName>": {
                         "TABLE_CATALOG"           : <value>,
@@ -113,70 +381,764 @@ def get_mysql_schema(db):
                 }
             }
         }
+
+    其中各列为`Column`对象，如需纯 dict 形式，可使用`mysql_schema_model.export_mysql_schema`导出
+    只获取符合`table_filter`（`TableFilter`）的表，未指定时排除`_`开头的表
     '''
-    mysql_schemas = OrderedDict()
+    database = db.config['database']
+    return get_mysql_schemas(db, [database], fetch_workers, extract_mode, table_filter)[database]
+
+def iter_mysql_schema(db, fetch_workers=None, table_filter=None):
+    '''
+    流式获取数据库结构，每获取完一个表立即返回 (<tableName>, <table>)，按表名排序
+    列信息读取完毕的表会立即提交获取建表语句，同时进行中的`SHOW CREATE TABLE`不超过`fetch_workers`
+    '''
+    fetch_workers = fetch_workers or 1
+
+    # 流式读取列信息时会一直占用一个连接，连接池中需额外保留一个连接用于获取建表语句，否则会一直等待空闲连接
+    if db.max_connections <= fetch_workers:
+        raise Exception('Streaming requires `max_connections` > `fetch_workers` ({} <= {}), open the source with `stream=True`'.format(
+                db.max_connections, fetch_workers))
+
+    # 索引、外键、分区信息数据量较小，预先一次获取
+    database = db.config['database']
+    index_rows, fk_rows, partition_rows = query_table_metadata_rows(db, [database], table_filter)
+    table_metadata = build_table_metadata(database,
+            index_rows.get(database, []),
+            fk_rows.get(database, []),
+            partition_rows.get(database, []))
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=fetch_workers) as executor:
+        def _pop_table():
+            table_name, table, future = pending.popleft()
+            table['syntax']       = future.result()
+            table['syntaxDigest'] = get_syntax_digest(table['syntax'])
+            table['fingerprint']  = get_table_fingerprint(table)
+            return table_name, table
+
+        for _, column_rows in iter_column_rows_by_database(db, None, table_filter):
+            for table_name, table_column_rows in groupby(column_rows, key=itemgetter('TABLE_NAME')):
+                table = {
+                    'syntax'      : None,
+                    'syntaxDigest': None,
+                    'fingerprint' : None,
+                    'columns'     : {},
+                }
+                for r in table_column_rows:
+                    table['columns'][r['COLUMN_NAME']] = Column(r)
+
+                set_table_metadata({ table_name: table }, table_metadata)
+
+                pending.append((table_name, table, executor.submit(get_create_syntax, db, table_name)))
+
+                while len(pending) > fetch_workers:
+                    yield _pop_table()
+
+        while pending:
+            yield _pop_table()
+
+def get_mysql_schemas(db, databases, fetch_workers=None, extract_mode=None, table_filter=None):
+    '''
+    一次查询获取同一服务器上多个数据库的结构（`TABLE_SCHEMA IN (...)`）
+    返回结构如下：
+        {
+            "<database>": <与`get_mysql_schema`返回结构一致>
+        }
+    '''
+    if extract_mode == 'bulk':
+        return get_mysql_schemas_bulk(db, databases, table_filter)
+
+    mysql_schemas_map = OrderedDict((database, OrderedDict()) for database in databases)
 
     # 获取所有表.列结构
-    sql = '''
-        SELECT
-            *
-        FROM
-            information_schema.columns
-        where
-            TABLE_SCHEMA = ?
-        ORDER BY
-            TABLE_NAME,
-            ORDINAL_POSITION
-        '''
-    sql_params = [db.config['database']]
-    db_ret = db.query(sql, sql_params)
-    for r in db_ret:
-        table_name  = r['TABLE_NAME']
-        column_name = r['COLUMN_NAME']
+    for database, column_rows in iter_column_rows_by_database(db, databases, table_filter):
+        mysql_schemas = mysql_schemas_map.setdefault(database, OrderedDict())
+        for r in column_rows:
+            add_column_row(mysql_schemas, r)
 
-        if table_name.startswith('_') or column_name.startswith('_'):
-            continue
+    # 获取所有索引、外键、分区
+    index_rows, fk_rows, partition_rows = query_table_metadata_rows(db, databases, table_filter)
 
-        if table_name not in mysql_schemas:
-            mysql_schemas[table_name] = {
-                'syntax' : None,
-                'columns': OrderedDict(),
+    # 获取所有建表语句
+    for database, mysql_schemas in mysql_schemas_map.items():
+        syntaxes = get_create_syntaxes(db, list(mysql_schemas.keys()), fetch_workers,
+                database=None if database == db.config['database'] else database)
+        for table_name, syntax in syntaxes.items():
+            mysql_schemas[table_name]['syntax'] = syntax
+
+        table_metadata = build_table_metadata(database,
+                index_rows.get(database, []),
+                fk_rows.get(database, []),
+                partition_rows.get(database, []))
+        set_table_metadata(mysql_schemas, table_metadata)
+
+        set_table_fingerprints(mysql_schemas)
+
+    return mysql_schemas_map
+
+def quote_identifier(name):
+    '''
+    为标识符（表名、列名、索引名等）加上反引号，名称中的反引号转义为两个反引号
+    '''
+    return '`{}`'.format(name.replace('`', '``'))
+
+def get_column_definition(column):
+    '''
+    根据列属性生成列定义，如：
+        `name` varchar(64) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci NOT NULL DEFAULT '' COMMENT '名称'
+    '''
+    definition = [quote_identifier(column['COLUMN_NAME']), column['COLUMN_TYPE']]
+
+    if column['CHARACTER_SET_NAME']:
+        definition.append('CHARACTER SET {}'.format(column['CHARACTER_SET_NAME']))
+    if column['COLLATION_NAME']:
+        definition.append('COLLATE {}'.format(column['COLLATION_NAME']))
+
+    is_nullable = column['IS_NULLABLE'] == 'YES'
+    definition.append('NULL' if is_nullable else 'NOT NULL')
+
+    extra          = column['EXTRA'] or ''
+    column_default = column['COLUMN_DEFAULT']
+    if column_default is None:
+        if is_nullable:
+            definition.append('DEFAULT NULL')
+
+    elif 'DEFAULT_GENERATED' in extra \
+            or column_default.upper().startswith('CURRENT_TIMESTAMP') \
+            or column_default.startswith("'") \
+            or column_default.upper() == 'NULL':
+        # 表达式、或已带引号（MariaDB）的默认值
+        definition.append('DEFAULT {}'.format(column_default))
+
+    elif column['DATA_TYPE'] in NUMERIC_DATA_TYPES:
+        definition.append('DEFAULT {}'.format(column_default))
+
+    else:
+        definition.append('DEFAULT {}'.format(escape_sql_param(column_default)))
+
+    extra = extra.replace('DEFAULT_GENERATED', '').strip()
+    if extra:
+        definition.append(extra.upper())
+
+    if column['COLUMN_COMMENT']:
+        definition.append('COMMENT {}'.format(escape_sql_param(column['COLUMN_COMMENT'])))
+
+    return ' '.join(definition)
+
+def get_index_definition(index_name, index_info):
+    index_columns = index_info['COLUMNS']
+
+    if index_name == 'PRIMARY':
+        return 'PRIMARY KEY ({})'.format(index_columns)
+
+    index_type = index_info['INDEX_TYPE']
+    if index_type in ('FULLTEXT', 'SPATIAL'):
+        return '{} KEY {} ({})'.format(index_type, quote_identifier(index_name), index_columns)
+
+    definition = '{}KEY {} ({})'.format('' if index_info['NON_UNIQUE'] else 'UNIQUE ', quote_identifier(index_name), index_columns)
+    if index_type and index_type != 'BTREE':
+        definition += ' USING {}'.format(index_type)
+
+    return definition
+
+def get_foreign_key_definition(constraint_name, fk_info):
+    definition = 'CONSTRAINT {} FOREIGN KEY ({}) REFERENCES {} ({})'.format(
+            quote_identifier(constraint_name), fk_info['COLUMNS'], fk_info['REFERENCED_TABLE'], fk_info['REFERENCED_COLUMNS'])
+
+    if fk_info['DELETE_RULE'] and fk_info['DELETE_RULE'] != 'RESTRICT':
+        definition += ' ON DELETE {}'.format(fk_info['DELETE_RULE'])
+    if fk_info['UPDATE_RULE'] and fk_info['UPDATE_RULE'] != 'RESTRICT':
+        definition += ' ON UPDATE {}'.format(fk_info['UPDATE_RULE'])
+
+    return definition
+
+def get_partition_definition(partition_info):
+    definition = 'PARTITION BY {} ({})'.format(partition_info['PARTITION_METHOD'], partition_info['PARTITION_EXPRESSION'])
+    if partition_info['SUBPARTITION_METHOD']:
+        definition += ' SUBPARTITION BY {} ({}) SUBPARTITIONS {}'.format(partition_info['SUBPARTITION_METHOD'],
+                partition_info['SUBPARTITION_EXPRESSION'], partition_info['SUBPARTITIONS'])
+
+    definition += '\n({})'.format(partition_info['PARTITIONS'])
+    return definition
+
+def group_rows_by_database(rows, key='TABLE_SCHEMA'):
+    rows_map = {}
+    for r in rows:
+        rows_map.setdefault(r[key], []).append(r)
+
+    return rows_map
+
+def query_table_metadata_rows(db, databases, table_filter=None):
+    '''
+    批量查询索引、外键、分区信息，查询次数与表数量无关
+    返回 (<索引数据>, <外键数据>, <分区数据>)，均按数据库分组：
+        {
+            "<database>": [ <row>, ... ]
+        }
+    '''
+    queries = get_bulk_queries(databases, table_filter)
+
+    index_rows     = group_rows_by_database(db.query(*queries['indexes']))
+    fk_rows        = group_rows_by_database(db.query(*queries['foreignKeys']))
+    partition_rows = group_rows_by_database(db.query(*queries['partitions']))
+
+    return index_rows, fk_rows, partition_rows
+
+def build_table_metadata(database, index_rows, fk_rows, partition_rows):
+    '''
+    根据查询得到的数据构建各表的索引、外键、分区信息
+    返回结构如下：
+        {
+            "<tableName>": {
+                "indexes": {
+                    "<indexName>": {
+                        "NON_UNIQUE": <int>,
+                        "INDEX_TYPE": <str>,
+                        "COLUMNS"   : <str>,  # 如："`a`,`b`(10)"，包含列顺序及前缀长度
+                    }
+                },
+                "foreignKeys": {
+                    "<constraintName>": {
+                        "COLUMNS"           : <str>,
+                        "REFERENCED_TABLE"  : <str>,
+                        "REFERENCED_COLUMNS": <str>,
+                        "UPDATE_RULE"       : <str>,
+                        "DELETE_RULE"       : <str>,
+                    }
+                },
+                "partition": None | {
+                    "PARTITION_METHOD"       : <str>,
+                    "PARTITION_EXPRESSION"   : <str>,
+                    "SUBPARTITION_METHOD"    : <str>,
+                    "SUBPARTITION_EXPRESSION": <str>,
+                    "SUBPARTITIONS"          : <int>,  # 每个分区的子分区数量
+                    "PARTITIONS"             : <str>,  # 如："PARTITION `p0` VALUES LESS THAN (100), ..."
+                }
+            }
+        }
+    '''
+    table_metadata = {}
+
+    def _get_metadata(table_name):
+        if table_name not in table_metadata:
+            table_metadata[table_name] = {
+                'indexes'    : OrderedDict(),
+                'foreignKeys': OrderedDict(),
+                'partition'  : None,
             }
 
-        if column_name not in mysql_schemas[table_name]['columns']:
-            mysql_schemas[table_name]['columns'][column_name] = {}
+        return table_metadata[table_name]
 
-        for p in COLUMN_PROPS:
-            mysql_schemas[table_name]['columns'][column_name][p] = r[p]
+    # 索引
+    for r in index_rows:
+        indexes = _get_metadata(r['TABLE_NAME'])['indexes']
 
+        index_column = quote_identifier(r['COLUMN_NAME'])
+        if r['SUB_PART']:
+            index_column += '({})'.format(r['SUB_PART'])
 
-    # 获取所有建表语句
-    for table_name, _ in mysql_schemas.items():
-        sql = '''
-            SHOW CREATE TABLE `??`
-        '''
-        sql_params = [table_name]
-        db_ret = db.query(sql, sql_params)
+        if r['INDEX_NAME'] in indexes:
+            indexes[r['INDEX_NAME']]['COLUMNS'] += ',' + index_column
+        else:
+            indexes[r['INDEX_NAME']] = OrderedDict([
+                ('NON_UNIQUE', int(r['NON_UNIQUE'])),
+                ('INDEX_TYPE', r['INDEX_TYPE']),
+                ('COLUMNS'   , index_column),
+            ])
+
+    # 外键
+    for r in fk_rows:
+        fks = _get_metadata(r['TABLE_NAME'])['foreignKeys']
+
+        column            = quote_identifier(r['COLUMN_NAME'])
+        referenced_column = quote_identifier(r['REFERENCED_COLUMN_NAME'])
+
+        if r['CONSTRAINT_NAME'] in fks:
+            fks[r['CONSTRAINT_NAME']]['COLUMNS']            += ',' + column
+            fks[r['CONSTRAINT_NAME']]['REFERENCED_COLUMNS'] += ',' + referenced_column
+
+        else:
+            referenced_table = quote_identifier(r['REFERENCED_TABLE_NAME'])
+            if r['REFERENCED_TABLE_SCHEMA'] != database:
+                referenced_table = '{}.{}'.format(quote_identifier(r['REFERENCED_TABLE_SCHEMA']), referenced_table)
+
+            fks[r['CONSTRAINT_NAME']] = OrderedDict([
+                ('COLUMNS'           , column),
+                ('REFERENCED_TABLE'  , referenced_table),
+                ('REFERENCED_COLUMNS', referenced_column),
+                ('UPDATE_RULE'       , r['UPDATE_RULE']),
+                ('DELETE_RULE'       , r['DELETE_RULE']),
+            ])
+
+    # 分区
+    for r in partition_rows:
+        metadata = _get_metadata(r['TABLE_NAME'])
+
+        if metadata['partition'] is None:
+            metadata['partition'] = OrderedDict([
+                ('PARTITION_METHOD'       , r['PARTITION_METHOD']),
+                ('PARTITION_EXPRESSION'   , r['PARTITION_EXPRESSION']),
+                ('SUBPARTITION_METHOD'    , r['SUBPARTITION_METHOD']),
+                ('SUBPARTITION_EXPRESSION', r['SUBPARTITION_EXPRESSION']),
+                ('SUBPARTITIONS'          , None),
+                ('PARTITIONS'             , []),
+            ])
+
+        partition = metadata['partition']
+
+        partition_definition = 'PARTITION {}'.format(quote_identifier(r['PARTITION_NAME']))
+        if r['PARTITION_DESCRIPTION'] is not None:
+            if r['PARTITION_METHOD'].startswith('RANGE'):
+                partition_definition += ' VALUES LESS THAN ({})'.format(r['PARTITION_DESCRIPTION'])
+            elif r['PARTITION_METHOD'].startswith('LIST'):
+                partition_definition += ' VALUES IN ({})'.format(r['PARTITION_DESCRIPTION'])
+
+        if not partition['PARTITIONS'] or partition['PARTITIONS'][-1] != partition_definition:
+            partition['PARTITIONS'].append(partition_definition)
+
+        if r['SUBPARTITION_NAME'] and len(partition['PARTITIONS']) == 1:
+            # 各分区的子分区数量相同
+            partition['SUBPARTITIONS'] = (partition['SUBPARTITIONS'] or 0) + 1
+
+    for metadata in table_metadata.values():
+        if metadata['partition'] is not None:
+            metadata['partition']['PARTITIONS'] = ',\n '.join(metadata['partition']['PARTITIONS'])
+
+    return table_metadata
+
+def set_table_metadata(mysql_schemas, table_metadata):
+    for table_name, table in mysql_schemas.items():
+        metadata = table_metadata.get(table_name) or {}
+
+        table['indexes']     = metadata.get('indexes')     or OrderedDict()
+        table['foreignKeys'] = metadata.get('foreignKeys') or OrderedDict()
+        table['partition']   = metadata.get('partition')
+
+def build_mysql_schema_bulk(database, table_rows, column_rows, index_rows, fk_rows, view_rows, partition_rows=None):
+    '''
+    根据 information_schema 中查询得到的数据构建数据库结构
+    返回结构与`get_mysql_schema`一致，其中`syntax`为根据元数据生成的规范化建表语句
+    '''
+    mysql_schemas = OrderedDict()
+
+    for r in column_rows:
+        add_column_row(mysql_schemas, r)
+
+    # 索引、外键、分区
+    set_table_metadata(mysql_schemas, build_table_metadata(database, index_rows, fk_rows, partition_rows or []))
+
+    # 视图
+    view_definitions = {}
+    for r in view_rows:
+        view_definitions[r['TABLE_NAME']] = r
+
+    # 生成建表语句
+    for r in table_rows:
+        table_name = r['TABLE_NAME']
+        if table_name not in mysql_schemas:
+            continue
+
+        table = mysql_schemas[table_name]
+
+        if r['TABLE_TYPE'] == 'VIEW':
+            view_info = view_definitions.get(table_name) or {}
+            syntax = 'CREATE SQL SECURITY {} VIEW {} AS {}'.format(
+                    view_info.get('SECURITY_TYPE'), quote_identifier(table_name), view_info.get('VIEW_DEFINITION'))
+
+            if view_info.get('CHECK_OPTION') and view_info['CHECK_OPTION'] != 'NONE':
+                syntax += ' WITH {} CHECK OPTION'.format(view_info['CHECK_OPTION'])
+
+        else:
+            definitions = []
+            for column in table['columns'].values():
+                definitions.append(get_column_definition(column))
+
+            for index_name, index_info in table['indexes'].items():
+                definitions.append(get_index_definition(index_name, index_info))
+
+            for constraint_name, fk_info in table['foreignKeys'].items():
+                definitions.append(get_foreign_key_definition(constraint_name, fk_info))
 
-        if 'Create Table' in db_ret[0]:
-            # 表
-            syntax = db_ret[0]['Create Table']
-            syntax = re.sub(' AUTO_INCREMENT=\d+', '', syntax)
-            syntax = re.sub(' ROW_FORMAT=DYNAMIC', '', syntax)
+            syntax = 'CREATE TABLE {} (\n  {}\n) ENGINE={} DEFAULT COLLATE={}'.format(
+                    quote_identifier(table_name), ',\n  '.join(definitions), r['ENGINE'], r['TABLE_COLLATION'])
 
-        elif 'Create View' in db_ret[0]:
-            # 视图
-            syntax = db_ret[0]['Create View']
-            syntax = re.sub(' DEFINER=`[-\w]+`', '', syntax)
+            create_options = re.sub('row_format=dynamic|partitioned', '', r['CREATE_OPTIONS'] or '', flags=re.I).strip()
+            if create_options:
+                syntax += ' ' + create_options.upper()
+
+            if r['TABLE_COMMENT']:
+                syntax += ' COMMENT={}'.format(escape_sql_param(r['TABLE_COMMENT']))
+
+            if table['partition']:
+                syntax += '\n' + get_partition_definition(table['partition'])
 
         # 去除数据库名，避免影响对比
-        syntax = syntax.replace('`{}`'.format(db.config['database']), '`<DB>`')
+        syntax = syntax.replace('`{}`'.format(database), '`<DB>`')
+
+        table['syntax'] = syntax
+
+    set_table_fingerprints(mysql_schemas)
+
+    return mysql_schemas
+
+def get_mysql_schema_bulk(db, table_filter=None):
+    '''
+    使用固定数量的 information_schema 批量查询获取数据库结构，查询次数与表数量无关
+    返回结构与`get_mysql_schema`一致
+    '''
+    database = db.config['database']
+    return get_mysql_schemas_bulk(db, [database], table_filter)[database]
+
+def get_mysql_schemas_bulk(db, databases, table_filter=None):
+    '''
+    使用固定数量的 information_schema 批量查询获取同一服务器上多个数据库的结构
+    查询次数与数据库、表的数量均无关
+    返回结构与`get_mysql_schemas`一致
+    '''
+    queries = get_bulk_queries(databases, table_filter)
+
+    # 表、视图
+    table_rows = group_rows_by_database(db.query(*queries['tables']))
+    view_rows  = group_rows_by_database(db.query(*queries['views']))
+
+    # 索引、外键、分区
+    index_rows, fk_rows, partition_rows = query_table_metadata_rows(db, databases, table_filter)
+
+    # 列（流式读取，按数据库逐个构建）
+    mysql_schemas_map = OrderedDict((database, OrderedDict()) for database in databases)
+    for database, column_rows in iter_column_rows_by_database(db, databases, table_filter):
+        mysql_schemas_map[database] = build_mysql_schema_bulk(database,
+                table_rows.get(database, []),
+                column_rows,
+                index_rows.get(database, []),
+                fk_rows.get(database, []),
+                view_rows.get(database, []),
+                partition_rows.get(database, []))
+
+    return mysql_schemas_map
+
+async def get_mysql_schemas_bulk_async(db, databases, table_filter=None):
+    '''
+    使用`AsyncMySQLHelper`获取同一服务器上多个数据库的结构，各 information_schema 查询同时执行
+    返回结构与`get_mysql_schemas_bulk`一致
+    '''
+    table_filter = table_filter or DEFAULT_TABLE_FILTER
+    queries = get_bulk_queries(databases, table_filter)
+
+    results = await asyncio.gather(*(db.query(sql, sql_params) for sql, sql_params in queries.values()))
+    rows_map = dict(zip(queries.keys(), results))
+
+    table_rows     = group_rows_by_database(rows_map['tables'])
+    view_rows      = group_rows_by_database(rows_map['views'])
+    column_rows    = group_rows_by_database(filter_column_rows(rows_map['columns'], table_filter))
+    index_rows     = group_rows_by_database(rows_map['indexes'])
+    fk_rows        = group_rows_by_database(rows_map['foreignKeys'])
+    partition_rows = group_rows_by_database(rows_map['partitions'])
+
+    mysql_schemas_map = OrderedDict()
+    for database in databases:
+        mysql_schemas_map[database] = build_mysql_schema_bulk(database,
+                table_rows.get(database, []),
+                column_rows.get(database, []),
+                index_rows.get(database, []),
+                fk_rows.get(database, []),
+                view_rows.get(database, []),
+                partition_rows.get(database, []))
+
+    return mysql_schemas_map
+
+async def get_mysql_schema_async(db, table_filter=None):
+    '''
+    使用`AsyncMySQLHelper`获取数据库结构，只执行固定数量的 information_schema 批量查询
+    返回结构与`get_mysql_schema`一致
+    '''
+    database = db.config['database']
+    return (await get_mysql_schemas_bulk_async(db, [database], table_filter))[database]
+
+async def get_mysql_schemas_async(dbs, table_filter=None):
+    '''
+    在同一事件循环中同时获取多个数据库的结构，返回结构列表，顺序与传入的`dbs`一致
+    '''
+    return list(await asyncio.gather(*(get_mysql_schema_async(db, table_filter) for db in dbs)))
+
+def load_mysql_schema(db, fetch_workers=None, extract_mode=None, snapshot_cache=None, table_filter=None):
+    '''
+    获取数据库结构，`db`为快照文件路径时直接读取快照，指定`snapshot_cache`时优先使用快照缓存
+    读取快照时同样按`table_filter`过滤，保证与从数据库获取的结构可比
+    '''
+    table_filter = table_filter or DEFAULT_TABLE_FILTER
+
+    if isinstance(db, str):
+        from mysql_schema_snapshot import load_snapshot
+
+        mysql_schemas, meta = load_snapshot(db)
+        return table_filter.filter_schema(mysql_schemas)
 
-        mysql_schemas[table_name]['syntax'] = syntax
+    if snapshot_cache is None:
+        return get_mysql_schema(db, fetch_workers, extract_mode, table_filter)
+
+    def _extract(db):
+        return get_mysql_schema(db, fetch_workers, extract_mode, table_filter)
+
+    cache_scope = (extract_mode or 'show') + table_filter.get_cache_scope()
+    mysql_schemas, cache_hit = snapshot_cache.get_mysql_schema(db, _extract, cache_scope)
+    if cache_hit:
+        print('使用快照缓存: {}/{}'.format(db.config.get('host'), db.config.get('database')))
 
     return mysql_schemas
 
-def compare_schema(base_schema, target_schema):
+def get_mysql_schemas_concurrently(dbs, fetch_workers=None, extract_mode=None, snapshot_cache=None, table_filter=None):
+    '''
+    同时获取多个数据库的结构，每个数据库使用一个独立线程
+    返回 (<结构列表>, <耗时列表>)，顺序与传入的`dbs`一致
+    '''
+    def _get_mysql_schema(db):
+        start_time = time.time()
+        schema = load_mysql_schema(db, fetch_workers, extract_mode, snapshot_cache, table_filter)
+        return schema, time.time() - start_time
+
+    with ThreadPoolExecutor(max_workers=len(dbs)) as executor:
+        results = list(executor.map(_get_mysql_schema, dbs))
+
+    schemas    = [r[0] for r in results]
+    cost_times = [r[1] for r in results]
+    return schemas, cost_times
+
+def compare_table(base_table, target_table, rules=None):
+    '''
+    对比单个表，表结构一致时返回 None
+    `rules`为对比规则（`DiffRules`），默认为`DEFAULT_DIFF_RULES`
+    返回结构与`compare_schema`中的"<tableName>"部分一致
+    '''
+    rules = rules or DEFAULT_DIFF_RULES
+
+    diff = {
+        'tableAdded'        : False,
+        'tableRemoved'      : False,
+        'syntaxChanged'     : False,
+        'changedColumns'    : OrderedDict(),
+        'changedIndexes'    : OrderedDict(),
+        'changedForeignKeys': OrderedDict(),
+        'partitionChanges'  : OrderedDict(),
+    }
+
+    if (base_table is None) and (target_table is None):
+        # 两侧均不存在（如：监控过程中新增后又被删除的表）
+        return None
+
+    elif (base_table is None) and (target_table is not None):
+        # 表增加
+        diff['tableAdded'] = True
+        return diff
+
+    elif (base_table is not None) and (target_table is None):
+        # 表删除
+        diff['tableRemoved'] = True
+        return diff
+
+    # 指纹相同，表结构必然一致
+    if get_table_fingerprint(base_table, rules) == get_table_fingerprint(target_table, rules):
+        return None
+
+    # 继续对比建表语句（规范化的语法树，忽略不同版本的格式差异）
+    # 非默认规则可能去除了默认的规范化，此时建表语句相同不代表表结构一致
+    syntax_same = get_table_syntax_digest(base_table) == get_table_syntax_digest(target_table)
+    if syntax_same and rules.is_default:
+        return None
+
+    diff['syntaxChanged'] = True
+
+    # 继续比较各列（先按基准数据库中的顺序，再按目标数据库中的顺序列出多余列）
+    base_columns   = base_table['columns']
+    target_columns = target_table['columns']
+
+    column_names = list(base_columns.keys())
+    column_names.extend(c for c in target_columns.keys() if c not in base_columns)
+
+    column_props = rules.get_props('column', COLUMN_PROPS)
+
+    for column_name in column_names:
+        base_column  = base_columns.get(column_name)
+        target_column = target_columns.get(column_name)
+
+        if rules.is_ignored_column(base_column if base_column is not None else target_column):
+            continue
+
+        col_diff = {
+            'columnAdded'  : False,
+            'columnRemoved': False,
+            'columnChanges': OrderedDict(),
+        }
+
+        if (base_column is None) and (target_column is not None):
+            # 列增加
+            col_diff['columnAdded'] = True
+            diff['changedColumns'][column_name] = col_diff
+
+        elif (base_column is not None) and (target_column is None):
+            # 列删除
+            col_diff['columnRemoved'] = True
+            diff['changedColumns'][column_name] = col_diff
+
+        elif get_column_fingerprint(base_column, rules) == get_column_fingerprint(target_column, rules):
+            # 指纹相同，列属性必然一致
+            continue
+
+        else:
+            # 继续比较各列属性
+            for prop in column_props:
+                # 不同版本兼容
+                base_prop   = rules.normalize_column_prop(prop, base_column[prop])
+                target_prop = rules.normalize_column_prop(prop, target_column[prop])
+
+                # 比较（同义值视为相同）
+                if base_prop != target_prop and not rules.is_equivalent(prop, base_prop, target_prop):
+                    col_diff['columnChanges'][prop] = {
+                        'base'  : base_prop,
+                        'target': target_prop,
+                    }
+
+            if col_diff['columnChanges']:
+                diff['changedColumns'][column_name] = col_diff
+
+    # 继续比较索引、外键
+    diff['changedIndexes'] = compare_table_objects(
+            base_table.get('indexes'), target_table.get('indexes'), rules.get_props('index', INDEX_PROPS), 'index')
+    diff['changedForeignKeys'] = compare_table_objects(
+            base_table.get('foreignKeys'), target_table.get('foreignKeys'), rules.get_props('foreignKey', FOREIGN_KEY_PROPS), 'foreignKey')
+
+    # 继续比较分区
+    base_partition   = base_table.get('partition')   or {}
+    target_partition = target_table.get('partition') or {}
+    for prop in rules.get_props('partition', PARTITION_PROPS):
+        if base_partition.get(prop) != target_partition.get(prop):
+            diff['partitionChanges'][prop] = {
+                'base'  : base_partition.get(prop),
+                'target': target_partition.get(prop),
+            }
+
+    # 差异均被规则忽略，且建表语句相同或被忽略
+    if not (diff['changedColumns'] or diff['changedIndexes'] or diff['changedForeignKeys'] or diff['partitionChanges']):
+        if syntax_same or rules.ignore_table_syntax:
+            return None
+
+    return diff
+
+def compare_table_objects(base_objects, target_objects, props, diff_prefix):
+    '''
+    按名称对比表中的索引或外键，`diff_prefix`为差异中的键名前缀（如："index"）
+    返回结构如下：
+        {
+            "<name>": {
+                "<diff_prefix>Added"  : True|False,
+                "<diff_prefix>Removed": True|False,
+                "<diff_prefix>Changes": {
+                    "<prop>": {
+                        "base"  : <value>,
+                        "target": <value>,
+                    }
+                }
+            }
+        }
+    '''
+    base_objects   = base_objects   or {}
+    target_objects = target_objects or {}
+
+    names = list(base_objects.keys())
+    names.extend(n for n in target_objects.keys() if n not in base_objects)
+
+    changed_objects = OrderedDict()
+    for name in names:
+        base_object   = base_objects.get(name)
+        target_object = target_objects.get(name)
+
+        object_diff = {
+            diff_prefix + 'Added'  : False,
+            diff_prefix + 'Removed': False,
+            diff_prefix + 'Changes': OrderedDict(),
+        }
+
+        if base_object is None:
+            object_diff[diff_prefix + 'Added'] = True
+
+        elif target_object is None:
+            object_diff[diff_prefix + 'Removed'] = True
+
+        else:
+            for prop in props:
+                if base_object[prop] != target_object[prop]:
+                    object_diff[diff_prefix + 'Changes'][prop] = {
+                        'base'  : base_object[prop],
+                        'target': target_object[prop],
+                    }
+
+            if not object_diff[diff_prefix + 'Changes']:
+                continue
+
+        changed_objects[name] = object_diff
+
+    return changed_objects
+
+def iter_sorted_tables(schema):
+    '''
+    将数据库结构转换为按表名排序的 (<tableName>, <table>) 迭代器
+    `schema`可以是 dict 形式的数据库结构，也可以是已按表名排序的迭代器（如`iter_mysql_schema`）
+    '''
+    if hasattr(schema, 'items'):
+        return iter(sorted(schema.items(), key=itemgetter(0)))
+
+    return iter(schema)
+
+def iter_table_pairs(base_schema, target_schema):
+    '''
+    以归并的方式按表名顺序逐个返回 (<tableName>, <基准表 | None>, <目标表 | None>)
+    '''
+    base_iter   = iter_sorted_tables(base_schema)
+    target_iter = iter_sorted_tables(target_schema)
+
+    def _next(it, prev_name):
+        item = next(it, None)
+        if item is not None and prev_name is not None and item[0] <= prev_name:
+            raise Exception('Schema tables are not sorted by name: `{}` after `{}`'.format(item[0], prev_name))
+
+        return item
+
+    base_item   = _next(base_iter, None)
+    target_item = _next(target_iter, None)
+
+    while base_item is not None or target_item is not None:
+        if target_item is None or (base_item is not None and base_item[0] < target_item[0]):
+            table_name, base_table, target_table = base_item[0], base_item[1], None
+            base_item = _next(base_iter, table_name)
+
+        elif base_item is None or target_item[0] < base_item[0]:
+            table_name, base_table, target_table = target_item[0], None, target_item[1]
+            target_item = _next(target_iter, table_name)
+
+        else:
+            table_name, base_table, target_table = base_item[0], base_item[1], target_item[1]
+            base_item   = _next(base_iter, table_name)
+            target_item = _next(target_iter, table_name)
+
+        yield table_name, base_table, target_table
+
+def iter_schema_diff(base_schema, target_schema, rules=None):
+    '''
+    以归并的方式逐个对比两个按表名排序的数据库结构，每对比完一个表立即返回
+    按表名顺序逐个返回 (<tableName>, <与`compare_schema`中的"<tableName>"部分一致的差异>)，表结构一致的表、被规则忽略的表不返回
+    '''
+    rules = rules or DEFAULT_DIFF_RULES
+
+    for table_name, base_table, target_table in iter_table_pairs(base_schema, target_schema):
+        if rules.is_ignored_table(table_name):
+            continue
+
+        diff = compare_table(base_table, target_table, rules)
+        if diff is not None:
+            yield table_name, diff
+
+def compare_schema(base_schema, target_schema, rules=None):
     '''
     返回结构如下：
         {
@@ -197,95 +1159,28 @@ def compare_schema(base_schema, target_schema):
                             }
                         }
                     }
+                },
+                "changedIndexes": {
+                    "<indexName>": {
+                        "indexAdded"  : True|False,
+                        "indexRemoved": True|False,
+                        "indexChanges": { "<indexProp>": { "base": <value>, "target": <value> } }
+                    }
+                },
+                "changedForeignKeys": {
+                    "<constraintName>": {
+                        "foreignKeyAdded"  : True|False,
+                        "foreignKeyRemoved": True|False,
+                        "foreignKeyChanges": { "<foreignKeyProp>": { "base": <value>, "target": <value> } }
+                    }
+                },
+                "partitionChanges": {
+                    "<partitionProp>": { "base": <value>, "target": <value> }
                 }
             }
         }
     '''
-    diff_schemas = OrderedDict()
-
-    for table_name in list(set(list(base_schema.keys()) + list(target_schema.keys()))):
-        base_table  = base_schema.get(table_name)
-        target_table = target_schema.get(table_name)
-
-        diff = {
-            'tableAdded'    : False,
-            'tableRemoved'  : False,
-            'syntaxChanged' : False,
-            'changedColumns': OrderedDict(),
-        }
-
-        if (base_table is None) and (target_table is not None):
-            # 表增加
-            diff['tableAdded'] = True
-            diff_schemas[table_name] = diff
-
-        elif (base_table is not None) and (target_table is None):
-            # 表删除
-            diff['tableRemoved'] = True
-            diff_schemas[table_name] = diff
-
-        else:
-            # 继续对比建表语句
-            if base_table['syntax'] != target_table['syntax']:
-                diff['syntaxChanged'] = True
-
-                # 继续比较各列
-                for column_name in list(set(base_table['columns'].keys()) | set(target_table['columns'].keys())):
-                    base_column  = base_table['columns'].get(column_name)
-                    target_column = target_table['columns'].get(column_name)
-
-                    col_diff = {
-                        'columnAdded'  : False,
-                        'columnRemoved': False,
-                        'columnChanges': OrderedDict(),
-                    }
-
-                    if (base_column is None) and (target_column is not None):
-                        # 列增加
-                        col_diff['columnAdded'] = True
-                        diff['changedColumns'][column_name] = col_diff
-
-                    elif (base_column is not None) and (target_column is None):
-                        # 列删除
-                        col_diff['columnRemoved'] = True
-                        diff['changedColumns'][column_name] = col_diff
-
-                    else:
-                        # 继续比较各列属性
-                        for prop in COLUMN_PROPS:
-                            base_prop   = base_column[prop]
-                            target_prop = target_column[prop]
-
-                            # 不同版本兼容
-                            if prop == 'COLUMN_TYPE':
-                                base_prop   = re.sub(r'int\(\d+\)', 'int', base_prop)
-                                target_prop = re.sub(r'int\(\d+\)', 'int', target_prop)
-
-                            elif prop == 'COLUMN_DEFAULT':
-                                if base_prop and not base_prop.startswith("'"):
-                                    base_prop = escape_sql_param(base_prop)
-                                if target_prop and not target_prop.startswith("'"):
-                                    target_prop = escape_sql_param(target_prop)
-
-                            # 比较
-                            if base_prop != target_prop:
-                                # 同义处理
-                                for same_prop_value in COLUMN_SAME_PROP_VALUES:
-                                    if base_prop in same_prop_value and target_prop in same_prop_value:
-                                        break
-
-                                else:
-                                    col_diff['columnChanges'][prop] = {
-                                        'base'  : base_prop,
-                                        'target': target_prop,
-                                    }
-
-                        if col_diff['columnChanges']:
-                            diff['changedColumns'][column_name] = col_diff
-
-                diff_schemas[table_name] = diff
-
-    return diff_schemas
+    return OrderedDict(iter_schema_diff(base_schema, target_schema, rules))
 
 def convert_readable_value(v):
     if v is None:
@@ -298,7 +1193,13 @@ def convert_readable_value(v):
         return v
 
 def print_schema_diff(schema_diff, no_color=False):
-    for table_name, table_diff in schema_diff.items():
+    '''
+    输出差异，`schema_diff`可以是`compare_schema`的结果，也可以是`iter_schema_diff`返回的迭代器
+    '''
+    if hasattr(schema_diff, 'items'):
+        schema_diff = schema_diff.items()
+
+    for table_name, table_diff in schema_diff:
         print_line = '\n'
 
         line_label = ''
@@ -356,37 +1257,323 @@ def print_schema_diff(schema_diff, no_color=False):
                                 target_value)
                         print(print_line)
 
+        for diff_key, diff_prefix, object_label in (
+                ('changedIndexes',     'index',      '索引'),
+                ('changedForeignKeys', 'foreignKey', '外键')):
+            for object_name, object_diff in (table_diff.get(diff_key) or {}).items():
+                print_line = '\t'
+
+                line_label = ''
+                if object_diff[diff_prefix + 'Added']:
+                    line_label = '+ [多余{}] '.format(object_label)
+                    if no_color is False:
+                        line_label = COLOR_GREEN  + line_label + COLOR_RESET
+
+                elif object_diff[diff_prefix + 'Removed']:
+                    line_label = '- [缺少{}] '.format(object_label)
+                    if no_color is False:
+                        line_label = COLOR_RED  + line_label + COLOR_RESET
+
+                else:
+                    line_label = '* [差异{}] '.format(object_label)
+                    if no_color is False:
+                        line_label = COLOR_YELLOW  + line_label + COLOR_RESET
+
+                print_line += line_label + object_name
+                print(print_line)
+
+                print_prop_changes(object_diff[diff_prefix + 'Changes'])
+
+        partition_changes = table_diff.get('partitionChanges')
+        if partition_changes:
+            line_label = '* [差异分区] '
+            if no_color is False:
+                line_label = COLOR_YELLOW  + line_label + COLOR_RESET
+
+            print('\t' + line_label + table_name)
+            print_prop_changes(partition_changes)
+
+def print_prop_changes(prop_changes):
+    for prop, diff_info in prop_changes.items():
+        base_value   = convert_readable_value(diff_info['base'])
+        target_value = convert_readable_value(diff_info['target'])
+
+        print_line = '\t\t{:-<30} 从基准数据库的`{}`被改为目标数据库的`{}`'.format(
+                '{} '.format(prop),
+                base_value,
+                target_value)
+        print(print_line)
+
+def iter_schema_source(db, fetch_workers=None, table_filter=None):
+    '''
+    流式获取数据库结构来源：快照直接读取，数据库使用`iter_mysql_schema`逐表获取
+    '''
+    if isinstance(db, str):
+        return load_mysql_schema(db, table_filter=table_filter)
+
+    return iter_mysql_schema(db, fetch_workers, table_filter)
+
+def get_snapshot_cache(options):
+    if not (options.get('cache') or options.get('refresh-cache')):
+        return None
+
+    from mysql_schema_snapshot import SnapshotCache
+
+    cache_max_age  = options.get('cache-max-age')
+    cache_max_size = options.get('cache-max-size')
+    snapshot_cache = SnapshotCache(
+            cache_dir=options.get('cache-dir') or None,
+            max_age=int(cache_max_age) if cache_max_age else None,
+            max_size=int(cache_max_size) * 1024 * 1024 if cache_max_size else None,
+            refresh=options.get('refresh-cache') is True)
+
+    return snapshot_cache
+
+def open_schema_source(source, fetch_workers, db_pool=None, stream=False):
+    '''
+    打开数据库结构来源：快照文件路径或 MySQL 连接字符串
+    指定`db_pool`（如：守护进程中的`DaemonDBPool`）时复用其中已建立连接的`MySQLHelper`
+    `stream`为 True 时（`iter_mysql_schema`）连接池额外保留一个连接用于流式读取列信息
+    返回 (<快照文件路径 | MySQLHelper>, <用于显示的描述>)
+    '''
+    from mysql_schema_snapshot import is_snapshot_path
+
+    if is_snapshot_path(source):
+        return source, 'snapshot={}'.format(source)
+
+    max_connections = fetch_workers + 1 if stream else fetch_workers
+
+    db_option = get_mysql_option(source)
+    if db_pool is not None:
+        db = db_pool.get_db(db_option, max_connections)
+    else:
+        db = MySQLHelper(db_option, max_connections=max_connections)
+
+    if db_option['password']:
+        db_option['password'] = '***'
+
+    return db, ', '.join(['{}={}'.format(k, v) for k, v in db_option.items()])
+
+def export_main(args, options):
+    '''
+    导出数据库结构快照：
+        python mysql_schema_diff.py export <user>:<passwd>@<host>:<port>/<db> <path>
+    '''
+    from mysql_schema_snapshot import dump_snapshot
+
+    fetch_workers_option = int(options.get('fetch-workers') or DEFAULT_FETCH_WORKERS)
+    extract_mode_option  = options.get('extract-mode') or 'show'
+    table_filter         = get_table_filter(options)
+
+    db_option = get_mysql_option(args[0])
+    db = MySQLHelper(db_option, max_connections=fetch_workers_option)
+
+    start_time = time.time()
+    mysql_schemas = get_mysql_schema(db, fetch_workers_option, extract_mode_option, table_filter)
+
+    meta = {
+        'host'       : db_option.get('host'),
+        'port'       : db_option.get('port'),
+        'database'   : db_option.get('database'),
+        'extractMode': extract_mode_option,
+        'createTime' : time.time(),
+    }
+    dump_snapshot(mysql_schemas, args[1], meta)
+
+    print('已导出 {} 个表至 {}，耗时 {:.3f} 秒'.format(len(mysql_schemas), args[1], time.time() - start_time))
+
+def get_profiler(options):
+    if not (options.get('profile') or options.get('profile-output')):
+        return None
+
+    from mysql_profiler import QueryProfiler
+
+    # 所有`MySQLHelper`实例的查询均会被统计
+    profiler = QueryProfiler()
+    MySQLHelper.profiler = profiler
+
+    return profiler
+
+def get_phase(profiler, name):
+    if profiler is None:
+        return nullcontext()
+
+    return profiler.phase(name)
+
+def report_profile(profiler, options):
+    if options.get('profile'):
+        profiler.print_summary()
+
+    if options.get('profile-output'):
+        profiler.dump_json(options['profile-output'])
+        print('性能统计已写入 {}'.format(options['profile-output']))
+
 def main():
-    db_base_option  = get_mysql_option(sys.argv[1])
-    db_target_option = get_mysql_option(sys.argv[2])
+    args, options = get_cli_options(sys.argv[1:])
+
+    if args and args[0] == 'daemon':
+        from mysql_schema_daemon import daemon_main
+        return daemon_main(args[1:], options)
+
+    if options.get('daemon-socket'):
+        from mysql_schema_daemon import is_daemon_job, submit_job
+
+        # 对比任务提交至守护进程执行，导出快照、持续监控仍在当前进程中执行
+        if is_daemon_job(args):
+            sys.exit(submit_job(options['daemon-socket'], sys.argv[1:]))
+
+    profiler = get_profiler(options)
+    try:
+        if args and args[0] == 'export':
+            return export_main(args[1:], options)
+
+        return diff_main(args, options, profiler)
+
+    finally:
+        if profiler:
+            report_profile(profiler, options)
+
+def diff_main(args, options, profiler=None, db_pool=None, snapshot_cache=None):
+    no_color_option        = options.get('no-color') is True
+    serial_option          = options.get('serial') is True
+    stream_option          = options.get('stream') is True
+    two_phase_option       = options.get('two-phase') is True
+    format_option          = options.get('format') or 'text'
+    output_option          = options.get('output') or None
+    fetch_workers_option   = int(options.get('fetch-workers') or DEFAULT_FETCH_WORKERS)
+    extract_mode_option    = options.get('extract-mode') or 'show'
+    compare_workers_option = int(options.get('compare-workers') or 0)
+
+    if extract_mode_option not in ('show', 'bulk'):
+        raise Exception('Invalid extract mode: {}'.format(extract_mode_option))
+
+    if compare_workers_option > 1 and stream_option:
+        raise Exception('Parallel comparison requires complete schemas, `--stream` is not supported')
+
+    if args and args[0] == 'fleet' and format_option != 'text':
+        raise Exception('Fleet mode only supports `text` output format')
 
-    no_color_option = False
-    if len(sys.argv) > 3 and sys.argv[3] == '--no-color':
-        no_color_option = True
+    if args and args[0] == 'watch' and format_option not in ('text', 'jsonl'):
+        raise Exception('Watch mode only supports `text` and `jsonl` output formats')
 
-    db_base  = MySQLHelper(db_base_option)
-    db_target = MySQLHelper(db_target_option)
+    # 各子命令是否支持输出格式已在上面检查，确认需要后才打开输出
+    output_stream = None
+    if format_option != 'text':
+        from mysql_schema_output import OUTPUT_FORMATS, open_output
 
-    if db_base_option['password']:
-        db_base_option['password'] = '***'
+        if format_option not in OUTPUT_FORMATS:
+            raise Exception('Invalid output format: {}'.format(format_option))
 
-    if db_target_option['password']:
-        db_target_option['password'] = '***'
+        if format_option == 'sql' and stream_option:
+            raise Exception('Migration SQL requires complete schemas, `--stream` is not supported')
 
-    print('基准数据库:', ', '.join(['{}={}'.format(k, v) for k, v in db_base_option.items()]))
-    print('目标数据库:', ', '.join(['{}={}'.format(k, v) for k, v in db_target_option.items()]))
+        # 结构化输出时，其他提示信息改为输出至标准错误
+        sys.stdout.flush()
+        output_stream = open_output(output_option)
+        if not output_option:
+            sys.stdout = sys.stderr
 
-    db_base_schema  = get_mysql_schema(db_base)
-    db_target_schema = get_mysql_schema(db_target)
+    if snapshot_cache is None:
+        snapshot_cache = get_snapshot_cache(options)
 
-    schema_diff = compare_schema(db_base_schema, db_target_schema)
+    table_filter = get_table_filter(options)
+    rules        = load_diff_rules(options.get('rules'))
 
-    if schema_diff:
-        print(COLOR_YELLOW + '-> 目标数据库相对于基准数据库存在以下差异：' + COLOR_RESET)
-        print_schema_diff(schema_diff, no_color_option)
+    if args and args[0] == 'fleet':
+        from mysql_schema_fleet import fleet_main
+        return fleet_main(args[1:], options, fetch_workers_option, extract_mode_option, snapshot_cache, table_filter, rules)
+
+    if args and args[0] == 'watch':
+        from mysql_schema_watch import watch_main
+        return watch_main(args[1:], options, fetch_workers_option, extract_mode_option, table_filter, output_stream, rules)
+
+    with get_phase(profiler, 'open'):
+        db_base,  db_base_label   = open_schema_source(args[0], fetch_workers_option, db_pool, stream_option)
+        db_target, db_target_label = open_schema_source(args[1], fetch_workers_option, db_pool, stream_option)
+
+    print('基准数据库:', db_base_label)
+    print('目标数据库:', db_target_label)
+
+    start_time = time.time()
+    if stream_option:
+        # 流式获取、对比、输出
+        db_base_schema  = iter_schema_source(db_base, fetch_workers_option, table_filter)
+        db_target_schema = iter_schema_source(db_target, fetch_workers_option, table_filter)
+
+    else:
+        with get_phase(profiler, 'extract'):
+            if serial_option:
+                # 依次获取
+                base_start_time = time.time()
+                db_base_schema  = load_mysql_schema(db_base, fetch_workers_option, extract_mode_option, snapshot_cache, table_filter)
+                base_cost_time  = time.time() - base_start_time
+
+                target_start_time = time.time()
+                db_target_schema  = load_mysql_schema(db_target, fetch_workers_option, extract_mode_option, snapshot_cache, table_filter)
+                target_cost_time  = time.time() - target_start_time
+
+            elif two_phase_option and not (isinstance(db_base, str) or isinstance(db_target, str)):
+                # 先对比服务器端计算的校验和，只获取不一致的表
+                from mysql_schema_checksum import get_mysql_schemas_two_phase
+
+                schemas, cost_times, changed_table_names = get_mysql_schemas_two_phase([db_base, db_target], fetch_workers_option, extract_mode_option, table_filter)
+                db_base_schema, db_target_schema = schemas
+                base_cost_time, target_cost_time = cost_times
+
+                print('校验和不一致的表: {} 个'.format(len(changed_table_names)))
+
+            else:
+                # 同时获取
+                schemas, cost_times = get_mysql_schemas_concurrently([db_base, db_target], fetch_workers_option, extract_mode_option, snapshot_cache, table_filter)
+                db_base_schema, db_target_schema = schemas
+                base_cost_time, target_cost_time = cost_times
+
+        total_cost_time = time.time() - start_time
+
+        print('基准数据库结构获取耗时: {:.3f} 秒'.format(base_cost_time))
+        print('目标数据库结构获取耗时: {:.3f} 秒'.format(target_cost_time))
+        print('结构获取总耗时: {:.3f} 秒'.format(total_cost_time))
+
+    if compare_workers_option > 1:
+        # 按表分片，使用多个进程对比
+        from mysql_schema_parallel import iter_schema_diff_parallel
+        schema_diff_iter = iter_schema_diff_parallel(db_base_schema, db_target_schema, compare_workers_option, rules=rules)
 
     else:
-        print(COLOR_GREEN + '-> 数据库结构完全一致' + COLOR_RESET)
+        schema_diff_iter = iter_schema_diff(db_base_schema, db_target_schema, rules)
+
+    if profiler and not stream_option:
+        # 统计性能时先完成对比，以便区分对比与输出的耗时
+        with get_phase(profiler, 'compare'):
+            schema_diff_iter = iter(list(schema_diff_iter))
+
+    # 流式处理时，获取、对比、输出交替进行，统一计入`stream`阶段
+    with get_phase(profiler, 'stream' if stream_option else 'output'):
+        if output_stream:
+            from mysql_schema_output import write_schema_diff
+            from mysql_schema_migration import write_migration_sql
+
+            try:
+                if format_option == 'sql':
+                    write_migration_sql(schema_diff_iter, db_base_schema, db_target_schema, output_stream)
+                else:
+                    write_schema_diff(schema_diff_iter, format_option, output_stream)
+
+            finally:
+                output_stream.close()
+
+            return
+
+        first_table_diff = next(schema_diff_iter, None)
+        if first_table_diff:
+            print(COLOR_YELLOW + '-> 目标数据库相对于基准数据库存在以下差异：' + COLOR_RESET)
+            print_schema_diff(chain([first_table_diff], schema_diff_iter), no_color_option)
+
+        else:
+            print(COLOR_GREEN + '-> 数据库结构完全一致' + COLOR_RESET)
+
+    if stream_option:
+        print('\n总耗时: {:.3f} 秒'.format(time.time() - start_time))
 
 if __name__ == '__main__':
     main()
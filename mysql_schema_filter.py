@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+import re
+import fnmatch
+
+from collections import OrderedDict
+from mysql_helper import format_sql
+
+# 默认排除`_`开头的表（如 gh-ost/pt-osc 产生的影子表）
+DEFAULT_EXCLUDE_PATTERNS = ['_*']
+
+# 以该前缀开头的模式为正则表达式，否则为通配符
+REGEX_PATTERN_PREFIX = 're:'
+
+def parse_patterns(s):
+    '''
+    解析以`,`分隔的模式列表，正则表达式模式中包含`,`时可多次指定选项（见`get_table_filter`）
+    '''
+    if not s:
+        return []
+
+    if isinstance(s, (list, tuple)):
+        return list(s)
+
+    if s.startswith(REGEX_PATTERN_PREFIX):
+        return [s]
+
+    return [p.strip() for p in s.split(',') if p.strip()]
+
+def compile_patterns(patterns):
+    '''
+    将多个模式编译为一个匹配函数，无模式时返回 None
+    精确名称使用集合查找，通配符、正则表达式分别合并为一个预编译的正则表达式，匹配耗时与模式数量无关
+    '''
+    names   = set()
+    globs   = []
+    regexes = []
+    for pattern in patterns:
+        if pattern.startswith(REGEX_PATTERN_PREFIX):
+            regexes.append(pattern[len(REGEX_PATTERN_PREFIX):])
+        elif any(c in pattern for c in '*?['):
+            globs.append(fnmatch.translate(pattern))
+        else:
+            names.add(pattern)
+
+    if not (names or globs or regexes):
+        return None
+
+    glob_match   = re.compile('|'.join('(?:{})'.format(g) for g in globs)).match    if globs   else None
+    regex_search = re.compile('|'.join('(?:{})'.format(r) for r in regexes)).search if regexes else None
+
+    def _match(name):
+        if name in names:
+            return True
+
+        if glob_match is not None and glob_match(name):
+            return True
+
+        if regex_search is not None and regex_search(name):
+            return True
+
+        return False
+
+    return _match
+
+def glob_to_like(pattern):
+    '''
+    将通配符转换为 LIKE 表达式：`*`转换为`%`，`?`转换为`_`，其余`%`、`_`、`\\`转义
+    LIKE 不支持字符集合，包含`[`的通配符无法转换，见`is_like_pattern`
+    '''
+    like = []
+    for c in pattern:
+        if c == '*':
+            like.append('%')
+        elif c == '?':
+            like.append('_')
+        elif c in ('%', '_', '\\'):
+            like.append('\\' + c)
+        else:
+            like.append(c)
+
+    return ''.join(like)
+
+def is_like_pattern(pattern):
+    '''
+    是否可以转换为 LIKE 表达式下推：正则表达式（MySQL 与 Python 的语法、语义不一致）、包含字符集合的通配符只在 Python 中过滤
+    '''
+    return not pattern.startswith(REGEX_PATTERN_PREFIX) and '[' not in pattern
+
+def is_exact_like_pattern(pattern):
+    '''
+    是否可以转换为与 Python 匹配结果完全一致的 LIKE 表达式（按`BINARY`比较）：
+    `?`转换的`_`在二进制比较时只匹配一个字节，对多字节字符的匹配结果与 Python 不一致
+    '''
+    return is_like_pattern(pattern) and '?' not in pattern
+
+class TableFilter(object):
+    '''
+    表过滤条件：
+        tables : 精确匹配的表名列表，指定时只获取这些表
+        include: 需要获取的表名模式列表，为空时获取全部
+        exclude: 需要排除的表名模式列表，默认排除`_`开头的表
+
+    模式默认为通配符（如：`tb_main_*`），以`re:`开头时为正则表达式（如：`re:_(gho|del)$`）
+    过滤条件会生成 SQL 条件下推至 information_schema 查询中，并在获取结果后再按 Python 的规则（区分大小写）精确过滤一次
+    再次过滤只能去掉多余的表，因此下推的条件只能多获取、不能少获取：
+        include: 全部模式均可转换为 LIKE 时才下推（information_schema 的排序规则可能不区分大小写，只会多获取）
+        exclude: 只下推结果完全一致的模式，并按`BINARY`比较（区分大小写），其余只在 Python 中排除
+    '''
+    def __init__(self, tables=None, include=None, exclude=None):
+        self.tables  = list(tables or [])
+        self.include = list(include or [])
+        self.exclude = DEFAULT_EXCLUDE_PATTERNS if exclude is None else list(exclude)
+
+        self.table_set       = set(self.tables)
+        self.include_matches = [self._compile(p) for p in self.include]
+        self.exclude_matches = [self._compile(p) for p in self.exclude]
+
+    @staticmethod
+    def _compile(pattern):
+        if pattern.startswith(REGEX_PATTERN_PREFIX):
+            return re.compile(pattern[len(REGEX_PATTERN_PREFIX):]).search
+
+        return re.compile(fnmatch.translate(pattern)).match
+
+    @staticmethod
+    def _get_pattern_condition(pattern, column, binary=False):
+        if binary:
+            return format_sql('BINARY ?? LIKE ?', [column, glob_to_like(pattern)])
+
+        return format_sql('?? LIKE ?', [column, glob_to_like(pattern)])
+
+    def match(self, table_name):
+        if self.table_set and table_name not in self.table_set:
+            return False
+
+        if self.include_matches and not any(m(table_name) for m in self.include_matches):
+            return False
+
+        if any(m(table_name) for m in self.exclude_matches):
+            return False
+
+        return True
+
+    def get_sql_condition(self, column='TABLE_NAME'):
+        '''
+        生成用于 WHERE 子句的 SQL 条件，如：
+            (TABLE_NAME LIKE 'tb\\_main\\_%') AND NOT (BINARY TABLE_NAME LIKE '\\_%')
+        '''
+        conditions = []
+
+        if self.tables:
+            conditions.append(format_sql('?? IN (?)', [column, self.tables]))
+
+        if self.include and all(is_like_pattern(p) for p in self.include):
+            conditions.append('({})'.format(' OR '.join(self._get_pattern_condition(p, column) for p in self.include)))
+
+        exclude = [p for p in self.exclude if is_exact_like_pattern(p)]
+        if exclude:
+            conditions.append('NOT ({})'.format(' OR '.join(self._get_pattern_condition(p, column, binary=True) for p in exclude)))
+
+        return ' AND '.join(conditions) or '1 = 1'
+
+    def filter_schema(self, mysql_schemas):
+        '''
+        过滤已获取的数据库结构（如：读取的快照）
+        '''
+        return OrderedDict((k, v) for k, v in mysql_schemas.items() if self.match(k))
+
+    def get_cache_scope(self):
+        '''
+        用于区分快照缓存，过滤条件不同的结构不能共用同一份快照
+        '''
+        if self.is_default():
+            return ''
+
+        return repr((self.tables, self.include, self.exclude))
+
+    def is_default(self):
+        return not self.tables and not self.include and self.exclude == DEFAULT_EXCLUDE_PATTERNS
+
+DEFAULT_TABLE_FILTER = TableFilter()
+
+def get_table_filter(options):
+    '''
+    根据命令行选项`--tables`、`--include`、`--exclude`生成表过滤条件
+    '''
+    for option_name in ('tables', 'include'):
+        if options.get(option_name) is True:
+            raise Exception('Option `--{}` requires a value'.format(option_name))
+
+    tables  = parse_patterns(options.get('tables'))
+    include = parse_patterns(options.get('include'))
+
+    exclude = options.get('exclude')
+    if exclude is True:
+        # 仅指定`--exclude`时不排除任何表
+        exclude = []
+    else:
+        exclude = parse_patterns(exclude)
+
+    return TableFilter(tables, include, exclude)
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import hashlib
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from mysql_helper import MySQLHelper
+from mysql_schema_diff import COLOR_RED, COLOR_GREEN, COLOR_YELLOW, COLOR_RESET, \
+        get_mysql_option, get_mysql_schemas, load_mysql_schema, compare_schema, print_schema_diff
+
+# 默认同时获取的目标数据库数量
+DEFAULT_FLEET_WORKERS = 8
+
+def get_source_name(source):
+    '''
+    用于显示的数据库名称：快照路径或`<host>:<port>/<database>`（不包含用户名密码）
+    '''
+    if isinstance(source, str):
+        from mysql_schema_snapshot import is_snapshot_path
+        if is_snapshot_path(source):
+            return source
+
+        source = get_mysql_option(source)
+
+    return '{}:{}/{}'.format(source.get('host'), source.get('port') or 3306, source.get('database'))
+
+def read_targets_file(path):
+    '''
+    读取目标数据库列表文件，每行一个连接字符串或快照路径，`#`开头的行为注释
+    '''
+    targets = []
+    with open(path) as _f:
+        for line in _f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            targets.append(line)
+
+    return targets
+
+def get_diff_signature(schema_diff):
+    '''
+    差异内容的签名，差异完全相同的目标数据库签名相同
+    '''
+    dumped = json.dumps(schema_diff, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.md5(dumped.encode('utf-8')).hexdigest()
+
+def group_targets_by_server(targets):
+    '''
+    将位于同一服务器（host/port/user/password 均相同）的目标数据库分为一组，快照单独成组
+    返回 [ [<目标数据库>, ...], ... ]
+    '''
+    from mysql_schema_snapshot import is_snapshot_path
+
+    groups = OrderedDict()
+    for target in targets:
+        if is_snapshot_path(target):
+            groups[('snapshot', target)] = [target]
+            continue
+
+        option = get_mysql_option(target)
+        server_key = (option.get('host'), option.get('port'), option.get('user'), option.get('password'))
+        groups.setdefault(server_key, []).append(target)
+
+    return list(groups.values())
+
+def iter_fleet_diff(base_schema, targets, fleet_workers=None, fetch_workers=None, extract_mode=None, snapshot_cache=None, group_by_server=True, table_filter=None, compare_executor=None, rules=None):
+    '''
+    使用有限数量的线程并行获取各目标数据库结构，每获取完一个立即与基准数据库结构对比
+    `group_by_server`为 True 时，同一服务器上的多个目标数据库使用一次`TABLE_SCHEMA IN (...)`查询获取
+    指定`compare_executor`（`ProcessPoolExecutor`）时，各目标数据库均使用该进程池分片对比
+    按完成顺序逐个返回 (<目标数据库>, <差异>, <错误信息>)
+    '''
+    def _compare_schema(target_schema):
+        if compare_executor is not None:
+            from mysql_schema_parallel import compare_schema_parallel
+            return compare_schema_parallel(base_schema, target_schema, executor=compare_executor, rules=rules)
+
+        return compare_schema(base_schema, target_schema, rules)
+
+    def _diff_target(target):
+        from mysql_schema_snapshot import is_snapshot_path
+
+        db = None
+        try:
+            if is_snapshot_path(target):
+                db = target
+            else:
+                db = MySQLHelper(get_mysql_option(target), max_connections=fetch_workers)
+
+            target_schema = load_mysql_schema(db, fetch_workers, extract_mode, snapshot_cache, table_filter)
+            return [(target, _compare_schema(target_schema), None)]
+
+        finally:
+            if isinstance(db, MySQLHelper):
+                db.close()
+
+    def _diff_server_targets(server_targets):
+        if len(server_targets) == 1:
+            return _diff_target(server_targets[0])
+
+        target_map = OrderedDict((get_mysql_option(t)['database'], t) for t in server_targets)
+
+        db = MySQLHelper(get_mysql_option(server_targets[0]), max_connections=fetch_workers)
+        try:
+            schemas_map = get_mysql_schemas(db, list(target_map.keys()), fetch_workers, extract_mode, table_filter)
+
+        finally:
+            db.close()
+
+        results = []
+        for database, target in target_map.items():
+            results.append((target, _compare_schema(schemas_map[database]), None))
+
+        return results
+
+    if group_by_server:
+        tasks = group_targets_by_server(targets)
+    else:
+        tasks = [[t] for t in targets]
+
+    with ThreadPoolExecutor(max_workers=fleet_workers or DEFAULT_FLEET_WORKERS) as executor:
+        futures = OrderedDict()
+        for task_targets in tasks:
+            futures[executor.submit(_diff_server_targets, task_targets)] = task_targets
+
+        for future in as_completed(futures):
+            try:
+                results = future.result()
+
+            except Exception as e:
+                for target in futures[future]:
+                    yield target, None, '{}: {}'.format(type(e).__name__, e)
+
+            else:
+                for result in results:
+                    yield result
+
+def group_fleet_diff(fleet_diff_iter, on_result=None):
+    '''
+    按差异内容将目标数据库分组
+    返回结构如下：
+        {
+            "groups": [
+                {
+                    "diff"   : <compare_schema 结果>,
+                    "targets": [ <目标数据库名称>, ... ]
+                }
+            ],
+            "errors": {
+                "<目标数据库名称>": <错误信息>
+            }
+        }
+    其中`groups`按目标数据库数量降序排列，结构一致的目标数据库也作为一组（`diff`为空）
+    '''
+    groups = OrderedDict()
+    errors = OrderedDict()
+
+    for target, schema_diff, error in fleet_diff_iter:
+        target_name = get_source_name(target)
+
+        if on_result:
+            on_result(target_name, schema_diff, error)
+
+        if error:
+            errors[target_name] = error
+            continue
+
+        signature = get_diff_signature(schema_diff)
+        if signature not in groups:
+            groups[signature] = {
+                'diff'   : schema_diff,
+                'targets': [],
+            }
+
+        groups[signature]['targets'].append(target_name)
+
+    for group in groups.values():
+        group['targets'].sort()
+
+    report = {
+        'groups': sorted(groups.values(), key=lambda g: (-len(g['targets']), g['targets'][0])),
+        'errors': OrderedDict(sorted(errors.items())),
+    }
+    return report
+
+def print_fleet_report(report, no_color=False):
+    def _color(color, s):
+        if no_color:
+            return s
+        return color + s + COLOR_RESET
+
+    for group in report['groups']:
+        targets = group['targets']
+
+        print('')
+        if not group['diff']:
+            print(_color(COLOR_GREEN, '-> 以下 {} 个目标数据库与基准数据库结构完全一致：'.format(len(targets))))
+            print('\t' + ', '.join(targets))
+
+        else:
+            print(_color(COLOR_YELLOW, '-> 以下 {} 个目标数据库相对于基准数据库存在相同的差异：'.format(len(targets))))
+            print('\t' + ', '.join(targets))
+            print_schema_diff(group['diff'], no_color)
+
+    if report['errors']:
+        print('')
+        print(_color(COLOR_RED, '-> 以下 {} 个目标数据库获取结构失败：'.format(len(report['errors']))))
+        for target_name, error in report['errors'].items():
+            print('\t{} {}'.format(target_name, error))
+
+def fleet_main(args, options, fetch_workers=None, extract_mode=None, snapshot_cache=None, table_filter=None, rules=None):
+    '''
+    一个基准数据库对比多个目标数据库：
+        python mysql_schema_diff.py fleet <基准数据库> <目标数据库1> <目标数据库2> ... [--targets-file=<path>]
+    '''
+    from mysql_schema_snapshot import is_snapshot_path
+
+    no_color_option        = options.get('no-color') is True
+    fleet_workers_option   = int(options.get('fleet-workers') or DEFAULT_FLEET_WORKERS)
+    compare_workers_option = int(options.get('compare-workers') or 0)
+
+    base   = args[0]
+    targets = list(args[1:])
+    if options.get('targets-file'):
+        targets.extend(read_targets_file(options['targets-file']))
+
+    if not targets:
+        raise Exception('No target database specified')
+
+    print('基准数据库:', get_source_name(base))
+    print('目标数据库: 共 {} 个'.format(len(targets)))
+
+    start_time = time.time()
+
+    base_db = base
+    if not is_snapshot_path(base):
+        base_db = MySQLHelper(get_mysql_option(base), max_connections=fetch_workers)
+
+    try:
+        base_schema = load_mysql_schema(base_db, fetch_workers, extract_mode, snapshot_cache, table_filter)
+
+    finally:
+        if isinstance(base_db, MySQLHelper):
+            base_db.close()
+    print('基准数据库结构获取耗时: {:.3f} 秒'.format(time.time() - start_time))
+
+    progress = { 'done': 0 }
+    def _on_result(target_name, schema_diff, error):
+        progress['done'] += 1
+
+        if error:
+            status = '获取失败'
+        elif schema_diff:
+            status = '存在 {} 个差异表'.format(len(schema_diff))
+        else:
+            status = '结构一致'
+
+        print('[{}/{}] {} {}'.format(progress['done'], len(targets), target_name, status))
+
+    group_by_server = options.get('no-server-group') is not True
+
+    compare_executor = None
+    if compare_workers_option > 1:
+        from mysql_schema_parallel import get_compare_mp_context
+
+        # 子进程在各目标数据库的对比线程中首次提交任务时才创建，不能使用 fork
+        compare_executor = ProcessPoolExecutor(max_workers=compare_workers_option, mp_context=get_compare_mp_context())
+
+    try:
+        fleet_diff_iter = iter_fleet_diff(base_schema, targets, fleet_workers_option, fetch_workers, extract_mode, snapshot_cache, group_by_server, table_filter, compare_executor, rules)
+        report = group_fleet_diff(fleet_diff_iter, _on_result)
+
+    finally:
+        if compare_executor is not None:
+            compare_executor.shutdown()
+
+    print('全部对比耗时: {:.3f} 秒'.format(time.time() - start_time))
+
+    print_fleet_report(report, no_color_option)
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+import re
+
+from mysql_helper import format_sql
+from mysql_schema_diff import quote_identifier, get_column_definition, get_index_definition, get_foreign_key_definition
+
+DB_PLACEHOLDER_RE = re.compile(r'`<DB>`\.')
+
+# 生成列的 EXTRA（MariaDB 旧版本为`PERSISTENT GENERATED`）
+GENERATED_COLUMN_RE = re.compile(r'\b(?:VIRTUAL|STORED|PERSISTENT) GENERATED\b', re.I)
+
+def is_view_syntax(syntax):
+    return not (syntax or '').startswith('CREATE TABLE')
+
+def get_create_sql(syntax):
+    '''
+    从规范化的建表语句生成可执行的建表语句（去除`<DB>`前缀）
+    '''
+    return DB_PLACEHOLDER_RE.sub('', syntax)
+
+def is_generated_column(column):
+    '''
+    是否为生成列：列属性中不包含生成表达式（GENERATION_EXPRESSION），无法生成列定义
+    '''
+    return column is not None and GENERATED_COLUMN_RE.search(column['EXTRA'] or '') is not None
+
+def get_drop_index_clause(index_name):
+    if index_name == 'PRIMARY':
+        return 'DROP PRIMARY KEY'
+
+    return format_sql('DROP INDEX ??', [quote_identifier(index_name)])
+
+def get_alter_table_clauses(table_diff, base_table, target_table):
+    '''
+    根据列、索引、外键差异生成`ALTER TABLE`子句
+    顺序为：删除多余/差异索引、删除多余列、按基准数据库中的列顺序添加/修改列、添加缺少/差异索引、添加缺少/差异外键
+    需要添加/修改的生成列不生成子句，需手动处理
+    返回 (<子句列表>, <需手动处理的列名列表>)
+    '''
+    drop_clauses  = []
+    other_clauses = []
+    index_clauses = []
+
+    manual_column_names = []
+
+    for index_name, index_diff in (table_diff.get('changedIndexes') or {}).items():
+        if not index_diff['indexRemoved']:
+            # 目标数据库多余或不一致的索引
+            drop_clauses.append(get_drop_index_clause(index_name))
+
+        if not index_diff['indexAdded']:
+            # 目标数据库缺少或不一致的索引
+            index_clauses.append('ADD ' + get_index_definition(index_name, base_table['indexes'][index_name]))
+
+    for constraint_name, fk_diff in (table_diff.get('changedForeignKeys') or {}).items():
+        if not fk_diff['foreignKeyAdded']:
+            fk_info = base_table['foreignKeys'][constraint_name]
+            index_clauses.append('ADD ' + get_foreign_key_definition(constraint_name, fk_info))
+
+    base_column_names = list(base_table['columns'].keys())
+
+    def _position(column_name):
+        index = base_column_names.index(column_name)
+        if index == 0:
+            return 'FIRST'
+
+        return format_sql('AFTER ??', [quote_identifier(base_column_names[index - 1])])
+
+    for column_name, column_diff in table_diff['changedColumns'].items():
+        if column_diff['columnAdded']:
+            # 目标数据库多余的列
+            drop_clauses.append(format_sql('DROP COLUMN ??', [quote_identifier(column_name)]))
+
+        elif is_generated_column(base_table['columns'][column_name]) \
+                or is_generated_column(target_table['columns'].get(column_name)):
+            manual_column_names.append(column_name)
+
+        elif column_diff['columnRemoved']:
+            # 目标数据库缺少的列
+            base_column = base_table['columns'][column_name]
+            clause = format_sql('ADD COLUMN ?? ??', [get_column_definition(base_column), _position(column_name)])
+            other_clauses.append((base_column['ORDINAL_POSITION'], clause))
+
+        else:
+            base_column = base_table['columns'][column_name]
+            clause = format_sql('MODIFY COLUMN ??', [get_column_definition(base_column)])
+            if 'ORDINAL_POSITION' in column_diff['columnChanges']:
+                clause += ' ' + _position(column_name)
+
+            other_clauses.append((base_column['ORDINAL_POSITION'], clause))
+
+    other_clauses.sort(key=lambda x: x[0])
+    return drop_clauses + [x[1] for x in other_clauses] + index_clauses, manual_column_names
+
+def get_drop_foreign_key_sqls(table_name, table_diff):
+    '''
+    多余或不一致的外键需要在`ALTER TABLE`之前单独删除（同一语句中不能删除并重新添加同名外键）
+    '''
+    sqls = []
+    for constraint_name, fk_diff in (table_diff.get('changedForeignKeys') or {}).items():
+        if not fk_diff['foreignKeyRemoved']:
+            sqls.append(format_sql('ALTER TABLE ?? DROP FOREIGN KEY ??', [quote_identifier(table_name), quote_identifier(constraint_name)]))
+
+    return sqls
+
+def iter_migration_sql(schema_diff, base_schema, target_schema):
+    '''
+    根据差异生成使目标数据库结构与基准数据库一致的 SQL 语句
+    同一个表的所有列、索引变化合并为一条`ALTER TABLE`语句，避免大表被多次重建
+    视图在所有表处理完毕后再创建，以免依赖的表尚不存在
+    '''
+    if hasattr(schema_diff, 'items'):
+        schema_diff = schema_diff.items()
+
+    view_sqls = []
+    for table_name, table_diff in schema_diff:
+        base_table   = base_schema.get(table_name)
+        target_table = target_schema.get(table_name)
+
+        if table_diff['tableRemoved']:
+            # 目标数据库缺少的表/视图
+            create_sql = get_create_sql(base_table['syntax'])
+            if is_view_syntax(base_table['syntax']):
+                view_sqls.append(create_sql)
+            else:
+                yield create_sql
+
+        elif table_diff['tableAdded']:
+            # 目标数据库多余的表/视图
+            if is_view_syntax(target_table['syntax']):
+                yield format_sql('DROP VIEW ??', [quote_identifier(table_name)])
+            else:
+                yield format_sql('DROP TABLE ??', [quote_identifier(table_name)])
+
+        elif is_view_syntax(base_table['syntax']):
+            # 视图定义变化
+            create_sql = get_create_sql(base_table['syntax'])
+            view_sqls.append(re.sub(r'^CREATE ', 'CREATE OR REPLACE ', create_sql))
+
+        else:
+            for sql in get_drop_foreign_key_sqls(table_name, table_diff):
+                yield sql
+
+            clauses, manual_column_names = get_alter_table_clauses(table_diff, base_table, target_table)
+            for column_name in manual_column_names:
+                yield format_sql('-- 表??的列??为生成列，请手动处理', [quote_identifier(table_name), quote_identifier(column_name)])
+
+            if clauses:
+                yield format_sql('ALTER TABLE ??\n  ??', [quote_identifier(table_name), ',\n  '.join(clauses)])
+
+            if table_diff.get('partitionChanges'):
+                yield format_sql('-- 表??的分区存在差异，请手动处理', [quote_identifier(table_name)])
+
+            elif not clauses and not manual_column_names and not table_diff.get('changedForeignKeys'):
+                yield format_sql('-- 表??的建表语句存在列、索引以外的差异，请手动处理', [quote_identifier(table_name)])
+
+    for view_sql in view_sqls:
+        yield view_sql
+
+def write_migration_sql(schema_diff, base_schema, target_schema, fp):
+    for sql in iter_migration_sql(schema_diff, base_schema, target_schema):
+        if not sql.startswith('--'):
+            sql += ';'
+
+        fp.write((sql + '\n\n').encode('utf-8'))
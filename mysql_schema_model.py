@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import hashlib
+
+from collections import OrderedDict, namedtuple
+from mysql_ddl_parser import get_syntax_digest
+from mysql_schema_rules import DEFAULT_DIFF_RULES
+
+COLUMN_PROPS = [
+    'TABLE_CATALOG',
+    # 'TABLE_SCHEMA', 各数据库的取值必然不同，不获取也不对比
+    'TABLE_NAME',
+    'COLUMN_NAME',
+    'ORDINAL_POSITION',
+    'COLUMN_DEFAULT',
+    'IS_NULLABLE',
+    'DATA_TYPE',
+    'CHARACTER_MAXIMUM_LENGTH',
+    'CHARACTER_OCTET_LENGTH',
+    'NUMERIC_PRECISION',
+    'NUMERIC_SCALE',
+    'DATETIME_PRECISION',
+    'CHARACTER_SET_NAME',
+    'COLLATION_NAME',
+    'COLUMN_TYPE',
+    'COLUMN_KEY',
+    'EXTRA',
+    'COLUMN_COMMENT',
+]
+
+# 索引属性，`COLUMNS`包含列顺序及前缀长度，如："`a`,`b`(10)"
+INDEX_PROPS = [
+    'NON_UNIQUE',
+    'INDEX_TYPE',
+    'COLUMNS',
+]
+
+FOREIGN_KEY_PROPS = [
+    'COLUMNS',
+    'REFERENCED_TABLE',
+    'REFERENCED_COLUMNS',
+    'UPDATE_RULE',
+    'DELETE_RULE',
+]
+
+PARTITION_PROPS = [
+    'PARTITION_METHOD',
+    'PARTITION_EXPRESSION',
+    'SUBPARTITION_METHOD',
+    'SUBPARTITION_EXPRESSION',
+    'SUBPARTITIONS',
+    'PARTITIONS',
+]
+
+def get_column_fingerprint(column, rules=None):
+    '''
+    计算列的指纹：按对比规则（默认为`DEFAULT_DIFF_RULES`）规范化并合并同义值后的全部属性的 MD5
+    使用非默认规则时不使用已保存的指纹
+    '''
+    rules = rules or DEFAULT_DIFF_RULES
+    if rules.is_default:
+        fingerprint = column.get('fingerprint')
+        if fingerprint is not None:
+            return fingerprint
+
+    values = rules.get_canonical_values(column, COLUMN_PROPS)
+
+    return hashlib.md5(repr(values).encode('utf-8')).digest()
+
+def get_table_syntax_digest(table):
+    '''
+    获取表的规范化建表语句语法树的 MD5，不同版本的格式差异不影响结果
+    '''
+    syntax_digest = table.get('syntaxDigest')
+    if syntax_digest is not None:
+        return syntax_digest
+
+    return get_syntax_digest(table['syntax'])
+
+def get_table_fingerprint(table, rules=None):
+    '''
+    计算表的指纹：规范化的建表语句语法树、各列指纹及索引、外键、分区的 MD5
+    使用非默认规则时按规则计算，结果与规则摘要一起保存在`rulesFingerprint`中
+    '''
+    rules = rules or DEFAULT_DIFF_RULES
+    if rules.is_default:
+        fingerprint = table.get('fingerprint')
+        if fingerprint is not None:
+            return fingerprint
+
+    else:
+        rules_fingerprint = table.get('rulesFingerprint')
+        if rules_fingerprint is not None and rules_fingerprint[0] == rules.digest:
+            return rules_fingerprint[1]
+
+    h = hashlib.md5(b'' if rules.ignore_table_syntax else get_table_syntax_digest(table))
+    for column_name, column in table['columns'].items():
+        if rules.is_ignored_column(column):
+            continue
+
+        h.update(b'\0' + column_name.encode('utf-8') + b'\0' + get_column_fingerprint(column, rules))
+
+    for key, kind, props in (('indexes', 'index', INDEX_PROPS), ('foreignKeys', 'foreignKey', FOREIGN_KEY_PROPS)):
+        props = rules.get_props(kind, props)
+        for name, info in sorted((table.get(key) or {}).items()):
+            h.update('\1{}\0{}\0{!r}'.format(key, name, [info[p] for p in props]).encode('utf-8'))
+
+    partition = table.get('partition')
+    if partition:
+        h.update('\1partition\0{!r}'.format([partition[p] for p in rules.get_props('partition', PARTITION_PROPS)]).encode('utf-8'))
+
+    fingerprint = h.digest()
+    if not rules.is_default:
+        table['rulesFingerprint'] = (rules.digest, fingerprint)
+
+    return fingerprint
+
+_ColumnRecord = namedtuple('_ColumnRecord', list(COLUMN_PROPS) + ['fingerprint'])
+
+# 只有列属性名（包含`fingerprint`）可以通过`column[prop]`、`column.get(prop)`访问
+# 否则`getattr`会将`count`、`index`等 tuple 方法当作属性返回
+COLUMN_FIELDS = frozenset(_ColumnRecord._fields)
+
+class Column(_ColumnRecord):
+    '''
+    紧凑的列结构（namedtuple），只保存`COLUMN_PROPS`中的属性及列指纹，字符串值会被 intern 以共享相同取值
+    支持`column[prop]`、`column.get(prop)`形式访问，与原先的 dict 用法兼容
+    '''
+    __slots__ = ()
+
+    def __new__(cls, r):
+        values = []
+        for p in COLUMN_PROPS:
+            v = r[p]
+            if isinstance(v, str):
+                v = sys.intern(v)
+
+            values.append(v)
+
+        return cls.from_values(values)
+
+    @classmethod
+    def from_values(cls, values, fingerprint=None):
+        '''
+        根据按`COLUMN_PROPS`顺序排列的属性值创建列，用于从快照中恢复
+        '''
+        values = tuple(values)
+        if fingerprint is None:
+            fingerprint = get_column_fingerprint(dict(zip(COLUMN_PROPS, values)))
+
+        return tuple.__new__(cls, values + (fingerprint, ))
+
+    def __reduce__(self):
+        return (Column.from_values, (self.values(), self.fingerprint))
+
+    def values(self):
+        return tuple(self[:-1])
+
+    def __getitem__(self, prop):
+        if isinstance(prop, str):
+            if prop not in COLUMN_FIELDS:
+                raise KeyError(prop)
+
+            return getattr(self, prop)
+
+        return tuple.__getitem__(self, prop)
+
+    def __contains__(self, prop):
+        return prop in COLUMN_PROPS
+
+    def get(self, prop, default=None):
+        if prop not in COLUMN_FIELDS:
+            return default
+
+        return getattr(self, prop)
+
+    def keys(self):
+        return list(COLUMN_PROPS)
+
+    def items(self):
+        return list(zip(COLUMN_PROPS, self[:-1]))
+
+    def to_dict(self):
+        return OrderedDict(self.items())
+
+def add_column_row(mysql_schemas, r):
+    table_name  = r['TABLE_NAME']
+    column_name = r['COLUMN_NAME']
+
+    if column_name.startswith('_'):
+        return
+
+    if table_name not in mysql_schemas:
+        mysql_schemas[table_name] = {
+            'syntax' : None,
+            'columns': {},
+        }
+
+    mysql_schemas[table_name]['columns'][column_name] = Column(r)
+
+def set_table_fingerprints(mysql_schemas):
+    for table in mysql_schemas.values():
+        table['syntaxDigest'] = get_syntax_digest(table['syntax'])
+        table['fingerprint']  = None
+        table['fingerprint']  = get_table_fingerprint(table)
+
+def export_mysql_schema(mysql_schemas):
+    '''
+    将数据库结构导出为纯 dict 形式（与`get_mysql_schema`文档中的结构一致），可直接用于 JSON 序列化
+    '''
+    exported = OrderedDict()
+    for table_name, table in mysql_schemas.items():
+        columns = OrderedDict()
+        for column_name, column in table['columns'].items():
+            columns[column_name] = OrderedDict((p, column[p]) for p in COLUMN_PROPS)
+
+        exported[table_name] = {
+            'syntax'     : table['syntax'],
+            'columns'    : columns,
+            'indexes'    : table.get('indexes')     or OrderedDict(),
+            'foreignKeys': table.get('foreignKeys') or OrderedDict(),
+            'partition'  : table.get('partition'),
+        }
+
+    return exported
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import struct
+import datetime
+import decimal
+
+# 输出缓冲区大小
+OUTPUT_BUFFER_SIZE = 64 * 1024
+
+OUTPUT_FORMATS = ('text', 'jsonl', 'msgpack', 'sql')
+
+def iter_diff_records(schema_diff):
+    '''
+    将差异转换为扁平的记录，每个表、每个列的变化各一条
+    `schema_diff`可以是`compare_schema`的结果，也可以是`iter_schema_diff`返回的迭代器
+    记录结构如下：
+        { "type": "table",  "table": "<tableName>", "change": "added|removed|changed" }
+        { "type": "column", "table": "<tableName>", "column": "<columnName>", "change": "added|removed|changed",
+          "props": { "<columnProp>": { "base": <value>, "target": <value> } } }
+        { "type": "index|foreignKey", "table": "<tableName>", "name": "<indexName|constraintName>", "change": "added|removed|changed",
+          "props": { "<prop>": { "base": <value>, "target": <value> } } }
+        { "type": "partition", "table": "<tableName>", "change": "changed",
+          "props": { "<partitionProp>": { "base": <value>, "target": <value> } } }
+    '''
+    if hasattr(schema_diff, 'items'):
+        schema_diff = schema_diff.items()
+
+    for table_name, table_diff in schema_diff:
+        if table_diff['tableAdded']:
+            change = 'added'
+        elif table_diff['tableRemoved']:
+            change = 'removed'
+        else:
+            change = 'changed'
+
+        yield {
+            'type'  : 'table',
+            'table' : table_name,
+            'change': change,
+        }
+
+        for column_name, column_diff in table_diff['changedColumns'].items():
+            if column_diff['columnAdded']:
+                change = 'added'
+            elif column_diff['columnRemoved']:
+                change = 'removed'
+            else:
+                change = 'changed'
+
+            record = {
+                'type'  : 'column',
+                'table' : table_name,
+                'column': column_name,
+                'change': change,
+            }
+            if column_diff['columnChanges']:
+                record['props'] = column_diff['columnChanges']
+
+            yield record
+
+        for diff_key, diff_prefix in (('changedIndexes', 'index'), ('changedForeignKeys', 'foreignKey')):
+            for object_name, object_diff in (table_diff.get(diff_key) or {}).items():
+                if object_diff[diff_prefix + 'Added']:
+                    change = 'added'
+                elif object_diff[diff_prefix + 'Removed']:
+                    change = 'removed'
+                else:
+                    change = 'changed'
+
+                record = {
+                    'type'  : diff_prefix,
+                    'table' : table_name,
+                    'name'  : object_name,
+                    'change': change,
+                }
+                if object_diff[diff_prefix + 'Changes']:
+                    record['props'] = object_diff[diff_prefix + 'Changes']
+
+                yield record
+
+        if table_diff.get('partitionChanges'):
+            yield {
+                'type'  : 'partition',
+                'table' : table_name,
+                'change': 'changed',
+                'props' : table_diff['partitionChanges'],
+            }
+
+def convert_plain_value(v):
+    if isinstance(v, decimal.Decimal):
+        return int(v) if v == v.to_integral_value() else float(v)
+
+    elif isinstance(v, (datetime.date, datetime.datetime, datetime.time)):
+        return v.isoformat()
+
+    elif isinstance(v, bytes):
+        return v.decode('utf-8', 'replace')
+
+    return str(v)
+
+def write_jsonl(records, fp):
+    '''
+    以 JSON Lines 格式写入记录，每行一条
+    '''
+    for record in records:
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=convert_plain_value)
+        fp.write(line.encode('utf-8'))
+        fp.write(b'\n')
+
+def msgpack_pack(obj, buf):
+    '''
+    按 MessagePack 格式序列化，仅支持 nil/bool/int/float/str/bytes/array/map
+    '''
+    if obj is None:
+        buf.append(b'\xc0')
+
+    elif obj is True:
+        buf.append(b'\xc3')
+
+    elif obj is False:
+        buf.append(b'\xc2')
+
+    elif isinstance(obj, int):
+        if 0 <= obj < 0x80:
+            buf.append(struct.pack('B', obj))
+        elif -0x20 <= obj < 0:
+            buf.append(struct.pack('b', obj))
+        elif 0 <= obj < 2 ** 64:
+            buf.append(b'\xcf' + struct.pack('>Q', obj))
+        elif -2 ** 63 <= obj < 0:
+            buf.append(b'\xd3' + struct.pack('>q', obj))
+        else:
+            msgpack_pack(str(obj), buf)
+
+    elif isinstance(obj, float):
+        buf.append(b'\xcb' + struct.pack('>d', obj))
+
+    elif isinstance(obj, str):
+        data = obj.encode('utf-8')
+        size = len(data)
+        if size < 32:
+            buf.append(struct.pack('B', 0xa0 | size))
+        elif size < 2 ** 8:
+            buf.append(b'\xd9' + struct.pack('B', size))
+        elif size < 2 ** 16:
+            buf.append(b'\xda' + struct.pack('>H', size))
+        else:
+            buf.append(b'\xdb' + struct.pack('>I', size))
+        buf.append(data)
+
+    elif isinstance(obj, (bytes, bytearray)):
+        size = len(obj)
+        if size < 2 ** 8:
+            buf.append(b'\xc4' + struct.pack('B', size))
+        elif size < 2 ** 16:
+            buf.append(b'\xc5' + struct.pack('>H', size))
+        else:
+            buf.append(b'\xc6' + struct.pack('>I', size))
+        buf.append(bytes(obj))
+
+    elif isinstance(obj, (list, tuple)):
+        size = len(obj)
+        if size < 16:
+            buf.append(struct.pack('B', 0x90 | size))
+        elif size < 2 ** 16:
+            buf.append(b'\xdc' + struct.pack('>H', size))
+        else:
+            buf.append(b'\xdd' + struct.pack('>I', size))
+
+        for x in obj:
+            msgpack_pack(x, buf)
+
+    elif isinstance(obj, dict):
+        size = len(obj)
+        if size < 16:
+            buf.append(struct.pack('B', 0x80 | size))
+        elif size < 2 ** 16:
+            buf.append(b'\xde' + struct.pack('>H', size))
+        else:
+            buf.append(b'\xdf' + struct.pack('>I', size))
+
+        for k, v in obj.items():
+            msgpack_pack(k, buf)
+            msgpack_pack(v, buf)
+
+    else:
+        msgpack_pack(convert_plain_value(obj), buf)
+
+def write_msgpack(records, fp):
+    '''
+    以 MessagePack 格式连续写入记录，每条记录为一个独立的 map，可使用任意 MessagePack 流式解析器读取
+    '''
+    for record in records:
+        buf = []
+        msgpack_pack(record, buf)
+        fp.write(b''.join(buf))
+
+def open_output(path=None):
+    '''
+    打开带缓冲的二进制输出流，未指定`path`时输出至标准输出
+    '''
+    if path:
+        return open(path, 'wb', buffering=OUTPUT_BUFFER_SIZE)
+
+    return io.BufferedWriter(io.FileIO(1, 'wb', closefd=False), buffer_size=OUTPUT_BUFFER_SIZE)
+
+def write_schema_diff(schema_diff, output_format, fp):
+    records = iter_diff_records(schema_diff)
+
+    if output_format == 'jsonl':
+        write_jsonl(records, fp)
+
+    elif output_format == 'msgpack':
+        write_msgpack(records, fp)
+
+    else:
+        raise Exception('Invalid output format: {}'.format(output_format))
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+import gc
+import pickle
+import threading
+import multiprocessing
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from mysql_schema_rules import DEFAULT_DIFF_RULES
+from mysql_schema_model import Column, get_column_fingerprint, get_table_fingerprint, get_table_syntax_digest
+from mysql_schema_diff import iter_table_pairs, compare_table
+
+# 每个分片包含的表数量，分片过小时进程间通信开销占比较大，过大时各进程负载不均
+DEFAULT_COMPARE_SHARD_SIZE = 200
+
+# 使用 fork 创建子进程时，子进程直接读取继承自父进程的待对比表，无需序列化
+# 同一时间只能有一个对比使用该方式，其余使用序列化分片的方式
+_forked_lock        = threading.Lock()
+_forked_table_pairs = None
+_forked_rules       = None
+
+def get_compare_mp_context():
+    '''
+    返回不使用 fork 的进程上下文
+    多线程进程（如：守护进程、批量对比）中 fork 时，其他线程持有的锁（连接池、日志等）在子进程中永远不会释放，可能导致子进程死锁
+    '''
+    start_methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in start_methods else 'spawn')
+
+def can_fork_compare():
+    '''
+    只有当前进程为单线程且支持 fork 时，才能使用 fork 方式对比
+    '''
+    return 'fork' in multiprocessing.get_all_start_methods() and threading.active_count() == 1
+
+def pack_table(table, other_table=None, rules=None):
+    '''
+    将表转换为紧凑的可序列化形式：(<表级别信息>, [ (<columnName>, <按`COLUMN_PROPS`排列的属性值 | None>, <列指纹>), ... ])
+        - 不包含建表语句，只保留对比所需的`syntaxDigest`
+        - 与`other_table`中同名且指纹相同的列不包含属性值，对比时只需比较指纹（使用非默认规则时不省略）
+    同一分片整体序列化，各表共用的字符串（已 intern）只会序列化一次
+    '''
+    if table is None:
+        return None
+
+    rules = rules or DEFAULT_DIFF_RULES
+
+    table_info = dict((k, v) for k, v in table.items() if k not in ('syntax', 'columns'))
+    table_info['syntaxDigest'] = get_table_syntax_digest(table)
+    table_info['fingerprint']  = get_table_fingerprint(table)
+
+    other_columns = {}
+    if other_table is not None and rules.is_default:
+        other_columns = other_table['columns']
+
+    columns = []
+    for column_name, column in table['columns'].items():
+        fingerprint = get_column_fingerprint(column)
+
+        other_column = other_columns.get(column_name)
+        if other_column is not None and get_column_fingerprint(other_column) == fingerprint:
+            columns.append((column_name, None, fingerprint))
+        else:
+            columns.append((column_name, column.values(), fingerprint))
+
+    return table_info, columns
+
+def unpack_table(packed_table):
+    '''
+    还原`pack_table`的结果，未包含属性值的列只保留指纹（`{ "fingerprint": <bytes> }`）
+    '''
+    if packed_table is None:
+        return None
+
+    table_info, columns = packed_table
+
+    table = dict(table_info)
+    table['columns'] = OrderedDict()
+    for column_name, values, fingerprint in columns:
+        if values is None:
+            table['columns'][column_name] = { 'fingerprint': fingerprint }
+        else:
+            table['columns'][column_name] = Column.from_values(values, fingerprint)
+
+    return table
+
+def compare_shard(shard_blob):
+    '''
+    在子进程中对比一个分片中的各表
+    返回 [ (<tableName>, <差异>), ... ]，表结构一致的表不返回
+    '''
+    rules, shard = pickle.loads(shard_blob)
+
+    results = []
+    for table_name, base_table, target_table in shard:
+        diff = compare_table(unpack_table(base_table), unpack_table(target_table), rules)
+        if diff is not None:
+            results.append((table_name, diff))
+
+    return results
+
+def is_changed_table_pair(base_table, target_table, rules=None):
+    '''
+    与`compare_table`中的前两步一致：指纹或建表语句相同的表不存在差异，可在当前进程中直接跳过
+    '''
+    if base_table is None or target_table is None:
+        return True
+
+    rules = rules or DEFAULT_DIFF_RULES
+
+    if get_table_fingerprint(base_table, rules) == get_table_fingerprint(target_table, rules):
+        return False
+
+    if rules.is_default and get_table_syntax_digest(base_table) == get_table_syntax_digest(target_table):
+        return False
+
+    return True
+
+def iter_changed_table_pairs(base_schema, target_schema, rules=None):
+    rules = rules or DEFAULT_DIFF_RULES
+
+    for table_name, base_table, target_table in iter_table_pairs(base_schema, target_schema):
+        if rules.is_ignored_table(table_name):
+            continue
+
+        if is_changed_table_pair(base_table, target_table, rules):
+            yield table_name, base_table, target_table
+
+def iter_compare_shards(base_schema, target_schema, shard_size=None, rules=None):
+    '''
+    按表名顺序将需要对比的表分片，与对比规则一起序列化
+    '''
+    rules      = rules or DEFAULT_DIFF_RULES
+    shard_size = shard_size or DEFAULT_COMPARE_SHARD_SIZE
+
+    shard = []
+    for table_name, base_table, target_table in iter_changed_table_pairs(base_schema, target_schema, rules):
+        shard.append((table_name, pack_table(base_table, target_table, rules), pack_table(target_table, base_table, rules)))
+        if len(shard) >= shard_size:
+            yield pickle.dumps((rules, shard), protocol=pickle.HIGHEST_PROTOCOL)
+            shard = []
+
+    if shard:
+        yield pickle.dumps((rules, shard), protocol=pickle.HIGHEST_PROTOCOL)
+
+def compare_forked_shard(shard_range):
+    '''
+    在 fork 创建的子进程中对比`_forked_table_pairs[start:end]`
+    '''
+    start, end = shard_range
+
+    results = []
+    for table_name, base_table, target_table in _forked_table_pairs[start:end]:
+        diff = compare_table(base_table, target_table, _forked_rules)
+        if diff is not None:
+            results.append((table_name, diff))
+
+    return results
+
+def iter_shard_results(executor, func, shards):
+    # `map`按提交顺序返回结果，各分片本身按表名排序，因此合并后的顺序是确定的
+    for results in executor.map(func, shards):
+        for result in results:
+            yield result
+
+def iter_schema_diff_parallel(base_schema, target_schema, compare_workers=None, shard_size=None, executor=None, rules=None):
+    '''
+    使用多个进程按表分片对比，返回结果及顺序与`iter_schema_diff`完全一致
+        - 指定`executor`（`ProcessPoolExecutor`，如：批量对比时多个目标数据库共用）时，各分片序列化后发送至子进程
+        - 否则创建`compare_workers`个子进程，当前进程为单线程且支持 fork 时子进程直接继承待对比的表，只需发送各分片的范围
+        - 多线程（如：守护进程、批量对比）或已有其他对比在使用 fork 方式时，使用 forkserver/spawn 创建子进程，各分片序列化后发送
+    '''
+    global _forked_table_pairs, _forked_rules
+
+    if executor is not None:
+        for result in iter_shard_results(executor, compare_shard, iter_compare_shards(base_schema, target_schema, shard_size, rules)):
+            yield result
+
+        return
+
+    if not (can_fork_compare() and _forked_lock.acquire(False)):
+        with ProcessPoolExecutor(max_workers=compare_workers, mp_context=get_compare_mp_context()) as executor:
+            for result in iter_shard_results(executor, compare_shard, iter_compare_shards(base_schema, target_schema, shard_size, rules)):
+                yield result
+
+        return
+
+    shard_size = shard_size or DEFAULT_COMPARE_SHARD_SIZE
+
+    # 子进程在首次提交任务时创建，此时已可继承待对比的表
+    _forked_table_pairs = list(iter_changed_table_pairs(base_schema, target_schema, rules))
+    _forked_rules       = rules
+
+    # 避免子进程中的垃圾回收修改继承的对象，导致写时复制的内存页被大量复制
+    gc.freeze()
+    try:
+        shard_ranges = [(i, i + shard_size) for i in range(0, len(_forked_table_pairs), shard_size)]
+
+        with ProcessPoolExecutor(max_workers=compare_workers, mp_context=multiprocessing.get_context('fork')) as executor:
+            for result in iter_shard_results(executor, compare_forked_shard, shard_ranges):
+                yield result
+
+    finally:
+        gc.unfreeze()
+        _forked_table_pairs = None
+        _forked_rules       = None
+        _forked_lock.release()
+
+def compare_schema_parallel(base_schema, target_schema, compare_workers=None, shard_size=None, executor=None, rules=None):
+    '''
+    返回结构与`compare_schema`一致
+    '''
+    return OrderedDict(iter_schema_diff_parallel(base_schema, target_schema, compare_workers, shard_size, executor, rules))
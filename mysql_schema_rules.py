@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+
+import re
+import json
+import hashlib
+
+from collections import OrderedDict
+from mysql_helper import escape_sql_param
+from mysql_schema_filter import REGEX_PATTERN_PREFIX, compile_patterns
+
+# 默认对比规则，与规则文件中未指定的项合并
+DEFAULT_DIFF_RULES_CONFIG = OrderedDict([
+    ('ignoreTables'         , []),
+    ('ignoreColumns'        , []),
+    ('ignoreColumnProps'    , []),
+    ('ignoreIndexProps'     , []),
+    ('ignoreForeignKeyProps', []),
+    ('ignorePartitionProps' , []),
+    ('ignoreTableSyntax'    , False),
+    ('equivalences', [
+        { 'values': ["'NULL'", None] },
+    ]),
+    ('normalizers', [
+        # MySQL 8.0.19 起不再显示整数类型的显示宽度
+        { 'props': ['COLUMN_TYPE'], 'pattern': r'int\(\d+\)', 'replace': 'int' },
+        # 部分版本中 COLUMN_DEFAULT 的字符串值不带引号
+        { 'props': ['COLUMN_DEFAULT'], 'quote': True },
+    ]),
+])
+
+# 忽略属性的规则项及对应的对象类型
+IGNORE_PROPS_RULES = OrderedDict([
+    ('ignoreColumnProps'    , 'column'),
+    ('ignoreIndexProps'     , 'index'),
+    ('ignoreForeignKeyProps', 'foreignKey'),
+    ('ignorePartitionProps' , 'partition'),
+])
+
+def get_rules_digest(config):
+    return hashlib.md5(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
+
+def quote_literal(value):
+    '''
+    为不带引号的字符串值加上引号
+    '''
+    if isinstance(value, str) and value and not value.startswith("'"):
+        value = escape_sql_param(value)
+
+    return value
+
+def compile_normalizer(normalizer):
+    if normalizer.get('quote'):
+        return quote_literal
+
+    pattern = re.compile(normalizer['pattern'])
+    replace = normalizer.get('replace') or ''
+
+    def _normalize(value):
+        if isinstance(value, str):
+            value = pattern.sub(replace, value)
+
+        return value
+
+    return _normalize
+
+def compile_equivalences(equivalences):
+    '''
+    将同义值规则编译为 { "<prop> | None": { <value>: <同组的第一个值> } }，`None`对应未指定`props`的规则
+    包含相同值的组会被合并
+    '''
+    groups = OrderedDict()
+    for equivalence in equivalences:
+        for prop in equivalence.get('props') or [None]:
+            groups.setdefault(prop, []).append(list(equivalence['values']))
+
+    # 未指定`props`的同义值对所有属性生效
+    for prop, prop_groups in groups.items():
+        if prop is not None:
+            prop_groups[0:0] = groups.get(None, [])
+
+    compiled = {}
+    for prop, prop_groups in groups.items():
+        canonical_map = {}
+        for values in prop_groups:
+            # 与已有的组包含相同值时合并为一组
+            canonicals = [canonical_map[v] for v in values if v in canonical_map]
+            canonical  = canonicals[0] if canonicals else values[0]
+
+            for k, c in list(canonical_map.items()):
+                if c in canonicals:
+                    canonical_map[k] = canonical
+
+            for v in values:
+                canonical_map[v] = canonical
+
+        compiled[prop] = canonical_map
+
+    return compiled
+
+class DiffRules(object):
+    '''
+    对比规则，创建时编译为集合、字典查找及预编译的正则表达式，对比时每个属性的开销与规则数量无关
+    规则结构如下（均为可选，未指定的项使用`DEFAULT_DIFF_RULES_CONFIG`中的值）：
+        {
+            "ignoreTables"         : [ "<表名模式>", ... ],
+            "ignoreColumns"        : [ "<列名模式>" | "<表名模式>.<列名模式>", ... ],
+            "ignoreColumnProps"    : [ "<columnProp>", ... ],
+            "ignoreIndexProps"     : [ "<indexProp>", ... ],
+            "ignoreForeignKeyProps": [ "<foreignKeyProp>", ... ],
+            "ignorePartitionProps" : [ "<partitionProp>", ... ],
+            "ignoreTableSyntax"    : true|false,
+            "equivalences": [
+                { "props": [ "<columnProp>", ... ], "values": [ <value>, ... ] }
+            ],
+            "normalizers": [
+                { "props": [ "<columnProp>", ... ], "pattern": "<正则表达式>", "replace": "<替换内容>" },
+                { "props": [ "<columnProp>", ... ], "quote": true }
+            ]
+        }
+    模式与`--include`一致：默认为通配符，以`re:`开头时为正则表达式
+    `ignoreTableSyntax`为 true 时，只要列、索引、外键、分区（忽略规则生效后）一致，即使建表语句不同（如：表注释）也视为一致
+    同义值、规范化规则只用于列属性，`equivalences`未指定`props`时对所有列属性生效
+    '''
+    def __init__(self, config=None):
+        merged_config = OrderedDict(DEFAULT_DIFF_RULES_CONFIG)
+        for k, v in (config or {}).items():
+            if k not in DEFAULT_DIFF_RULES_CONFIG:
+                raise Exception('Unknown diff rule: `{}`'.format(k))
+
+            merged_config[k] = v
+
+        self.config     = merged_config
+        self.digest     = get_rules_digest(self.config)
+        self.is_default = self.digest == DEFAULT_DIFF_RULES_DIGEST
+
+        self.ignore_table_syntax = self.config['ignoreTableSyntax'] is True
+
+        self.ignored_props = dict((kind, frozenset(self.config[k])) for k, kind in IGNORE_PROPS_RULES.items())
+        self.props_cache   = {}
+
+        self.table_match = compile_patterns(self.config['ignoreTables'])
+
+        # 不含`.`的列名模式只匹配列名，其余匹配"<tableName>.<columnName>"
+        column_patterns       = []
+        table_column_patterns = []
+        for pattern in self.config['ignoreColumns']:
+            if '.' in pattern or pattern.startswith(REGEX_PATTERN_PREFIX):
+                table_column_patterns.append(pattern)
+            else:
+                column_patterns.append(pattern)
+
+        self.column_match       = compile_patterns(column_patterns)
+        self.table_column_match = compile_patterns(table_column_patterns)
+
+        self.normalizers = {}
+        for normalizer in self.config['normalizers']:
+            normalize = compile_normalizer(normalizer)
+            for prop in normalizer['props']:
+                self.normalizers.setdefault(prop, []).append(normalize)
+
+        equivalents = compile_equivalences(self.config['equivalences'])
+        self.default_equivalents = equivalents.pop(None, {})
+        self.equivalents         = equivalents
+
+    def __reduce__(self):
+        # 编译结果包含闭包，序列化（如：发送至子进程）时只传递规则本身
+        return (DiffRules, (self.config, ))
+
+    def get_props(self, kind, props):
+        '''
+        返回未被忽略的属性
+        '''
+        key = (kind, tuple(props))
+        filtered_props = self.props_cache.get(key)
+        if filtered_props is None:
+            ignored_props  = self.ignored_props[kind]
+            filtered_props = self.props_cache[key] = [p for p in props if p not in ignored_props]
+
+        return filtered_props
+
+    def is_ignored_table(self, table_name):
+        return self.table_match is not None and self.table_match(table_name)
+
+    def is_ignored_column(self, column):
+        if self.column_match is None and self.table_column_match is None:
+            return False
+
+        column_name = column['COLUMN_NAME']
+        if self.column_match is not None and self.column_match(column_name):
+            return True
+
+        if self.table_column_match is not None and self.table_column_match('{}.{}'.format(column['TABLE_NAME'], column_name)):
+            return True
+
+        return False
+
+    def normalize_column_prop(self, prop, value):
+        '''
+        规范化列属性值，用于兼容不同版本
+        '''
+        normalizers = self.normalizers.get(prop)
+        if normalizers:
+            for normalize in normalizers:
+                value = normalize(value)
+
+        return value
+
+    def get_canonical_values(self, column, props):
+        '''
+        按`props`中未被忽略的属性返回规范化后的属性值列表，同义值统一为同组中的第一个值
+        各属性的规范化函数、同义值字典预先查找并缓存，用于计算指纹
+        '''
+        key = ('canonical', tuple(props))
+        prop_rules = self.props_cache.get(key)
+        if prop_rules is None:
+            prop_rules = self.props_cache[key] = [
+                    (p, tuple(self.normalizers.get(p) or ()), self.equivalents.get(p, self.default_equivalents))
+                    for p in self.get_props('column', props)]
+
+        values = []
+        for prop, normalizers, equivalents in prop_rules:
+            value = column[prop]
+            for normalize in normalizers:
+                value = normalize(value)
+
+            values.append(equivalents.get(value, value))
+
+        return values
+
+    def is_equivalent(self, prop, base_value, target_value):
+        '''
+        判断两个已规范化的值是否为同义值
+        '''
+        equivalents = self.equivalents.get(prop, self.default_equivalents)
+        return equivalents.get(base_value, base_value) == equivalents.get(target_value, target_value)
+
+DEFAULT_DIFF_RULES_DIGEST = get_rules_digest(DEFAULT_DIFF_RULES_CONFIG)
+DEFAULT_DIFF_RULES        = DiffRules()
+
+def load_diff_rules(path=None):
+    '''
+    从 JSON 文件加载对比规则，未指定`path`时返回默认规则
+    '''
+    if not path:
+        return DEFAULT_DIFF_RULES
+
+    from mysql_schema_model import COLUMN_PROPS, INDEX_PROPS, FOREIGN_KEY_PROPS, PARTITION_PROPS
+
+    with open(path) as _f:
+        config = json.load(_f, object_pairs_hook=OrderedDict)
+
+    known_props = {
+        'column'    : COLUMN_PROPS,
+        'index'     : INDEX_PROPS,
+        'foreignKey': FOREIGN_KEY_PROPS,
+        'partition' : PARTITION_PROPS,
+    }
+    for k, kind in IGNORE_PROPS_RULES.items():
+        for prop in config.get(k) or []:
+            if prop not in known_props[kind]:
+                raise Exception('Unknown {} prop in `{}`: `{}`'.format(kind, k, prop))
+
+    for k in ('equivalences', 'normalizers'):
+        for rule in config.get(k) or []:
+            for prop in rule.get('props') or []:
+                if prop not in COLUMN_PROPS:
+                    raise Exception('Unknown column prop in `{}`: `{}`'.format(k, prop))
+
+    return DiffRules(config)
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import time
+import pickle
+import threading
+import hashlib
+
+from collections import OrderedDict
+from mysql_schema_model import COLUMN_PROPS, Column
+
+SNAPSHOT_FORMAT  = 'mysql-schema-diff-snapshot'
+SNAPSHOT_VERSION = 4
+SNAPSHOT_EXT     = '.snapshot'
+
+DEFAULT_CACHE_DIR      = os.path.join(os.path.expanduser('~'), '.cache', 'mysql-schema-diff')
+DEFAULT_CACHE_MAX_AGE  = 7 * 24 * 3600     # 秒
+DEFAULT_CACHE_MAX_SIZE = 200 * 1024 * 1024 # 字节
+
+# 快照中允许出现的类型，其余均为 pickle 内置支持的基本类型（dict、list、tuple、str、bytes、int、float、None）
+SNAPSHOT_ALLOWED_GLOBALS = {
+    ('collections', 'OrderedDict'): OrderedDict,
+}
+
+class SnapshotError(Exception):
+    pass
+
+class SnapshotUnpickler(pickle.Unpickler):
+    '''
+    只允许还原`SNAPSHOT_ALLOWED_GLOBALS`中类型的`Unpickler`
+    快照文件可能来自其他机器（如：CI 产物），直接`pickle.load`会执行其中任意的可调用对象
+    '''
+    def find_class(self, module, name):
+        cls = SNAPSHOT_ALLOWED_GLOBALS.get((module, name))
+        if cls is None:
+            raise pickle.UnpicklingError('Global `{}.{}` is not allowed in snapshot files'.format(module, name))
+
+        return cls
+
+def loads_snapshot_data(data):
+    return SnapshotUnpickler(io.BytesIO(data)).load()
+
+class SnapshotTable(dict):
+    '''
+    快照中的表，各列在首次访问`table['columns']`时才反序列化
+    对比时结构一致的表只需比较指纹，无需还原各列
+    '''
+    __slots__ = ('columns_blob', )
+
+    def __init__(self, table_info, columns_blob):
+        super(SnapshotTable, self).__init__(table_info)
+        self.columns_blob = columns_blob
+
+    def __missing__(self, key):
+        if key != 'columns' or self.columns_blob is None:
+            raise KeyError(key)
+
+        columns = {}
+        for column_name, values, fingerprint in loads_snapshot_data(self.columns_blob):
+            columns[column_name] = Column.from_values(values, fingerprint)
+
+        self['columns']   = columns
+        self.columns_blob = None
+        return columns
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+def dump_columns_blob(table):
+    if isinstance(table, SnapshotTable) and table.columns_blob is not None:
+        # 未还原的列，直接沿用
+        return table.columns_blob
+
+    columns = []
+    for column_name, column in table['columns'].items():
+        values = tuple(column[p] for p in COLUMN_PROPS)
+        columns.append((column_name, values, column.get('fingerprint')))
+
+    return pickle.dumps(columns, protocol=pickle.HIGHEST_PROTOCOL)
+
+def dump_snapshot(mysql_schemas, path, meta=None):
+    '''
+    将数据库结构保存为快照文件
+    使用 pickle 二进制格式，每个表的各列单独序列化为一个二进制块，加载快照时只需还原表级别的信息
+    '''
+    tables = []
+    for table_name, table in mysql_schemas.items():
+        table_info = dict((k, v) for k, v in table.items() if k != 'columns')
+        tables.append((table_name, table_info, dump_columns_blob(table)))
+
+    snapshot = {
+        'format'     : SNAPSHOT_FORMAT,
+        'version'    : SNAPSHOT_VERSION,
+        'meta'       : meta or {},
+        'columnProps': list(COLUMN_PROPS),
+        'tables'     : tables,
+    }
+
+    # 先写入临时文件再替换，避免并发读取到不完整的快照
+    # 同一进程中可能有多个线程同时写入同一快照（如：基准、目标数据库相同），临时文件按进程、线程区分
+    tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+    with open(tmp_path, 'wb') as _f:
+        pickle.dump(snapshot, _f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    os.replace(tmp_path, path)
+
+def load_snapshot(path):
+    '''
+    读取快照文件
+    返回 (<数据库结构>, <元数据>)
+    '''
+    with open(path, 'rb') as _f:
+        try:
+            snapshot = SnapshotUnpickler(_f).load()
+        except Exception as e:
+            raise SnapshotError('Invalid snapshot file `{}`: {}'.format(path, e))
+
+    if not isinstance(snapshot, dict) or snapshot.get('format') != SNAPSHOT_FORMAT:
+        raise SnapshotError('Not a snapshot file: `{}`'.format(path))
+
+    if snapshot.get('version') != SNAPSHOT_VERSION or snapshot.get('columnProps') != list(COLUMN_PROPS):
+        raise SnapshotError('Incompatible snapshot file: `{}`'.format(path))
+
+    mysql_schemas = OrderedDict()
+    for table_name, table_info, columns_blob in snapshot['tables']:
+        mysql_schemas[table_name] = SnapshotTable(table_info, columns_blob)
+
+    return mysql_schemas, snapshot['meta']
+
+def is_snapshot_path(s):
+    return s.endswith(SNAPSHOT_EXT) or os.path.isfile(s)
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except EnvironmentError:
+        # 可能已被其他进程删除
+        pass
+
+def get_schema_probe(db):
+    '''
+    获取用于判断数据库结构是否变化的探测值
+    只汇总表、列、索引、视图、外键、分区的元数据校验和，不包含 UPDATE_TIME（写入数据也会改变该值）
+    '''
+    sql = '''
+        SELECT
+            (SELECT COUNT(*)
+                FROM information_schema.TABLES
+                WHERE TABLE_SCHEMA = ?) AS tableCount,
+            (SELECT MAX(CREATE_TIME)
+                FROM information_schema.TABLES
+                WHERE TABLE_SCHEMA = ?) AS maxCreateTime,
+            (SELECT SUM(CRC32(CONCAT_WS('|', TABLE_NAME, TABLE_TYPE, ENGINE, CREATE_TIME, TABLE_COLLATION, CREATE_OPTIONS, TABLE_COMMENT)))
+                FROM information_schema.TABLES
+                WHERE TABLE_SCHEMA = ?) AS tableChecksum,
+            (SELECT SUM(CRC32(CONCAT_WS('|', TABLE_NAME, COLUMN_NAME, ORDINAL_POSITION, COLUMN_DEFAULT, IS_NULLABLE, COLUMN_TYPE, COLLATION_NAME, COLUMN_KEY, EXTRA, COLUMN_COMMENT)))
+                FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = ?) AS columnChecksum,
+            (SELECT SUM(CRC32(CONCAT_WS('|', TABLE_NAME, INDEX_NAME, NON_UNIQUE, SEQ_IN_INDEX, COLUMN_NAME, SUB_PART, INDEX_TYPE)))
+                FROM information_schema.STATISTICS
+                WHERE TABLE_SCHEMA = ?) AS indexChecksum,
+            (SELECT SUM(CRC32(CONCAT_WS('|', TABLE_NAME, VIEW_DEFINITION, CHECK_OPTION, SECURITY_TYPE)))
+                FROM information_schema.VIEWS
+                WHERE TABLE_SCHEMA = ?) AS viewChecksum,
+            (SELECT SUM(CRC32(CONCAT_WS('|', TABLE_NAME, CONSTRAINT_NAME, UPDATE_RULE, DELETE_RULE, REFERENCED_TABLE_NAME)))
+                FROM information_schema.REFERENTIAL_CONSTRAINTS
+                WHERE CONSTRAINT_SCHEMA = ?) AS foreignKeyChecksum,
+            (SELECT SUM(CRC32(CONCAT_WS('|', TABLE_NAME, PARTITION_NAME, SUBPARTITION_NAME, PARTITION_METHOD, PARTITION_EXPRESSION, PARTITION_DESCRIPTION)))
+                FROM information_schema.PARTITIONS
+                WHERE TABLE_SCHEMA = ? AND PARTITION_NAME IS NOT NULL) AS partitionChecksum
+        '''
+    sql_params = [db.config['database']] * 8
+    db_ret = db.query(sql, sql_params)
+
+    probe = db_ret[0]
+    return [str(probe[k]) for k in ('tableCount', 'maxCreateTime', 'tableChecksum', 'columnChecksum', 'indexChecksum', 'viewChecksum', 'foreignKeyChecksum', 'partitionChecksum')]
+
+class SnapshotCache(object):
+    '''
+    本地数据库结构快照缓存，按 host/port/database 区分
+    '''
+    def __init__(self, cache_dir=None, max_age=None, max_size=None, refresh=False):
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.max_age   = DEFAULT_CACHE_MAX_AGE  if max_age  is None else max_age
+        self.max_size  = DEFAULT_CACHE_MAX_SIZE if max_size is None else max_size
+        self.refresh   = refresh
+
+    def get_cache_path(self, db, cache_scope=None):
+        key = '{}:{}/{}|{}'.format(
+                db.config.get('host') or '127.0.0.1',
+                db.config.get('port') or 3306,
+                db.config.get('database'),
+                cache_scope or '')
+        key = hashlib.md5(key.encode('utf-8')).hexdigest()
+
+        return os.path.join(self.cache_dir, key + SNAPSHOT_EXT)
+
+    def get_mysql_schema(self, db, extract_func, cache_scope=None):
+        '''
+        优先使用未过期的快照，探测值变化时才重新获取
+        `extract_func(db)`用于实际获取数据库结构，`cache_scope`用于区分不同获取方式的快照
+        返回 (<数据库结构>, <是否命中缓存>)
+        '''
+        path = self.get_cache_path(db, cache_scope)
+
+        # 在获取结构前探测，获取期间发生的变化会在下次运行时被发现
+        probe = get_schema_probe(db)
+
+        if not self.refresh and os.path.exists(path):
+            try:
+                mysql_schemas, meta = load_snapshot(path)
+
+            except (SnapshotError, EnvironmentError):
+                pass
+
+            else:
+                if meta.get('probe') == probe and time.time() - meta.get('createTime', 0) < self.max_age:
+                    return mysql_schemas, True
+
+        mysql_schemas = extract_func(db)
+
+        # 多个线程（如：并发获取基准、目标数据库，批量对比）可能同时创建
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        meta = {
+            'host'      : db.config.get('host'),
+            'port'      : db.config.get('port'),
+            'database'  : db.config.get('database'),
+            'probe'     : probe,
+            'createTime': time.time(),
+        }
+        dump_snapshot(mysql_schemas, path, meta)
+
+        self.evict()
+
+        return mysql_schemas, False
+
+    def evict(self):
+        '''
+        删除过期快照，并在总大小超出限制时从最旧的快照开始删除
+        '''
+        if not os.path.isdir(self.cache_dir):
+            return
+
+        now = time.time()
+
+        snapshots = []
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith(SNAPSHOT_EXT):
+                continue
+
+            path = os.path.join(self.cache_dir, file_name)
+            try:
+                stat = os.stat(path)
+            except EnvironmentError:
+                continue
+
+            if now - stat.st_mtime > self.max_age:
+                remove_file(path)
+                continue
+
+            snapshots.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(s[1] for s in snapshots)
+        for mtime, size, path in sorted(snapshots):
+            if total_size <= self.max_size:
+                break
+
+            remove_file(path)
+            total_size -= size
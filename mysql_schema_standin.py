@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+import re
+import struct
+import asyncio
+import threading
+
+# 服务器能力标志：CLIENT_LONG_PASSWORD | CLIENT_CONNECT_WITH_DB | CLIENT_PROTOCOL_41 | CLIENT_TRANSACTIONS
+#               | CLIENT_SECURE_CONNECTION | CLIENT_MULTI_RESULTS | CLIENT_PLUGIN_AUTH
+STANDIN_CAPABILITIES = 0x00000001 | 0x00000008 | 0x00000200 | 0x00002000 | 0x00008000 | 0x00020000 | 0x00080000
+
+STANDIN_SERVER_VERSION = '5.7.99-standin'
+
+COM_QUIT  = 0x01
+COM_QUERY = 0x03
+
+# 字段类型及字符集
+FIELD_TYPE_LONGLONG   = 8
+FIELD_TYPE_VAR_STRING = 253
+CHARSET_BINARY        = 63
+CHARSET_UTF8MB4       = 45
+
+SERVER_STATUS_AUTOCOMMIT = 0x0002
+
+# 需要返回结果集的语句，其余语句（`SET`、`COMMIT`、`ROLLBACK`等）直接返回 OK
+RESULTSET_SQL_RE = re.compile(r'^\s*(?:SELECT|SHOW)\b', re.I)
+OK_SQL_RE        = re.compile(r'^\s*(?:SET|COMMIT|ROLLBACK|BEGIN|START\s+TRANSACTION)\b', re.I)
+
+def pack_lenenc_int(n):
+    if n < 251:
+        return struct.pack('<B', n)
+    if n < 2 ** 16:
+        return b'\xfc' + struct.pack('<H', n)
+    if n < 2 ** 24:
+        return b'\xfd' + struct.pack('<I', n)[:3]
+
+    return b'\xfe' + struct.pack('<Q', n)
+
+def pack_lenenc_str(s):
+    if not isinstance(s, bytes):
+        s = str(s).encode('utf-8')
+
+    return pack_lenenc_int(len(s)) + s
+
+class StandInConnection(object):
+    '''
+    单个客户端连接，只实现文本协议中获取结构所需的部分：握手（接受任意用户名密码）、COM_QUERY、COM_QUIT
+    '''
+    def __init__(self, server, reader, writer):
+        self.server   = server
+        self.reader   = reader
+        self.writer   = writer
+        self.sequence = 0
+
+    def send_packet(self, payload):
+        self.writer.write(struct.pack('<I', len(payload))[:3] + struct.pack('<B', self.sequence & 0xff) + payload)
+        self.sequence += 1
+
+    async def recv_packet(self):
+        header = await self.reader.readexactly(4)
+        self.sequence = header[3] + 1
+
+        size = header[0] | header[1] << 8 | header[2] << 16
+        return await self.reader.readexactly(size)
+
+    def send_handshake(self):
+        salt = b'0123456789abcdefghij'
+        self.send_packet(b''.join([
+            b'\x0a',
+            STANDIN_SERVER_VERSION.encode('utf-8') + b'\x00',
+            struct.pack('<I', 1),
+            salt[:8] + b'\x00',
+            struct.pack('<H', STANDIN_CAPABILITIES & 0xffff),
+            struct.pack('<B', CHARSET_UTF8MB4),
+            struct.pack('<H', SERVER_STATUS_AUTOCOMMIT),
+            struct.pack('<H', STANDIN_CAPABILITIES >> 16),
+            struct.pack('<B', len(salt) + 1),
+            b'\x00' * 10,
+            salt[8:] + b'\x00',
+            b'mysql_native_password\x00',
+        ]))
+
+    def send_ok(self):
+        self.send_packet(b'\x00\x00\x00' + struct.pack('<HH', SERVER_STATUS_AUTOCOMMIT, 0))
+
+    def send_eof(self):
+        self.send_packet(b'\xfe' + struct.pack('<HH', 0, SERVER_STATUS_AUTOCOMMIT))
+
+    def send_error(self, code, message):
+        self.send_packet(b'\xff' + struct.pack('<H', code) + b'#HY000' + message.encode('utf-8'))
+
+    def send_resultset(self, rows):
+        # 空结果集也需要至少一个字段
+        fields = list(rows[0].keys()) if rows else ['_']
+
+        self.send_packet(pack_lenenc_int(len(fields)))
+        for field in fields:
+            values = [r[field] for r in rows if r[field] is not None]
+            is_int = bool(values) and all(isinstance(v, int) for v in values)
+
+            field_type = FIELD_TYPE_LONGLONG if is_int else FIELD_TYPE_VAR_STRING
+            charset    = CHARSET_BINARY      if is_int else CHARSET_UTF8MB4
+            self.send_packet(b''.join([
+                pack_lenenc_str('def'), pack_lenenc_str(''), pack_lenenc_str(''), pack_lenenc_str(''),
+                pack_lenenc_str(field), pack_lenenc_str(field),
+                b'\x0c', struct.pack('<HIBHB', charset, 1024, field_type, 0, 0), b'\x00\x00',
+            ]))
+
+        self.send_eof()
+
+        for r in rows:
+            self.send_packet(b''.join(b'\xfb' if r[f] is None else pack_lenenc_str(r[f]) for f in fields))
+
+        self.send_eof()
+
+    async def handle_query(self, sql):
+        if OK_SQL_RE.match(sql):
+            self.send_ok()
+            return
+
+        if not RESULTSET_SQL_RE.match(sql):
+            self.send_error(1064, 'Unsupported statement in stand-in server')
+            return
+
+        if self.server.latency:
+            await asyncio.sleep(self.server.latency)
+
+        try:
+            rows = list(self.server.db.get_rows(sql))
+
+        except Exception as e:
+            self.send_error(1105, str(e))
+
+        else:
+            self.send_resultset(rows)
+
+    async def run(self):
+        try:
+            self.send_handshake()
+            await self.writer.drain()
+
+            # 握手响应，不校验用户名密码
+            await self.recv_packet()
+            self.send_ok()
+            await self.writer.drain()
+
+            while True:
+                packet = await self.recv_packet()
+
+                command = packet[0]
+                if command == COM_QUIT:
+                    break
+
+                if command == COM_QUERY:
+                    await self.handle_query(packet[1:].decode('utf-8'))
+                else:
+                    self.send_ok()
+
+                await self.writer.drain()
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+        finally:
+            self.writer.close()
+
+class StandInMySQLServer(object):
+    '''
+    使用 MySQL 文本协议回放`ReplayDB`/`SyntheticDB`查询结果的本地模拟服务器
+    可通过`MySQLHelper`、`AsyncMySQLHelper`（PyMySQL/aiomysql）连接，在没有 MySQL 服务器时测试完整的连接池、流式读取、事务及错误处理
+    事件循环在单独的线程中运行，`latency`为每次查询模拟的网络延迟（秒），不阻塞其他连接
+    '''
+    def __init__(self, db, latency=0, host='127.0.0.1', port=0):
+        self.db      = db
+        self.latency = latency
+        self.host    = host
+        self.port    = port
+
+        self.loop   = None
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        '''
+        启动服务器，返回实际监听的端口
+        '''
+        self.loop = asyncio.new_event_loop()
+
+        async def _handle(reader, writer):
+            await StandInConnection(self, reader, writer).run()
+
+        self.server = self.loop.run_until_complete(asyncio.start_server(_handle, self.host, self.port))
+        self.port   = self.server.sockets[0].getsockname()[1]
+
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        return self.port
+
+    def get_config(self, database):
+        return {
+            'host'    : self.host,
+            'port'    : self.port,
+            'user'    : 'standin',
+            'password': 'standin',
+            'database': database,
+        }
+
+    def close(self):
+        if self.loop is None:
+            return
+
+        async def _close():
+            self.server.close()
+            await self.server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(_close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+        self.loop = None
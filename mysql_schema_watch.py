@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+import json
+
+from collections import OrderedDict
+from mysql_schema_diff import COLOR_RED, COLOR_GREEN, COLOR_YELLOW, COLOR_RESET, \
+        get_mysql_schema, load_mysql_schema, compare_table, compare_schema, print_schema_diff, open_schema_source
+from mysql_schema_checksum import get_table_checksums, get_changed_table_names, get_changed_table_filter
+
+# 默认检查间隔（秒）
+DEFAULT_WATCH_INTERVAL = 60
+
+class WatchedSchema(object):
+    '''
+    保存在内存中的数据库结构，每次检查时只重新获取校验和变化的表
+    快照文件不会变化，只在创建时读取一次
+    '''
+    def __init__(self, db, fetch_workers=None, extract_mode=None, table_filter=None):
+        self.db            = db
+        self.fetch_workers = fetch_workers
+        self.extract_mode  = extract_mode
+        self.table_filter  = table_filter
+
+        # 先计算校验和再获取结构，获取期间发生的变化会在下次检查时被发现
+        self.checksums = None
+        if not self.is_snapshot():
+            self.checksums = get_table_checksums(db, table_filter)
+
+        self.schema = load_mysql_schema(db, fetch_workers, extract_mode, None, table_filter)
+
+    def is_snapshot(self):
+        return isinstance(self.db, str)
+
+    def refresh(self):
+        '''
+        重新计算校验和，并只重新获取变化的表
+        返回变化的表名列表
+        '''
+        if self.is_snapshot():
+            return []
+
+        checksums = get_table_checksums(self.db, self.table_filter)
+
+        changed_table_names = get_changed_table_names(self.checksums, checksums)
+        if changed_table_names:
+            changed_table_filter = get_changed_table_filter(changed_table_names)
+            changed_schema = get_mysql_schema(self.db, self.fetch_workers, self.extract_mode, changed_table_filter)
+
+            for table_name in changed_table_names:
+                if table_name in changed_schema:
+                    self.schema[table_name] = changed_schema[table_name]
+                else:
+                    self.schema.pop(table_name, None)
+
+        self.checksums = checksums
+        return changed_table_names
+
+def get_drift_event(prev_table_diff, table_diff):
+    '''
+    根据表的前后差异判断漂移事件类型，无变化时返回 None
+        drift   : 出现新的差异
+        resolved: 差异已消除
+        changed : 差异内容发生变化
+    '''
+    if prev_table_diff is None and table_diff is None:
+        return None
+
+    elif prev_table_diff is None:
+        return 'drift'
+
+    elif table_diff is None:
+        return 'resolved'
+
+    elif prev_table_diff != table_diff:
+        return 'changed'
+
+    return None
+
+def iter_drift_events(base, target, schema_diff, changed_table_names, rules=None):
+    '''
+    只重新对比变化的表，并逐个返回 (<事件类型>, <tableName>, <表差异>)
+    `schema_diff`会被同步更新为最新的差异
+    '''
+    for table_name in changed_table_names:
+        if rules is not None and rules.is_ignored_table(table_name):
+            continue
+
+        table_diff = compare_table(base.schema.get(table_name), target.schema.get(table_name), rules)
+        event = get_drift_event(schema_diff.get(table_name), table_diff)
+
+        if table_diff is None:
+            schema_diff.pop(table_name, None)
+        else:
+            schema_diff[table_name] = table_diff
+
+        if event:
+            yield event, table_name, table_diff
+
+def print_drift_event(event, table_name, table_diff, no_color=False):
+    now = time.strftime('%Y-%m-%d %H:%M:%S')
+
+    if event == 'drift':
+        line = '[{}] 表`{}`出现差异'.format(now, table_name)
+        color = COLOR_RED
+    elif event == 'resolved':
+        line = '[{}] 表`{}`的差异已消除'.format(now, table_name)
+        color = COLOR_GREEN
+    else:
+        line = '[{}] 表`{}`的差异发生变化'.format(now, table_name)
+        color = COLOR_YELLOW
+
+    if no_color is False:
+        line = color + line + COLOR_RESET
+
+    print(line)
+    if table_diff is not None:
+        print_schema_diff(OrderedDict([(table_name, table_diff)]), no_color)
+
+    sys.stdout.flush()
+
+def write_drift_event_jsonl(event, table_name, table_diff, fp):
+    from mysql_schema_output import iter_diff_records, convert_plain_value
+
+    record = {
+        'time'   : time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'event'  : event,
+        'table'  : table_name,
+        'records': list(iter_diff_records([(table_name, table_diff)])) if table_diff is not None else [],
+    }
+    line = json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=convert_plain_value)
+    fp.write(line.encode('utf-8'))
+    fp.write(b'\n')
+    fp.flush()
+
+def watch_main(args, options, fetch_workers=None, extract_mode=None, table_filter=None, output_stream=None, rules=None):
+    '''
+    持续监控目标数据库相对于基准数据库的结构漂移：
+        python mysql_schema_diff.py watch <基准数据库> <目标数据库> [--interval=60]
+    每次检查只计算各表的校验和，重新获取并对比校验和变化的表，差异出现、变化、消除时输出事件
+    '''
+    no_color_option   = options.get('no-color') is True
+    interval_option   = float(options.get('interval') or DEFAULT_WATCH_INTERVAL)
+    max_rounds_option = int(options.get('max-rounds') or 0)
+
+    db_base,  db_base_label   = open_schema_source(args[0], fetch_workers)
+    db_target, db_target_label = open_schema_source(args[1], fetch_workers)
+
+    print('基准数据库:', db_base_label)
+    print('目标数据库:', db_target_label)
+
+    def _emit(event, table_name, table_diff):
+        if output_stream:
+            write_drift_event_jsonl(event, table_name, table_diff, output_stream)
+        else:
+            print_drift_event(event, table_name, table_diff, no_color_option)
+
+    start_time = time.time()
+    base   = WatchedSchema(db_base,   fetch_workers, extract_mode, table_filter)
+    target = WatchedSchema(db_target, fetch_workers, extract_mode, table_filter)
+
+    schema_diff = compare_schema(base.schema, target.schema, rules)
+    print('初始结构获取耗时: {:.3f} 秒，存在差异的表: {} 个'.format(time.time() - start_time, len(schema_diff)))
+
+    for table_name, table_diff in schema_diff.items():
+        _emit('drift', table_name, table_diff)
+
+    # 已重新获取但尚未重新对比的表（另一侧检查失败时保留至下次检查）
+    changed_table_names = set()
+
+    rounds = 0
+    try:
+        while not max_rounds_option or rounds < max_rounds_option:
+            time.sleep(interval_option)
+            rounds += 1
+
+            try:
+                changed_table_names.update(base.refresh())
+                changed_table_names.update(target.refresh())
+
+            except Exception as e:
+                # 连接中断等错误不退出，下次检查时重试
+                print('[{}] 检查失败: {}: {}'.format(time.strftime('%Y-%m-%d %H:%M:%S'), type(e).__name__, e))
+                continue
+
+            for event, table_name, table_diff in iter_drift_events(base, target, schema_diff, sorted(changed_table_names), rules):
+                _emit(event, table_name, table_diff)
+
+            changed_table_names.clear()
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        for db in (db_base, db_target):
+            if not isinstance(db, str):
+                db.close()
+
+        if output_stream:
+            output_stream.close()